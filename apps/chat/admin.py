@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Conversation, ConversationParticipant, Message, FileMessage, StickerPack, Sticker, Invite, VoiceRoom, Bot, BotCommand, BotParticipant, Server, ServerMember, Channel
+from .models import Conversation, ConversationParticipant, Message, FileMessage, ArchiveSegment, StickerPack, Sticker, Invite, VoiceRoom, Bot, BotCommand, BotParticipant, Server, ServerMember, Channel
 
 class ConversationParticipantInline(admin.TabularInline):
     model = ConversationParticipant
@@ -12,13 +12,17 @@ class ConversationAdmin(admin.ModelAdmin):
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
-    list_display = ('id', 'conversation', 'sender', 'timestamp', 'is_read', 'deleted')
-    list_filter = ('is_read', 'deleted')
+    list_display = ('id', 'conversation', 'sender', 'timestamp', 'deleted')
+    list_filter = ('deleted',)
 
 @admin.register(FileMessage)
 class FileMessageAdmin(admin.ModelAdmin):
     list_display = ('id', 'message', 'filename', 'file_size')
 
+@admin.register(ArchiveSegment)
+class ArchiveSegmentAdmin(admin.ModelAdmin):
+    list_display = ('id', 'conversation', 'first_timestamp', 'last_timestamp', 'count', 'size')
+
 @admin.register(StickerPack)
 class StickerPackAdmin(admin.ModelAdmin):
     list_display = ('name', 'author', 'created_at', 'is_official')
@@ -0,0 +1,245 @@
+import gzip
+import heapq
+import json
+import time
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from apps.core.lru import LocalLRU
+from apps.users.models import User
+from .models import ArchiveSegment, FileMessage, Message, PinnedMessage, Sticker
+
+# Холодный архив истории. Сообщения старше горизонта чата
+# (Conversation.archive_after_days или CHAT_ARCHIVE_AFTER_DAYS) команда
+# archive_messages переносит пачками в сжатые NDJSON-файлы — по файлу
+# (ArchiveSegment) на пачку — и удаляет из Message. Каждая пачка — отдельная
+# короткая транзакция, блокируются только её строки.
+#
+# В Message остаются: сообщения с файлами (на них ссылаются FileMessage,
+# file_list и скачивание), закреплённые и Conversation.last_message.
+# Удалённые (deleted=True) в архив не пишутся, просто удаляются.
+#
+# history.fetch_page читает сегменты, только когда страница уходит старше
+# горячих строк: архивные сообщения отдаются в той же форме и с тем же
+# курсором. Архив только для чтения — правка, удаление и поиск работают
+# по горячей таблице.
+
+FIELDS = ('id', 'sender_id', 'content', 'sticker_id', 'timestamp', 'edited_at')
+# Сегменты неизменяемы: разобранные держим в LRU процесса
+SEGMENT_CACHE_TTL = 3600
+SEGMENT_SCAN_BATCH = 8
+
+archive_storage = FileSystemStorage(location=settings.CHAT_ARCHIVE_ROOT)
+
+_segments = LocalLRU(settings.CHAT_ARCHIVE_CACHE_SEGMENTS, SEGMENT_CACHE_TTL)
+
+def message_key(message):
+    return message.timestamp, message.id
+
+def item_key(item):
+    # Ключ и для Message, и для архивной записи
+    if isinstance(item, dict):
+        return item['timestamp'], item['id']
+    return message_key(item)
+
+# --- Запись ---
+
+def horizon_for(conversation, now=None):
+    # Граница архива чата или None, если чат не архивируется
+    days = conversation.archive_after_days
+    if days is None:
+        days = settings.CHAT_ARCHIVE_AFTER_DAYS
+    if not days:
+        return None
+    return (now or timezone.now()) - timedelta(days=days)
+
+def encode_row(row):
+    return json.dumps({
+        'id': row['id'],
+        'sender_id': row['sender_id'],
+        'content': row['content'],
+        'sticker_id': row['sticker_id'],
+        'timestamp': row['timestamp'].isoformat(),
+        'edited_at': row['edited_at'].isoformat() if row['edited_at'] else None,
+    }, ensure_ascii=False, separators=(',', ':'))
+
+def write_segment(conversation_id, rows):
+    # rows — по возрастанию (timestamp, id); возвращает (имя файла, размер)
+    data = gzip.compress(('\n'.join(encode_row(row) for row in rows) + '\n').encode())
+    name = archive_storage.save(
+        f'{conversation_id}/{rows[0]["id"]}-{rows[-1]["id"]}.ndjson.gz', ContentFile(data)
+    )
+    return name, len(data)
+
+def candidates(conversation):
+    qs = Message.objects.filter(conversation_id=conversation.id).exclude(
+        id__in=FileMessage.objects.filter(message__conversation_id=conversation.id).values('message_id')
+    ).exclude(
+        id__in=PinnedMessage.objects.filter(conversation_id=conversation.id).values('message_id')
+    )
+    if conversation.last_message_id:
+        qs = qs.exclude(id=conversation.last_message_id)
+    return qs
+
+def archive_batch(conversation, horizon, batch_size):
+    # Одна пачка: возвращает (выбрано, перенесено в архив, удалено всего)
+    name = None
+    try:
+        with transaction.atomic():
+            rows = list(
+                candidates(conversation).filter(timestamp__lt=horizon)
+                .order_by('timestamp', 'id').select_for_update()
+                .values(*FIELDS, 'deleted')[:batch_size]
+            )
+            fetched = len(rows)
+            if not rows:
+                return 0, 0, 0
+            # Закрепление могло появиться между выборкой и блокировкой — такие строки не трогаем
+            pinned = set(PinnedMessage.objects.filter(
+                message_id__in=[row['id'] for row in rows]
+            ).values_list('message_id', flat=True))
+            rows = [row for row in rows if row['id'] not in pinned]
+            kept = [row for row in rows if not row['deleted']]
+            if kept:
+                name, size = write_segment(conversation.id, kept)
+                ArchiveSegment.objects.create(
+                    conversation_id=conversation.id,
+                    name=name,
+                    first_timestamp=kept[0]['timestamp'],
+                    first_id=kept[0]['id'],
+                    last_timestamp=kept[-1]['timestamp'],
+                    last_id=kept[-1]['id'],
+                    count=len(kept),
+                    size=size,
+                )
+            Message.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    except Exception:
+        if name:
+            archive_storage.delete(name)
+        raise
+    return fetched, len(kept), len(rows)
+
+def archive_conversation(conversation, horizon, batch_size, pause=0):
+    # Возвращает (перенесено в архив, удалено всего)
+    archived = removed = 0
+    while True:
+        fetched, batch_archived, batch_removed = archive_batch(conversation, horizon, batch_size)
+        archived += batch_archived
+        removed += batch_removed
+        if fetched < batch_size:
+            return archived, removed
+        if pause:
+            time.sleep(pause)
+
+# --- Чтение ---
+
+def parse_line(line):
+    entry = json.loads(line)
+    entry['timestamp'] = datetime.fromisoformat(entry['timestamp'])
+    if entry['edited_at']:
+        entry['edited_at'] = datetime.fromisoformat(entry['edited_at'])
+    return entry
+
+def load_segment(name):
+    # Записи сегмента по возрастанию (timestamp, id)
+    with archive_storage.open(name, 'rb') as f:
+        text = gzip.decompress(f.read()).decode()
+    return [parse_line(line) for line in text.splitlines() if line]
+
+def read_segment(name):
+    entries = _segments.get(name)
+    if entries is None:
+        entries = load_segment(name)
+        _segments.set(name, entries)
+    return entries
+
+def segments_before(conversation_id, before_key=None):
+    # Сегменты, где есть сообщения строго старше before_key, по убыванию конца.
+    # Сегменты могут перекрываться (закреплённое сообщение, уехавшее в архив позже)
+    qs = ArchiveSegment.objects.filter(conversation_id=conversation_id)
+    if before_key:
+        ts, message_id = before_key
+        qs = qs.filter(Q(first_timestamp__lt=ts) | Q(first_timestamp=ts, first_id__lt=message_id))
+    qs = qs.order_by('-last_timestamp', '-last_id').values_list('name', 'last_timestamp', 'last_id')
+    offset = 0
+    while True:
+        batch = list(qs[offset:offset + SEGMENT_SCAN_BATCH])
+        yield from batch
+        if len(batch) < SEGMENT_SCAN_BATCH:
+            return
+        offset += len(batch)
+
+def merge_page(conversation_id, rows, before_key, count):
+    # rows — горячие сообщения по убыванию ключа (не больше count); дополняет
+    # их архивными, пока в архиве может найтись что-то новее count-го ключа
+    merged = [(message_key(m), m) for m in rows]
+    for name, last_timestamp, last_id in segments_before(conversation_id, before_key):
+        if len(merged) >= count and merged[count - 1][0] > (last_timestamp, last_id):
+            break
+        for entry in read_segment(name):
+            key = (entry['timestamp'], entry['id'])
+            if before_key is None or key < before_key:
+                merged.append((key, entry))
+        merged.sort(key=lambda item: item[0], reverse=True)
+        del merged[count:]
+    return resolve(conversation_id, [item for _, item in merged])
+
+def iter_entries(conversation_id, after_key=None):
+    # Все архивные записи чата строго после after_key по возрастанию ключа.
+    # В памяти только сегменты, перекрывающие текущую позицию (обычно один);
+    # кэш чтения истории не засоряется
+    qs = ArchiveSegment.objects.filter(conversation_id=conversation_id)
+    if after_key:
+        ts, message_id = after_key
+        qs = qs.filter(Q(last_timestamp__gt=ts) | Q(last_timestamp=ts, last_id__gt=message_id))
+    segments = iter(qs.order_by('first_timestamp', 'first_id').values_list(
+        'name', 'first_timestamp', 'first_id'
+    ).iterator())
+    heap = []
+    pending = next(segments, None)
+    while heap or pending:
+        # Сегмент открывается, только когда до его начала дошла очередь
+        while pending and (not heap or (pending[1], pending[2]) <= heap[0][0]):
+            entries = iter([e for e in load_segment(pending[0])
+                            if after_key is None or (e['timestamp'], e['id']) > after_key])
+            entry = next(entries, None)
+            if entry is not None:
+                heapq.heappush(heap, (item_key(entry), id(entries), entry, entries))
+            pending = next(segments, None)
+        _, _, entry, entries = heapq.heappop(heap)
+        yield entry
+        following = next(entries, None)
+        if following is not None:
+            heapq.heappush(heap, (item_key(following), id(entries), following, entries))
+
+def resolve(conversation_id, items):
+    # Архивные записи среди items заменяются экземплярами Message, порядок сохраняется
+    archived = [item for item in items if isinstance(item, dict)]
+    if not archived:
+        return items
+    built = iter(materialize(conversation_id, archived))
+    return [next(built) if isinstance(item, dict) else item for item in items]
+
+def materialize(conversation_id, entries):
+    # Несохраняемые экземпляры Message с отправителем и стикером, как после select_related
+    users = User.objects.in_bulk({e['sender_id'] for e in entries if e['sender_id']})
+    stickers = Sticker.objects.in_bulk({e['sticker_id'] for e in entries if e['sticker_id']})
+    messages = []
+    for entry in entries:
+        message = Message(
+            id=entry['id'],
+            conversation_id=conversation_id,
+            content=entry['content'],
+            timestamp=entry['timestamp'],
+            edited_at=entry['edited_at'],
+        )
+        message.sender = users.get(entry['sender_id'])
+        message.sticker = stickers.get(entry['sticker_id'])
+        # Сообщения с файлами не архивируются
+        Message.file.related.set_cached_value(message, None)
+        messages.append(message)
+    return messages
@@ -0,0 +1,68 @@
+from contextvars import ContextVar
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from apps.core.events import encode_event
+from .models import OutboxEvent
+
+# Рассылка в группы channel layer из представлений.
+#
+# Изменения данных с событием делаются синхронной функцией в transaction.atomic(),
+# событие отдаётся publish() внутри той же транзакции:
+# - CHAT_OUTBOX_ENABLED: строка OutboxEvent коммитится вместе с данными, рассылает
+#   её relay_outbox (outbox.py) — запрос не ждёт Redis;
+# - иначе group_send после коммита. Из async-представлений функцию вызывают через
+#   acommit(): рассылка тогда идёт в цикле событий, а не в потоке ORM.
+# События без изменений в БД (голосовые комнаты) шлются напрямую abroadcast().
+
+_pending = ContextVar('chat_pending_broadcasts', default=None)
+
+async def abroadcast(group, event):
+    await get_channel_layer().group_send(group, event)
+
+def broadcast(group, event):
+    async_to_sync(abroadcast)(group, event)
+
+def publish(group, event):
+    if settings.CHAT_OUTBOX_ENABLED:
+        OutboxEvent.objects.create(group=group, event=event)
+        return
+    pending = _pending.get()
+    if pending is not None:
+        transaction.on_commit(lambda: pending.append((group, event)))
+    else:
+        transaction.on_commit(lambda: broadcast(group, event))
+
+async def acommit(func, *args, **kwargs):
+    # Один переход в пул потоков на всю транзакцию
+    pending = []
+    token = _pending.set(pending)
+    try:
+        result = await sync_to_async(func)(*args, **kwargs)
+    finally:
+        _pending.reset(token)
+    for group, event in pending:
+        await abroadcast(group, event)
+    return result
+
+def chat_message_event(user, message, **extra):
+    return encode_event(
+        'chat_message',
+        conversation_id=message.conversation_id,
+        id=message.id,
+        sender_id=user.id,
+        sender_name=user.get_display_name(),
+        sender_avatar=user.avatar.thumbnail_url(settings.THUMBNAIL_AVATAR_SIZE),
+        timestamp=message.timestamp.isoformat(),
+        **extra,
+    )
+
+def file_message_event(user, message, file_msg):
+    return chat_message_event(
+        user, message,
+        content=f'📎 [{file_msg.filename}]({file_msg.file.url})',
+        file_url=file_msg.file.url,
+        thumbnail_url=file_msg.file.thumbnail_url(256),
+        filename=file_msg.filename,
+    )
@@ -1,133 +1,256 @@
+import asyncio
 import json
-import logging
-import traceback
+import uuid
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from .models import Conversation, Message, VoiceRoom
+from django.db import IntegrityError, transaction
+from apps.core.eventlog import EventLog
+from apps.core.events import encode_event, encode_frame
+from apps.users.consumers import PresenceMixin
+from .models import ConversationParticipant, Message, VoiceRoom
+from .membership import ais_member, afilter_member_conversations
+from .persistence import get_write_buffer
+from . import voice
+from .services import register_messages
 
-logger = logging.getLogger(__name__)
+log = EventLog(__name__)
 
 User = get_user_model()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatEventsMixin:
+    # Общая часть ChatConsumer (один чат на сокет) и EventsConsumer (много чатов
+    # на одном сокете): входящие кадры чата и пересылка событий групп chat_<id>.
+    # Все исходящие кадры несут conversation_id.
+
+    async def handle_chat_frame(self, conversation_id, data):
+        group_name = f'chat_{conversation_id}'
+        if data['type'] == 'message':
+            content = data['content']
+            uid = self.parse_uid(data.get('uid'))
+            payload = {
+                'conversation_id': conversation_id,
+                'uid': str(uid),
+                'sender_id': self.user.id,
+                'sender_name': self.user.get_display_name(),
+                'sender_avatar': self.user.avatar.thumbnail_url(settings.THUMBNAIL_AVATAR_SIZE),
+                'content': content,
+            }
+            if settings.CHAT_WRITE_BEHIND:
+                # Рассылаем сразу, запись в БД — пакетом (см. persistence.py)
+                pending = get_write_buffer().submit(uid, conversation_id, self.user.id, content)
+                payload.update(id=None, pending=True, timestamp=pending.timestamp.isoformat())
+            else:
+                message, created = await self.save_message(conversation_id, content, uid)
+                if not created:
+                    # Повтор уже сохранённого сообщения: подтверждаем только отправителю
+                    if message:
+                        await self.send(text_data=encode_frame(
+                            'message_saved', conversation_id=conversation_id, messages=[
+                                {'uid': str(uid), 'id': message.id, 'timestamp': message.timestamp.isoformat()}
+                            ]))
+                    return
+                payload.update(id=message.id, timestamp=message.timestamp.isoformat())
+            await self.channel_layer.group_send(group_name, encode_event('chat_message', **payload))
+            log.info('chat.message', conversation_id=conversation_id, user_id=self.user.id,
+                     pending=settings.CHAT_WRITE_BEHIND)
+        elif data['type'] == 'read':
+            message_id = self.parse_message_id(data.get('message_id'))
+            if message_id is None:
+                return
+            message_id = await self.mark_read(conversation_id, message_id)
+            if message_id:
+                await self.channel_layer.group_send(group_name, encode_event(
+                    'message_read',
+                    conversation_id=conversation_id,
+                    user_id=self.user.id,
+                    message_id=message_id,
+                ))
+
+    async def forward_event(self, event):
+        # Кадр уже закодирован отправителем (apps/core/events.py)
+        try:
+            await self.send(text_data=event['text'])
+        except Exception as e:
+            log.error('ws.forward_error', event_type=event['type'], error=repr(e))
+
+    chat_message = forward_event
+    message_saved = forward_event
+    message_failed = forward_event
+    edit_message = forward_event
+    delete_message = forward_event
+    pin_message = forward_event
+    unpin_message = forward_event
+    message_read = forward_event
+
+    @database_sync_to_async
+    def mark_read(self, conversation_id, message_id):
+        return ConversationParticipant.objects.mark_read(self.user.id, conversation_id, message_id)
+
+    @staticmethod
+    def parse_message_id(value):
+        # id сообщения из кадра клиента; None, если это не id
+        try:
+            message_id = int(value)
+        except (TypeError, ValueError):
+            return None
+        return message_id if 0 < message_id < 2 ** 63 else None
+
+    @staticmethod
+    def parse_uid(value):
+        try:
+            return uuid.UUID(str(value))
+        except ValueError:
+            return uuid.uuid4()
+
+    @database_sync_to_async
+    def save_message(self, conversation_id, content, uid):
+        # Повторная отправка с тем же uid не создаёт второе сообщение;
+        # счётчики обновляются в одной транзакции с сообщением
+        try:
+            with transaction.atomic():
+                msg = Message.objects.create(
+                    conversation_id=conversation_id,
+                    sender=self.user,
+                    content=content,
+                    uid=uid
+                )
+                register_messages(conversation_id, [msg])
+        except IntegrityError:
+            return Message.objects.filter(
+                uid=uid, sender=self.user, conversation_id=conversation_id
+            ).first(), False
+        return msg, True
+
+
+class ChatConsumer(ChatEventsMixin, AsyncWebsocketConsumer):
+    # Сокет одного чата (ws/chat/<id>/), остаётся для старых клиентов
     async def connect(self):
         self.user = self.scope['user']
-        self.conversation_id = self.scope['url_route']['kwargs']['conversation_id']
+        self.conversation_id = int(self.scope['url_route']['kwargs']['conversation_id'])
         self.room_group_name = f'chat_{self.conversation_id}'
 
-        logger.info(f"WebSocket connect attempt: user={self.user.id if not self.user.is_anonymous else 'anonymous'}, conversation_id={self.conversation_id}")
-
         if self.user.is_anonymous:
-            logger.warning("Anonymous user rejected")
+            log.warning('ws.reject', socket='chat', reason='anonymous')
             await self.close(code=4001)
             return
 
         try:
             if not await self.is_participant():
-                logger.warning(f"User {self.user.id} not participant of chat {self.conversation_id}")
+                log.warning('ws.reject', socket='chat', reason='not_member',
+                            user_id=self.user.id, conversation_id=self.conversation_id)
                 await self.close(code=4003)
                 return
 
             await self.channel_layer.group_add(self.room_group_name, self.channel_name)
             await self.accept()
-            logger.info(f"User {self.user.id} connected to chat {self.conversation_id}")
-        except Exception as e:
-            logger.error(f"Error in connect: {e}\n{traceback.format_exc()}")
+            log.info('ws.connect', socket='chat', user_id=self.user.id, conversation_id=self.conversation_id)
+        except Exception:
+            log.error('ws.connect_error', exc_info=True, socket='chat', conversation_id=self.conversation_id)
             await self.close(code=1011)
 
     async def disconnect(self, close_code):
-        logger.info(f"User {self.user.id if hasattr(self, 'user') else 'unknown'} disconnected from chat {getattr(self, 'conversation_id', 'unknown')} with code {close_code}")
+        log.info('ws.disconnect', socket='chat', code=close_code,
+                 conversation_id=getattr(self, 'conversation_id', None))
         if hasattr(self, 'room_group_name'):
             await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
 
     async def receive(self, text_data):
-        logger.info(f"Received message: {text_data}")
         try:
             data = json.loads(text_data)
-            if data['type'] == 'message':
-                content = data['content']
-                message = await self.save_message(content)
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'chat_message',
-                        'id': message.id,
-                        'sender_id': self.user.id,
-                        'sender_name': self.user.get_display_name(),
-                        'sender_avatar': self.user.avatar.url if self.user.avatar else None,
-                        'content': content,
-                        'timestamp': message.timestamp.isoformat(),
-                    }
-                )
-                logger.info(f"Message sent to group {self.room_group_name}")
-        except Exception as e:
-            logger.error(f"Error in receive: {e}\n{traceback.format_exc()}")
+            log.info('ws.frame', socket='chat', frame_type=data.get('type'), size=len(text_data))
+            await self.handle_chat_frame(self.conversation_id, data)
+        except Exception:
+            log.error('ws.receive_error', exc_info=True, socket='chat', text_data=text_data)
 
-    async def chat_message(self, event):
-        try:
-            await self.send(text_data=json.dumps(event))
-            logger.info(f"Message forwarded to client: {event['id']}")
-        except Exception as e:
-            logger.error(f"Error in chat_message: {e}")
+    async def is_participant(self):
+        return await ais_member(self.user.id, self.conversation_id)
 
-    async def edit_message(self, event):
-        try:
-            await self.send(text_data=json.dumps({
-                'type': 'edit_message',
-                'id': event['id'],
-                'content': event['content'],
-                'edited_at': event['edited_at'],
-            }))
-        except Exception as e:
-            logger.error(f"Error in edit_message: {e}")
 
-    async def delete_message(self, event):
-        try:
-            await self.send(text_data=json.dumps({
-                'type': 'delete_message',
-                'id': event['id'],
-            }))
-        except Exception as e:
-            logger.error(f"Error in delete_message: {e}")
+class EventsConsumer(PresenceMixin, ChatEventsMixin, AsyncWebsocketConsumer):
+    # Один сокет на клиента (ws/events/): чаты по подписке, счётчики непрочитанного
+    # и присутствие друзей. Управляющие кадры:
+    #   {"type": "subscribe", "conversation_ids": [...]}
+    #   {"type": "unsubscribe", "conversation_ids": [...]}
+    #   {"type": "sync_unread"}
+    # Кадры чата ("message", "read") обязаны содержать conversation_id подписанного чата.
+    async def connect(self):
+        self.user = self.scope['user']
+        self.subscriptions = set()
+        if self.user.is_anonymous:
+            log.warning('ws.reject', socket='events', reason='anonymous')
+            await self.close(code=4001)
+            return
+        await self.presence_connect()
+        log.info('ws.connect', socket='events', user_id=self.user.id)
 
-    async def pin_message(self, event):
-        try:
-            await self.send(text_data=json.dumps({
-                'type': 'pin_message',
-                'message_id': event['message_id'],
-                'content': event['content'],
-            }))
-        except Exception as e:
-            logger.error(f"Error in pin_message: {e}")
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'presence'):
+            return
+        for conversation_id in self.subscriptions:
+            await self.channel_layer.group_discard(f'chat_{conversation_id}', self.channel_name)
+        await self.presence_disconnect()
+        log.info('ws.disconnect', socket='events', user_id=self.user.id, code=close_code,
+                 subscriptions=len(self.subscriptions))
 
-    async def unpin_message(self, event):
+    async def receive(self, text_data):
         try:
-            await self.send(text_data=json.dumps({
-                'type': 'unpin_message',
-            }))
-        except Exception as e:
-            logger.error(f"Error in unpin_message: {e}")
+            data = json.loads(text_data)
+            log.info('ws.frame', socket='events', frame_type=data.get('type'), size=len(text_data))
+            if data['type'] == 'subscribe':
+                await self.subscribe(data.get('conversation_ids', []))
+            elif data['type'] == 'unsubscribe':
+                await self.unsubscribe(data.get('conversation_ids', []))
+            elif data['type'] == 'sync_unread':
+                await self.send(text_data=json.dumps({
+                    'type': 'unread_counts',
+                    'counts': await self.get_unread_counts(),
+                }))
+            elif data['type'] in ('message', 'read'):
+                conversation_id = int(data['conversation_id'])
+                if conversation_id in self.subscriptions:
+                    await self.handle_chat_frame(conversation_id, data)
+            else:
+                await self.handle_presence_frame(data)
+        except Exception:
+            log.error('ws.receive_error', exc_info=True, socket='events', text_data=text_data)
 
-    @database_sync_to_async
-    def is_participant(self):
-        return Conversation.objects.filter(
-            id=self.conversation_id,
-            participants=self.user
-        ).exists()
+    async def subscribe(self, conversation_ids):
+        requested = {int(cid) for cid in conversation_ids} - self.subscriptions
+        room = settings.CHAT_MAX_SUBSCRIPTIONS - len(self.subscriptions)
+        requested = set(sorted(requested)[:max(room, 0)])
+        allowed = await afilter_member_conversations(self.user.id, requested)
+        for conversation_id in allowed:
+            await self.channel_layer.group_add(f'chat_{conversation_id}', self.channel_name)
+        self.subscriptions |= allowed
+        log.info('chat.subscribe', user_id=self.user.id, added=len(allowed),
+                 rejected=len(requested - allowed), total=len(self.subscriptions))
+        await self.send(text_data=json.dumps({
+            'type': 'subscribed',
+            'conversation_ids': sorted(allowed),
+            'rejected': sorted(requested - allowed),
+        }))
+
+    async def unsubscribe(self, conversation_ids):
+        removed = {int(cid) for cid in conversation_ids} & self.subscriptions
+        for conversation_id in removed:
+            await self.channel_layer.group_discard(f'chat_{conversation_id}', self.channel_name)
+        self.subscriptions -= removed
+        await self.send(text_data=json.dumps({
+            'type': 'unsubscribed',
+            'conversation_ids': sorted(removed),
+        }))
 
     @database_sync_to_async
-    def save_message(self, content):
-        conv = Conversation.objects.get(id=self.conversation_id)
-        msg = Message.objects.create(
-            conversation=conv,
-            sender=self.user,
-            content=content
-        )
-        conv.last_message = msg
-        conv.save()
-        return msg
+    def get_unread_counts(self):
+        return dict(ConversationParticipant.objects.filter(
+            user=self.user, unread_count__gt=0
+        ).values_list('conversation_id', 'unread_count'))
+
 
+VOICE_SIGNALS = {'offer', 'answer', 'candidate'}
+VOICE_SIGNAL_FIELDS = ('sdp', 'candidate', 'sdpMid', 'sdpMLineIndex')
 
 class VoiceConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -149,27 +272,62 @@ class VoiceConsumer(AsyncWebsocketConsumer):
             return
 
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+        await voice.register_peer(self.voice_room_id, self.user.id, self.channel_name)
         await self.accept()
-        logger.info(f"User {self.user.id} connected to voice room {self.voice_room_id}")
+        # Пока сокет открыт, участник продлевает своё место в комнате; после
+        # закрытия вкладки оно истекает через VOICE_MEMBER_TTL
+        self.heartbeat_task = asyncio.create_task(self.heartbeat())
+        log.info('ws.connect', socket='voice', user_id=self.user.id, voice_room_id=self.voice_room_id)
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        if getattr(self, 'heartbeat_task', None):
+            self.heartbeat_task.cancel()
+            await voice.unregister_peer(self.voice_room_id, self.user.id, self.channel_name)
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.VOICE_HEARTBEAT_INTERVAL)
+            try:
+                present = await voice.heartbeat(self.voice_room_id, self.user.id, self.channel_name)
+            except Exception as e:
+                log.error('voice.heartbeat_error', user_id=self.user.id, error=repr(e))
+                continue
+            if not present:
+                # Участник вышел из комнаты (leave_voice) или его место истекло
+                await self.close()
+                return
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
-        if data['type'] in ['offer', 'answer', 'candidate']:
-            data['sender_id'] = self.user.id
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'voice_signal',
-                    'data': data,
-                }
-            )
+        try:
+            data = json.loads(text_data)
+        except ValueError:
+            data = None
+        if not isinstance(data, dict):
+            log.warning('ws.reject', socket='voice', reason='bad_frame', user_id=self.user.id)
+            return
+        signal_type = data.get('type')
+        if signal_type not in VOICE_SIGNALS:
+            return
+        # Сигнал адресован одному участнику комнаты: target_id обязателен
+        try:
+            target_id = int(data.pop('target_id'))
+        except (KeyError, TypeError, ValueError):
+            log.warning('ws.reject', socket='voice', reason='no_target', user_id=self.user.id)
+            return
+        channel_name = await voice.get_peer_channel(self.voice_room_id, target_id)
+        if channel_name is None or target_id == self.user.id:
+            await self.send(text_data=encode_frame('peer_unavailable', target_id=target_id))
+            return
+        # Получателю уходят только поля WebRTC: произвольные ключи клиента не пересылаются
+        payload = {field: data[field] for field in VOICE_SIGNAL_FIELDS if field in data}
+        await self.channel_layer.send(channel_name, {
+            'type': 'voice_signal',
+            'text': encode_frame(signal_type, sender_id=self.user.id, **payload),
+        })
 
     async def voice_signal(self, event):
-        if event['data']['sender_id'] != self.user.id:
-            await self.send(text_data=json.dumps(event['data']))
+        await self.send(text_data=event['text'])
 
     async def user_joined(self, event):
         await self.send(text_data=json.dumps({
@@ -191,6 +349,7 @@ class VoiceConsumer(AsyncWebsocketConsumer):
         except VoiceRoom.DoesNotExist:
             return None
 
-    @database_sync_to_async
-    def user_in_room(self):
-        return self.user in self.voice_room.active_users.all()
\ No newline at end of file
+    async def user_in_room(self):
+        if not await ais_member(self.user.id, self.voice_room.conversation_id):
+            return False
+        return await voice.is_member(self.voice_room_id, self.user.id)
\ No newline at end of file
@@ -0,0 +1,117 @@
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from apps.core.async_views import aiterate
+
+# Отдача вложений после проверки доступа:
+# - строгий ETag: SHA-256 содержимого, если он известен (загрузка по частям),
+#   иначе размер + mtime файла; If-None-Match -> 304;
+# - один диапазон Range (bytes=a-b, a-, -n) -> 206, с учётом If-Range;
+#   несколько диапазонов отдаются целым файлом (200), это допустимо по RFC 9110;
+# - CHAT_DOWNLOAD_OFFLOAD = 'x-accel' | 'x-sendfile': байты отдаёт фронт-прокси,
+#   Django только проверяет права и ставит заголовки.
+# Без прокси файл читается блоками через aiterate: синхронный генератор
+# StreamingHttpResponse под Daphne Django собрал бы в память целиком.
+
+BLOCK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+def file_etag(file_msg, stat):
+    if file_msg.sha256:
+        return f'"{file_msg.sha256}"'
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+def etag_matches(header, etag):
+    if header.strip() == '*':
+        return True
+    # Для If-None-Match сравнение слабое: W/ не учитывается
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+def parse_range(header, size):
+    # (start, end) включительно; None — заголовок не понят или диапазонов несколько;
+    # ValueError — диапазон за пределами файла
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+def read_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(BLOCK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+def stream_range(path, start, length):
+    return aiterate(read_range(path, start, length), thread_sensitive=False)
+
+def serve_file(request, file_msg):
+    path = file_msg.file.path
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404("Файл не найден на сервере")
+    etag = file_etag(file_msg, stat)
+    content_type = file_msg.file_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    headers = {
+        'ETag': etag,
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=0, must-revalidate',
+        'Content-Disposition': content_disposition_header(True, file_msg.filename),
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and etag_matches(if_none_match, etag):
+        return HttpResponse(status=304, headers={'ETag': etag, 'Cache-Control': headers['Cache-Control']})
+
+    offload = settings.CHAT_DOWNLOAD_OFFLOAD
+    if offload == 'x-accel':
+        # nginx сам обработает Range и If-None-Match для internal-локации
+        headers['X-Accel-Redirect'] = quote(settings.CHAT_DOWNLOAD_ACCEL_PREFIX + file_msg.file.name)
+        return HttpResponse(content_type=content_type, headers=headers)
+    if offload == 'x-sendfile':
+        headers['X-Sendfile'] = path
+        return HttpResponse(content_type=content_type, headers=headers)
+
+    size = stat.st_size
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if range_header and size:
+        if_range = request.headers.get('If-Range')
+        # If-Range со старым ETag: файл изменился, отдаём целиком
+        if not if_range or if_range.strip() == etag:
+            try:
+                byte_range = parse_range(range_header, size)
+            except ValueError:
+                return HttpResponse(status=416, headers={'Content-Range': f'bytes */{size}', 'ETag': etag})
+
+    if byte_range is None:
+        response = StreamingHttpResponse(stream_range(path, 0, size), content_type=content_type, headers=headers)
+        response['Content-Length'] = size
+        return response
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(stream_range(path, start, length), status=206,
+                                     content_type=content_type, headers=headers)
+    response['Content-Length'] = length
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    return response
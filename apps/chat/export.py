@@ -0,0 +1,176 @@
+import heapq
+import json
+import logging
+import os
+import zipfile
+from itertools import islice
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from . import archive
+from .history import encode_cursor
+from .models import ConversationParticipant, FileMessage, Message
+
+logger = logging.getLogger(__name__)
+
+# Выгрузка чата потоком: NDJSON (строка на запись) или ZIP, где рядом с
+# messages.ndjson лежат вложения files/<id>/<имя>.
+#
+# Формат NDJSON:
+#   {"kind": "conversation", ...}  — первая строка, только при выгрузке с начала;
+#   {"kind": "message", "cursor": ..., ...} — сообщения по возрастанию (timestamp, id),
+#       горячие и архивные вперемешку; "cursor" — тот же курсор, что в истории:
+#       клиент с оборванной выгрузкой повторяет запрос с after=<cursor последней строки>.
+#
+# Память постоянная: сообщения читаются страницами по ключу (timestamp, id)
+# по индексу chat_msg_conv_ts_id, а не .iterator() — драйвер MySQL всё равно
+# забирает весь результат запроса на клиента. Архив читается по одному сегменту.
+
+BLOCK_SIZE = 64 * 1024
+
+def after_key_filter(after_key):
+    ts, message_id = after_key
+    return Q(timestamp__gt=ts) | Q(timestamp=ts, id__gt=message_id)
+
+def hot_messages(conversation_id, after_key, chunk_size):
+    qs = Message.objects.filter(conversation_id=conversation_id, deleted=False).select_related(
+        'sender', 'sticker', 'file'
+    ).order_by('timestamp', 'id')
+    while True:
+        page = qs.filter(after_key_filter(after_key)) if after_key else qs
+        rows = list(page[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        after_key = archive.message_key(rows[-1])
+
+def iter_messages(conversation_id, after_key=None, chunk_size=None):
+    # Пачки Message по возрастанию ключа, архивные — несохраняемые экземпляры
+    chunk_size = chunk_size or settings.CHAT_EXPORT_CHUNK_SIZE
+    merged = heapq.merge(
+        hot_messages(conversation_id, after_key, chunk_size),
+        archive.iter_entries(conversation_id, after_key),
+        key=archive.item_key,
+    )
+    while True:
+        batch = list(islice(merged, chunk_size))
+        if not batch:
+            return
+        yield archive.resolve(conversation_id, batch)
+
+def attachment_path(file_msg):
+    # Только имя файла: путь из filename не должен выйти за каталог вложения
+    return f'files/{file_msg.id}/{os.path.basename(file_msg.filename) or "file"}'
+
+def conversation_record(conversation):
+    participants = ConversationParticipant.objects.filter(
+        conversation=conversation
+    ).select_related('user').order_by('id')
+    return {
+        'kind': 'conversation',
+        'id': conversation.id,
+        'type': conversation.type,
+        'name': conversation.name,
+        'created_at': conversation.created_at.isoformat(),
+        'exported_at': timezone.now().isoformat(),
+        'participants': [
+            {'id': p.user_id, 'name': p.user.get_display_name(), 'is_admin': p.is_admin}
+            for p in participants
+        ],
+    }
+
+def message_record(message):
+    sender = message.sender
+    record = {
+        'kind': 'message',
+        'cursor': encode_cursor(message.timestamp, message.id),
+        'id': message.id,
+        'sender_id': sender.id if sender else None,
+        'sender': sender.get_display_name() if sender else None,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+        'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+    }
+    if message.sticker_id:
+        record['sticker_id'] = message.sticker_id
+        record['sticker_url'] = message.sticker.image.url
+    file_msg = getattr(message, 'file', None)
+    if file_msg is not None:
+        record['file'] = {
+            'id': file_msg.id,
+            'filename': file_msg.filename,
+            'file_size': file_msg.file_size,
+            'file_type': file_msg.file_type,
+            'sha256': file_msg.sha256,
+            'path': attachment_path(file_msg),
+        }
+    return record
+
+def dump(record):
+    return json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+def ndjson_stream(conversation, after_key=None, chunk_size=None):
+    # Блоки байтов: по одному на пачку сообщений
+    if after_key is None:
+        yield dump(conversation_record(conversation)).encode()
+    for batch in iter_messages(conversation.id, after_key, chunk_size):
+        yield ''.join(dump(message_record(m)) for m in batch).encode()
+
+def attachments(conversation_id, after_key, chunk_size):
+    qs = FileMessage.objects.filter(
+        message__conversation_id=conversation_id, message__deleted=False
+    ).select_related('message').order_by('id')
+    if after_key:
+        ts, message_id = after_key
+        qs = qs.filter(Q(message__timestamp__gt=ts) | Q(message__timestamp=ts, message_id__gt=message_id))
+    last_id = 0
+    while True:
+        rows = list(qs.filter(id__gt=last_id)[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1].id
+
+class StreamSink:
+    # Файловый объект без seek для zipfile: отданное уже не нужно держать в памяти
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self.parts:
+            data = b''.join(self.parts)
+            self.parts.clear()
+            yield data
+
+def zip_stream(conversation, after_key=None, chunk_size=None):
+    chunk_size = chunk_size or settings.CHAT_EXPORT_CHUNK_SIZE
+    sink = StreamSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        with zf.open('messages.ndjson', 'w', force_zip64=True) as entry:
+            for block in ndjson_stream(conversation, after_key, chunk_size):
+                entry.write(block)
+                yield from sink.drain()
+        for file_msg in attachments(conversation.id, after_key, chunk_size):
+            info = zipfile.ZipInfo(
+                attachment_path(file_msg),
+                date_time=timezone.localtime(file_msg.message.timestamp).timetuple()[:6],
+            )
+            # Вложения обычно уже сжаты (изображения, видео, архивы)
+            info.compress_type = zipfile.ZIP_STORED
+            try:
+                source = file_msg.file.open('rb')
+            except FileNotFoundError:
+                logger.warning(f"Export of chat {conversation.id}: file {file_msg.file.name} is missing")
+                continue
+            with source, zf.open(info, 'w', force_zip64=True) as entry:
+                while block := source.read(BLOCK_SIZE):
+                    entry.write(block)
+                    yield from sink.drain()
+    yield from sink.drain()
@@ -0,0 +1,90 @@
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Q
+from . import archive
+from .models import Message
+
+# Курсор истории: base64url от "v1:<микросекунды с эпохи>:<id>".
+# Пагинация по ключу (timestamp, id): стоимость страницы не зависит от длины истории.
+CURSOR_VERSION = 'v1'
+PAGE_SIZE = settings.CHAT_HISTORY_PAGE_SIZE
+MAX_PAGE_SIZE = 200
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(timestamp, message_id):
+    micros = (timestamp - _EPOCH) // _MICROSECOND
+    raw = f'{CURSOR_VERSION}:{micros}:{message_id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        version, micros, message_id = base64.urlsafe_b64decode(padded).decode().split(':')
+        message_id = int(message_id)
+        # id — BIGINT: за его пределами запрос упал бы уже в базе
+        if version != CURSOR_VERSION or not 0 < message_id < 2 ** 63:
+            raise InvalidCursor(cursor)
+        return _EPOCH + int(micros) * _MICROSECOND, message_id
+    except (ValueError, UnicodeDecodeError, OverflowError) as e:
+        raise InvalidCursor(cursor) from e
+
+def clamp_limit(value, default=PAGE_SIZE):
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def before_cursor(cursor):
+    # Условие "строго старше курсора" для порядка (-timestamp, -id)
+    ts, message_id = decode_cursor(cursor)
+    return Q(timestamp__lt=ts) | Q(timestamp=ts, id__lt=message_id)
+
+def page_queryset(conversation_id, before=None):
+    # От новых к старым, начиная строго перед курсором
+    qs = Message.objects.filter(conversation_id=conversation_id, deleted=False)
+    if before:
+        qs = qs.filter(before_cursor(before))
+    return qs.select_related('sender', 'sticker', 'file').order_by('-timestamp', '-id')
+
+def fetch_page(conversation_id, before=None, limit=PAGE_SIZE):
+    # Возвращает (сообщения по возрастанию, курсор для более старой страницы или None)
+    rows = list(page_queryset(conversation_id, before)[:limit + 1])
+    # Старше горячих строк могут лежать архивные (см. archive.py)
+    rows = archive.merge_page(conversation_id, rows, decode_cursor(before) if before else None, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        oldest = rows[-1]
+        next_cursor = encode_cursor(oldest.timestamp, oldest.id)
+    rows.reverse()
+    return rows, next_cursor
+
+def serialize_message(message):
+    # Та же форма, что и у событий chat_message в WebSocket
+    sender = message.sender
+    data = {
+        'id': message.id,
+        'sender_id': sender.id if sender else None,
+        'sender_name': sender.get_display_name() if sender else '',
+        'sender_avatar': sender.avatar.thumbnail_url(settings.THUMBNAIL_AVATAR_SIZE) if sender else None,
+        'content': message.content,
+        'timestamp': message.timestamp.isoformat(),
+        'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+    }
+    if message.sticker_id:
+        data['sticker_id'] = message.sticker_id
+        data['sticker_url'] = message.sticker.image.thumbnail_url(128)
+    file_msg = getattr(message, 'file', None)
+    if file_msg is not None:
+        data['file_url'] = file_msg.file.url
+        data['thumbnail_url'] = file_msg.file.thumbnail_url(256)
+        data['filename'] = file_msg.filename
+        data['file_type'] = file_msg.file_type
+    return data
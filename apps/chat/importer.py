@@ -0,0 +1,412 @@
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+import uuid
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timezone as dt_timezone
+from itertools import repeat
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models import Count, F, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from apps.core.utils import preserve_auto_now
+from apps.users.models import User, UsernameSlots
+from . import membership
+from .models import Conversation, ConversationParticipant, FileMessage, ImportMapping, Message
+
+logger = logging.getLogger(__name__)
+
+# Массовый импорт истории с других платформ (команда import_history).
+#
+# Вход — NDJSON в UTF-8, запись на строку, тип задаёт поле "kind":
+#   {"kind": "user", "id": "u1", "username": "alice", "email": "alice@example.com",
+#    "date_joined": "2021-03-01T10:00:00+00:00"}
+#       email и date_joined необязательны. Пользователь с уже известным email не
+#       создаётся: внешний id привязывается к существующему аккаунту. Новым
+#       аккаунтам ставится непригодный пароль — вход после сброса пароля;
+#   {"kind": "conversation", "id": "c1", "type": "group", "name": "Общий",
+#    "created_at": "...", "owner": "u1", "participants": ["u1", "u2"], "admins": ["u1"]}
+#       type — group или private. Личный чат (ровно два участника) совпадает
+#       с уже существующим чатом этой пары;
+#   {"kind": "message", "id": "m1", "conversation": "c1", "sender": "u1",
+#    "content": "...", "timestamp": "...", "edited_at": null,
+#    "file": {"path": "attachments/1.png", "filename": "1.png", "file_type": "image/png"}}
+#       sender может быть null, file необязателен, file.path — относительно
+#       каталога --files. Сообщения одного чата идут по возрастанию timestamp:
+#       id в Aura растут в том же порядке, на этом держатся last_message и
+#       водяные знаки прочтения.
+# Время — ISO 8601; без часового пояса считается UTC. Записи могут идти в любом
+# порядке: сначала весь файл читается один раз, затем пишутся сообщения.
+#
+# Этапы:
+# 1. Чтение: пользователи пачками (bulk_create, номера — UsernameSlots.allocate_many),
+#    чаты копятся в памяти, сообщения раскладываются во временные файлы-корзины
+#    по хэшу внешнего id чата — все сообщения чата в одной корзине, по порядку;
+# 2. чаты и участники;
+# 3. корзины параллельно в процессах: bulk_create сообщений и FileMessage;
+# 4. итоги по чатам: last_message — самое позднее по (timestamp, id).
+#    В чатах, созданных этим запуском, история считается прочитанной. В личном
+#    чате, слитом с живым, и чатах прошлых запусков импортированное — старая
+#    история с новыми id: водяной знак поднимается над ним у всех, а счётчик
+#    пересчитывается по живым сообщениям выше прежнего знака. Живые — те, что
+#    были в чате до импорта (id не выше снятого перед этапом 3) или пришли во
+#    время него (время не раньше начала этапа 3). last_activity не трогается.
+#
+# Повторный запуск с тем же --source безопасен: пользователи и чаты находятся
+# по ImportMapping, сообщения — по Message.uid (uuid5 от источника, чата и
+# внешнего id), вставка с ignore_conflicts; в stats['messages'] — только
+# вставленные, уже бывшие — в stats['messages_existing']. Миниатюры вложений bulk_create
+# не заказывает — после импорта нужен backfill_thumbnails.
+
+UID_NAMESPACE = uuid.UUID('6f1c8a52-2b7e-4d8a-9a57-3c0e5b1f9d21')
+LOOKUP_BATCH = 1000
+BUCKETS_PER_WORKER = 4
+
+def message_uid(source, conversation_external_id, message_external_id):
+    return uuid.uuid5(UID_NAMESPACE, f'{source}:{conversation_external_id}:{message_external_id}')
+
+def parse_time(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'invalid datetime: {value}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+def lookup(source, kind, external_ids):
+    # {внешний id: id в Aura} для уже импортированных
+    external_ids = list(external_ids)
+    found = {}
+    for offset in range(0, len(external_ids), LOOKUP_BATCH):
+        found.update(ImportMapping.objects.filter(
+            source=source, kind=kind, external_id__in=external_ids[offset:offset + LOOKUP_BATCH],
+        ).values_list('external_id', 'internal_id'))
+    return found
+
+def remember(source, kind, pairs):
+    ImportMapping.objects.bulk_create([
+        ImportMapping(source=source, kind=kind, external_id=external_id, internal_id=internal_id)
+        for external_id, internal_id in pairs
+    ], ignore_conflicts=True)
+
+# --- Пользователи ---
+
+def import_users(source, records, stats):
+    records = list({str(r['id']): r for r in records}.values())
+    known = lookup(source, 'user', (str(r['id']) for r in records))
+    records = [r for r in records if str(r['id']) not in known]
+    if not records:
+        return
+    emails = {str(r['id']): (r.get('email') or f'{source}-{r["id"]}@import.invalid').lower() for r in records}
+    existing = dict(User.objects.filter(email__in=emails.values()).values_list('email', 'id'))
+    by_username = {}
+    seen = set(existing)
+    for r in records:
+        # Несколько внешних id с одним email получают один аккаунт
+        if emails[str(r['id'])] not in seen:
+            seen.add(emails[str(r['id'])])
+            username = (r.get('username') or f'user{r["id"]}')[:32]
+            by_username.setdefault(username, []).append(r)
+    with transaction.atomic():
+        users = []
+        # Один порядок блокировок строк UsernameSlots при любом составе пачки
+        for username in sorted(by_username):
+            group = by_username[username]
+            try:
+                discriminators = UsernameSlots.objects.allocate_many(username, len(group))
+            except ValidationError:
+                stats['users_exhausted'] += len(group)
+                continue
+            for r, discriminator in zip(group, discriminators):
+                users.append(User(
+                    username=username,
+                    email=emails[str(r['id'])],
+                    discriminator=discriminator,
+                    password=make_password(None),
+                    date_joined=parse_time(r.get('date_joined')) or timezone.now(),
+                ))
+        User.objects.bulk_create(users)
+        created = dict(User.objects.filter(email__in=[u.email for u in users]).values_list('email', 'id'))
+        ids = {**existing, **created}
+        remember(source, 'user', [
+            (external_id, ids[email]) for external_id, email in emails.items() if email in ids
+        ])
+    stats['users'] += len(users)
+    stats['users_linked'] += sum(1 for email in emails.values() if email in existing)
+
+# --- Чаты ---
+
+def import_conversations(source, records, stats):
+    # Возвращает id чатов, созданных этим вызовом (не слитых с существующими)
+    records = list({str(r['id']): r for r in records}.values())
+    known = lookup(source, 'conversation', (str(r['id']) for r in records))
+    users = lookup(source, 'user', {
+        str(u) for r in records for u in [*r.get('participants', []), r.get('owner')] if u is not None
+    })
+    created_ids = set()
+    for record in records:
+        if str(record['id']) in known:
+            continue
+        member_ids = list(dict.fromkeys(users[str(u)] for u in record.get('participants', []) if str(u) in users))
+        owner_id = users.get(str(record.get('owner')))
+        admin_ids = {users[str(u)] for u in record.get('admins', []) if str(u) in users} | {owner_id}
+        created_at = parse_time(record.get('created_at')) or timezone.now()
+        if record.get('type') == 'private' and len(member_ids) == 2:
+            pair = User.objects.in_bulk(member_ids)
+            conversation, created = Conversation.objects.get_or_create_private(pair[member_ids[0]], pair[member_ids[1]])
+            if created:
+                created_ids.add(conversation.id)
+        else:
+            with (
+                transaction.atomic(),
+                preserve_auto_now(Conversation, 'created_at'),
+                preserve_auto_now(ConversationParticipant, 'joined_at'),
+            ):
+                conversation = Conversation.objects.create(
+                    type='group',
+                    name=(record.get('name') or '')[:100],
+                    owner_id=owner_id,
+                    created_at=created_at,
+                )
+                ConversationParticipant.objects.bulk_create([
+                    ConversationParticipant(
+                        user_id=user_id,
+                        conversation=conversation,
+                        is_admin=user_id in admin_ids,
+                        joined_at=created_at,
+                        last_activity=created_at,
+                    )
+                    for user_id in member_ids
+                ], batch_size=LOOKUP_BATCH)
+            created_ids.add(conversation.id)
+        remember(source, 'conversation', [(str(record['id']), conversation.id)])
+        membership.invalidate(conversation.id, *member_ids)
+        stats['conversations'] += 1
+    return created_ids
+
+# --- Сообщения (в процессах-обработчиках) ---
+
+def import_bucket(source, path, files_root, batch_size):
+    stats = Counter()
+    users = {}
+    conversations = {}
+    batch = []
+    try:
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                batch.append(json.loads(line))
+                if len(batch) >= batch_size:
+                    import_messages(source, batch, users, conversations, files_root, stats)
+                    batch = []
+        if batch:
+            import_messages(source, batch, users, conversations, files_root, stats)
+    finally:
+        connections.close_all()
+    return stats
+
+def import_messages(source, records, users, conversations, files_root, stats):
+    # users / conversations — кэш соответствий обработчика, дополняется по пачкам
+    for kind, cache, field in (('user', users, 'sender'), ('conversation', conversations, 'conversation')):
+        missing = {str(r[field]) for r in records if r.get(field) is not None} - cache.keys()
+        cache.update(dict.fromkeys(missing))
+        cache.update(lookup(source, kind, missing))
+    rows = []
+    files = {}
+    for r in records:
+        conversation_id = conversations.get(str(r.get('conversation')))
+        if conversation_id is None:
+            stats['messages_orphaned'] += 1
+            continue
+        try:
+            timestamp = parse_time(r.get('timestamp'))
+            edited_at = parse_time(r.get('edited_at'))
+        except ValueError:
+            timestamp = None
+        if timestamp is None:
+            stats['messages_invalid'] += 1
+            continue
+        sender_id = users.get(str(r['sender'])) if r.get('sender') is not None else None
+        if r.get('sender') is not None and sender_id is None:
+            stats['unknown_senders'] += 1
+        uid = message_uid(source, str(r['conversation']), r['id'])
+        rows.append(Message(
+            uid=uid,
+            conversation_id=conversation_id,
+            sender_id=sender_id,
+            content=r.get('content') or ('📎 Файл' if r.get('file') else ''),
+            timestamp=timestamp,
+            edited_at=edited_at,
+        ))
+        if r.get('file'):
+            files[uid] = r['file']
+    rows = list({row.uid: row for row in rows}.values())
+    existing = set(Message.objects.filter(uid__in=[row.uid for row in rows]).values_list('uid', flat=True))
+    new = [row for row in rows if row.uid not in existing]
+    with transaction.atomic(), preserve_auto_now(Message, 'timestamp'):
+        Message.objects.bulk_create(new, ignore_conflicts=True)
+    stats['messages'] += len(new)
+    stats['messages_existing'] += len(rows) - len(new)
+    if files:
+        import_files(files, files_root, stats)
+
+def import_files(files, files_root, stats):
+    message_ids = dict(Message.objects.filter(uid__in=list(files)).values_list('uid', 'id'))
+    done = set(FileMessage.objects.filter(message_id__in=message_ids.values()).values_list('message_id', flat=True))
+    field = FileMessage._meta.get_field('file')
+    root = os.path.realpath(files_root) if files_root else None
+    new = []
+    for uid, spec in files.items():
+        message_id = message_ids.get(uid)
+        if message_id is None or message_id in done:
+            continue
+        source_path = os.path.realpath(os.path.join(root, spec['path'])) if root else None
+        if source_path is None or not source_path.startswith(root + os.sep):
+            stats['files_missing'] += 1
+            continue
+        filename = os.path.basename(spec.get('filename') or spec['path'])
+        try:
+            with open(source_path, 'rb') as f:
+                name = default_storage.save(field.generate_filename(None, filename), File(f))
+            size = default_storage.size(name)
+        except OSError:
+            stats['files_missing'] += 1
+            continue
+        new.append(FileMessage(
+            message_id=message_id,
+            file=name,
+            filename=filename[:255],
+            file_size=size,
+            file_type=spec.get('file_type') or mimetypes.guess_type(filename)[0] or '',
+            sha256=spec.get('sha256', ''),
+        ))
+    FileMessage.objects.bulk_create(new, ignore_conflicts=True)
+    stats['files'] += len(new)
+
+# --- Итоги ---
+
+def message_baseline(conversation_ids):
+    # {чат: наибольший id до импорта сообщений} — граница живых сообщений для finalize
+    conversation_ids = list(conversation_ids)
+    baseline = dict.fromkeys(conversation_ids, 0)
+    for offset in range(0, len(conversation_ids), LOOKUP_BATCH):
+        baseline.update(
+            Message.objects.filter(conversation_id__in=conversation_ids[offset:offset + LOOKUP_BATCH])
+            .order_by().values('conversation_id').annotate(top=Max('id')).values_list('conversation_id', 'top')
+        )
+    return baseline
+
+def finalize(conversation_ids, created_ids, baseline, started):
+    # created_ids — чаты этого запуска: в них только импортированная история,
+    # участники прочитали всё. Остальные (слитый личный чат, чаты прошлых
+    # запусков) — из baseline: см. этап 4 в начале модуля
+    conversation_ids = list(conversation_ids)
+    for offset in range(0, len(conversation_ids), LOOKUP_BATCH):
+        chunk = conversation_ids[offset:offset + LOOKUP_BATCH]
+        # Импорт старой истории получает новые id: последнее — по времени, а не по id
+        last = Message.objects.filter(conversation_id=OuterRef('pk')).order_by('-timestamp', '-id')
+        Conversation.objects.filter(id__in=chunk).update(last_message=Subquery(last.values('id')[:1]))
+        top_id = Message.objects.filter(conversation_id=OuterRef('conversation_id')).order_by('-id')
+        top_time = Message.objects.filter(conversation_id=OuterRef('conversation_id')).order_by('-timestamp', '-id')
+        participants = ConversationParticipant.objects.filter(conversation_id__in=chunk)
+        participants.filter(conversation_id__in=created_ids).update(
+            last_read=Coalesce(Subquery(top_id.values('id')[:1]), 0),
+            unread_count=0,
+            last_activity=Coalesce(Subquery(top_time.values('timestamp')[:1]), F('last_activity')),
+        )
+    # Наибольший импортированный id: выше снятой границы и старше начала импорта
+    imported = {}
+    merged_ids = list(baseline)
+    for offset in range(0, len(merged_ids), LOOKUP_BATCH):
+        chunk = merged_ids[offset:offset + LOOKUP_BATCH]
+        for conversation_id, top in (
+            Message.objects.filter(conversation_id__in=chunk, timestamp__lt=started)
+            .order_by().values('conversation_id').annotate(top=Max('id')).values_list('conversation_id', 'top')
+        ):
+            if top > baseline[conversation_id]:
+                imported[conversation_id] = top
+    for conversation_id, top in imported.items():
+        live = (
+            Message.objects.filter(conversation_id=conversation_id, id__gt=OuterRef('last_read'))
+            .filter(Q(id__lte=baseline[conversation_id]) | Q(timestamp__gte=started))
+            .exclude(sender_id=OuterRef('user_id'))
+            .order_by().values('conversation_id').annotate(n=Count('id')).values('n')
+        )
+        # Счётчик первым: MySQL вычисляет SET слева направо, подзапросу нужен прежний знак
+        ConversationParticipant.objects.filter(conversation_id=conversation_id, last_read__lt=top).update(
+            unread_count=Coalesce(Subquery(live), 0),
+            last_read=top,
+        )
+
+def run_import(path, source, files_root=None, batch_size=5000, workers=4, log=logger.info):
+    stats = Counter()
+    user_batch = []
+    conversation_records = []
+    with tempfile.TemporaryDirectory(prefix='aura-import-') as spool:
+        bucket_paths = [os.path.join(spool, f'{i}.ndjson') for i in range(max(workers, 1) * BUCKETS_PER_WORKER)]
+        buckets = [open(p, 'w', encoding='utf-8') for p in bucket_paths]
+        try:
+            with open(path, encoding='utf-8') as f:
+                for number, line in enumerate(f, 1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                        kind = record['kind']
+                        if record.get('id') is None:
+                            raise KeyError('id')
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        logger.warning(f"Import {source}: line {number} is not a valid record")
+                        stats['invalid_lines'] += 1
+                        continue
+                    if kind == 'message':
+                        key = str(record.get('conversation')).encode()
+                        buckets[zlib.crc32(key) % len(buckets)].write(line if line.endswith('\n') else line + '\n')
+                    elif kind == 'user':
+                        user_batch.append(record)
+                        if len(user_batch) >= batch_size:
+                            import_users(source, user_batch, stats)
+                            user_batch = []
+                    elif kind == 'conversation':
+                        conversation_records.append(record)
+                    else:
+                        stats['invalid_lines'] += 1
+        finally:
+            for bucket in buckets:
+                bucket.close()
+        if user_batch:
+            import_users(source, user_batch, stats)
+        log(f'users: {stats["users"]} created, {stats["users_linked"]} linked to existing accounts')
+        created_ids = import_conversations(source, conversation_records, stats)
+        log(f'conversations: {stats["conversations"]} created')
+        conversation_ids = list(lookup(source, 'conversation', (str(r['id']) for r in conversation_records)).values())
+        started = timezone.now()
+        baseline = message_baseline(cid for cid in conversation_ids if cid not in created_ids)
+
+        bucket_paths = [p for p in bucket_paths if os.path.getsize(p)]
+        if workers > 1:
+            # Соединения родителя не должны достаться дочерним процессам
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=django.setup) as pool:
+                results = pool.map(import_bucket, repeat(source), bucket_paths, repeat(files_root), repeat(batch_size))
+                for result in results:
+                    stats.update(result)
+                    log(f'messages: {stats["messages"]}')
+        else:
+            for p in bucket_paths:
+                stats.update(import_bucket(source, p, files_root, batch_size))
+                log(f'messages: {stats["messages"]}')
+
+    finalize(conversation_ids, created_ids, baseline, started)
+    return stats
@@ -0,0 +1,46 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...archive import archive_conversation, horizon_for
+from ...models import Conversation
+
+class Command(BaseCommand):
+    help = 'Переносит сообщения старше горизонта чата в сжатые сегменты архива (apps/chat/archive.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversation', type=int, action='append',
+                            help='Только эти чаты (можно повторять)')
+        parser.add_argument('--days', type=int,
+                            help='Горизонт в днях для всех чатов вместо archive_after_days / CHAT_ARCHIVE_AFTER_DAYS')
+        parser.add_argument('--batch-size', type=int, default=settings.CHAT_ARCHIVE_BATCH_SIZE,
+                            help='Сообщений в сегменте и в одной транзакции')
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help='Пауза между пачками, секунды')
+
+    def handle(self, *args, **options):
+        conversations = Conversation.objects.only('id', 'last_message', 'archive_after_days').order_by('id')
+        if options['conversation']:
+            conversations = conversations.filter(id__in=options['conversation'])
+        now = timezone.now()
+        started = time.perf_counter()
+        total_archived = total_removed = 0
+        for conversation in conversations.iterator():
+            if options['days'] is not None:
+                horizon = now - timedelta(days=options['days']) if options['days'] else None
+            else:
+                horizon = horizon_for(conversation, now)
+            if horizon is None:
+                continue
+            archived, removed = archive_conversation(
+                conversation, horizon, options['batch_size'], options['pause']
+            )
+            if removed:
+                self.stdout.write(f'  chat {conversation.id}: {archived} в архив, {removed - archived} удалённых стёрто')
+            total_archived += archived
+            total_removed += removed
+        self.stdout.write(
+            f'Перенесено в архив: {total_archived}, удалено из Message: {total_removed} '
+            f'за {time.perf_counter() - started:.1f} с'
+        )
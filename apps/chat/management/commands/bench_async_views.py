@@ -0,0 +1,144 @@
+import asyncio
+import statistics
+import threading
+import time
+from asgiref.sync import SyncToAsync, async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.management.base import BaseCommand
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from django.test import AsyncClient
+from django.test.utils import override_settings
+from django.urls import include, path, reverse
+from django.utils import timezone
+from apps.core.events import encode_event
+from ...models import Message
+from ..seed import make_users, make_conversation, cleanup
+
+# Прежнее синхронное представление: под ASGI весь запрос выполняется в общем
+# потоке thread_sensitive, а group_send ещё раз уходит в цикл через async_to_sync
+@login_required
+def legacy_edit_message(request, message_id):
+    message = get_object_or_404(Message, id=message_id, sender=request.user)
+    message.content = request.POST.get('content')
+    message.edited_at = timezone.now()
+    message.save()
+    async_to_sync(get_channel_layer().group_send)(
+        f'chat_{message.conversation_id}',
+        encode_event(
+            'edit_message',
+            conversation_id=message.conversation_id,
+            id=message.id,
+            content=message.content,
+            edited_at=message.edited_at.isoformat(),
+        )
+    )
+    return JsonResponse({'status': 'ok'})
+
+# Временный URLconf: основные маршруты плюс прежний вариант представления
+urlpatterns = [
+    path('bench/legacy_edit_message/<int:message_id>/', legacy_edit_message, name='bench_legacy_edit_message'),
+    path('', include(settings.ROOT_URLCONF)),
+]
+
+class HopCounter:
+    # Считает переходы из цикла событий в пул потоков (sync_to_async)
+    def __init__(self):
+        self.count = 0
+        self.original = SyncToAsync.__call__
+
+    def __enter__(self):
+        counter = self
+        original = self.original
+
+        async def counted(self, *args, **kwargs):
+            counter.count += 1
+            return await original(self, *args, **kwargs)
+
+        SyncToAsync.__call__ = counted
+        return self
+
+    def __exit__(self, *exc):
+        SyncToAsync.__call__ = self.original
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест edit_message: прежнее синхронное представление против async (req/s, переходы в пул, потоки)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--subscribers', type=int, default=10,
+                            help='Каналов в группе чата, получающих рассылку')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def handle(self, *args, **options):
+        users = make_users(1)
+        user = users[0]
+        conv = make_conversation(users)
+        message = Message.objects.create(conversation=conv, sender=user, content='bench')
+        client = AsyncClient()
+        # Сессия создаётся синхронно, до запуска цикла
+        client.force_login(user)
+        try:
+            with override_settings(ROOT_URLCONF=__name__):
+                urls = {
+                    'sync': reverse('bench_legacy_edit_message', args=[message.id]),
+                    'async': reverse('chat:edit_message', args=[message.id]),
+                }
+                self.stdout.write(
+                    f'requests: {options["requests"]}, concurrency: {options["concurrency"]}, '
+                    f'channel layer: {settings.CHANNEL_LAYERS["default"]["BACKEND"].rsplit(".", 1)[-1]}'
+                )
+                self.stdout.write(f'{"view":>6} {"req/s":>9} {"p50":>9} {"hops/req":>9} {"threads":>8}')
+                for name, url in urls.items():
+                    results = [
+                        asyncio.run(self.run(client, url, conv.id, options))
+                        for _ in range(options['repeat'])
+                    ]
+                    rps = statistics.median(r[0] for r in results)
+                    p50 = statistics.median(r[1] for r in results)
+                    hops = statistics.median(r[2] for r in results)
+                    threads = max(r[3] for r in results)
+                    self.stdout.write(f'{name:>6} {rps:>9.0f} {p50:>6.2f} ms {hops:>9.1f} {threads:>8}')
+        finally:
+            cleanup(users, [conv])
+
+    async def run(self, client, url, conversation_id, options):
+        total = options['requests']
+        layer = get_channel_layer()
+        channels = [await layer.new_channel() for _ in range(options['subscribers'])]
+        for channel in channels:
+            await layer.group_add(f'chat_{conversation_id}', channel)
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        latencies = []
+        peak_threads = threading.active_count()
+        done = asyncio.Event()
+
+        async def sample_threads():
+            nonlocal peak_threads
+            while not done.is_set():
+                peak_threads = max(peak_threads, threading.active_count())
+                await asyncio.sleep(0.005)
+
+        async def one(i):
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post(url, {'content': f'edit {i}'})
+                latencies.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    raise RuntimeError(f'{url}: HTTP {response.status_code}')
+
+        sampler = asyncio.create_task(sample_threads())
+        with HopCounter() as hops:
+            started = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(total)))
+            elapsed = time.perf_counter() - started
+        done.set()
+        await sampler
+        for channel in channels:
+            await layer.group_discard(f'chat_{conversation_id}', channel)
+        if hasattr(layer, 'flush'):
+            await layer.flush()
+        return total / elapsed, statistics.median(latencies), hops.count / total, peak_threads
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import statistics
+import time
+from django.core.management.base import BaseCommand
+from apps.core.events import encode_event
+from ...consumers import ChatEventsMixin
+
+class Receiver(ChatEventsMixin):
+    # Consumer без сокета: считаем только работу обработчика события
+    async def send(self, text_data=None, bytes_data=None):
+        pass
+
+class LegacyReceiver(Receiver):
+    # Прежний обработчик: json.dumps в каждом получателе
+    async def chat_message(self, event):
+        await self.send(text_data=json.dumps(event))
+
+class Command(BaseCommand):
+    help = 'CPU на одну рассылку сообщения в группу: json.dumps у каждого получателя против заранее закодированного кадра'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,100,1000,5000',
+                            help='Размеры групп через запятую')
+        parser.add_argument('--content-length', type=int, default=200)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',')]
+        content = 'x' * options['content_length']
+        self.stdout.write(f'{"group":>7} {"per-recipient":>15} {"pre-encoded":>13} {"speedup":>8}')
+        for size in sizes:
+            legacy = self.measure(LegacyReceiver, size, content, options['repeat'], encoded=False)
+            current = self.measure(Receiver, size, content, options['repeat'], encoded=True)
+            self.stdout.write(
+                f'{size:>7} {legacy:>12.3f} ms {current:>10.3f} ms {legacy / current:>7.1f}x'
+            )
+
+    def measure(self, receiver_class, size, content, repeat, encoded):
+        # Медиана процессорного времени на одну рассылку, включая кодирование у отправителя
+        receivers = [receiver_class() for _ in range(size)]
+        payload = {
+            'conversation_id': 1,
+            'uid': '6f1c1d7e-0000-4000-8000-000000000000',
+            'id': 123456,
+            'sender_id': 42,
+            'sender_name': 'bench_user#0001',
+            'sender_avatar': '/media/avatars/bench.png',
+            'content': content,
+            'timestamp': '2024-01-01T00:00:00+00:00',
+        }
+
+        async def fan_out():
+            if encoded:
+                event = encode_event('chat_message', **payload)
+            else:
+                event = {'type': 'chat_message', **payload}
+            for receiver in receivers:
+                await receiver.chat_message(event)
+
+        async def run():
+            samples = []
+            for _ in range(repeat):
+                started = time.process_time()
+                await fan_out()
+                samples.append((time.process_time() - started) * 1000)
+            return samples
+
+        return statistics.median(asyncio.run(run()))
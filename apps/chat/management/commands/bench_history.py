@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from ...history import fetch_page
+from ...models import Message
+from ..seed import make_users, make_conversation, fill_messages, measure, cleanup
+
+class Command(BaseCommand):
+    help = 'Время открытия чата (первая страница истории) в зависимости от длины истории'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Длины истории через запятую')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--legacy', action='store_true',
+                            help='Также замерить загрузку всей истории (старое поведение room)')
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',')]
+        users = make_users(2)
+        conversations = []
+        try:
+            self.stdout.write(f'{"messages":>10} {"first page, ms":>15} {"older page, ms":>15} {"full load, ms":>15}')
+            for size in sizes:
+                conv = make_conversation(users)
+                conversations.append(conv)
+                fill_messages(conv, users, size)
+
+                first = measure(lambda: fetch_page(conv.id), options['repeat'])
+                _, cursor = fetch_page(conv.id)
+                older = measure(lambda: fetch_page(conv.id, before=cursor), options['repeat'])
+                full = '-'
+                if options['legacy']:
+                    full = f'{measure(lambda: self.load_all(conv), options["repeat"]):.2f}'
+                self.stdout.write(f'{size:>10} {first:>15.2f} {older:>15.2f} {full:>15}')
+        finally:
+            cleanup(users, conversations)
+
+    def load_all(self, conv):
+        return list(
+            Message.objects.filter(conversation=conv)
+            .select_related('sender', 'sticker').prefetch_related('file').order_by('timestamp')
+        )
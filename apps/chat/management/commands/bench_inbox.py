@@ -0,0 +1,59 @@
+from django.db.models import OuterRef, Subquery, F, Count, IntegerField
+from django.db.models.functions import Coalesce
+from django.core.management.base import BaseCommand
+from ...models import Conversation, ConversationParticipant, Message
+from ..seed import make_users, make_conversation, fill_messages, measure, cleanup
+
+class Command(BaseCommand):
+    help = 'Список чатов: коррелированные подзапросы против денормализованных счётчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversations', type=int, default=500)
+        parser.add_argument('--messages', type=int, default=20,
+                            help='Сообщений в каждом чате')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        users = make_users(2)
+        me, other = users
+        conversations = []
+        try:
+            for i in range(options['conversations']):
+                conv = make_conversation(users, name=f'bench {i}')
+                conversations.append(conv)
+                fill_messages(conv, [other, me], options['messages'])
+
+            legacy = measure(lambda: list(self.legacy_inbox(me)), options['repeat'])
+            current = measure(lambda: list(self.inbox(me)), options['repeat'])
+            self.stdout.write(f'conversations: {options["conversations"]}, messages each: {options["messages"]}')
+            self.stdout.write(f'subqueries:   {legacy:.2f} ms')
+            self.stdout.write(f'denormalized: {current:.2f} ms')
+        finally:
+            cleanup(users, conversations)
+
+    def inbox(self, user):
+        # То же, что views.index
+        return ConversationParticipant.objects.filter(user=user).select_related(
+            'conversation', 'conversation__last_message'
+        ).order_by('-is_pinned', '-last_activity')
+
+    def legacy_inbox(self, user):
+        # Прежний views.index (с водяными знаками вместо дат прочтения)
+        unread_subquery = Message.objects.filter(
+            conversation=OuterRef('pk'),
+            id__gt=OuterRef('conversationparticipant__last_read')
+        ).exclude(sender=user).values('conversation').annotate(cnt=Count('id')).values('cnt')
+        return Conversation.objects.filter(participants=user).annotate(
+            last_msg_content=Subquery(
+                Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp').values('content')[:1]
+            ),
+            unread_count=Coalesce(Subquery(unread_subquery), 0, output_field=IntegerField()),
+            is_pinned=Subquery(
+                ConversationParticipant.objects.filter(
+                    user=user, conversation=OuterRef('pk')
+                ).values('is_pinned')[:1]
+            )
+        ).order_by(
+            F('is_pinned').desc(),
+            F('last_message__timestamp').desc(nulls_last=True)
+        ).select_related('last_message')
@@ -0,0 +1,75 @@
+import random
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from apps.core.utils import preserve_auto_now
+from ...models import ConversationParticipant, Message
+from ...search import search_messages
+from ..seed import BATCH_SIZE, make_users, make_conversation, measure, cleanup
+
+class Command(BaseCommand):
+    help = 'Поиск по сообщениям: content__icontains против FULLTEXT-индекса (apps/chat/search.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=10_000_000)
+        parser.add_argument('--conversations', type=int, default=1000)
+        parser.add_argument('--member-of', type=int, default=50,
+                            help='В скольких чатах состоит ищущий пользователь')
+        parser.add_argument('--vocabulary', type=int, default=50000)
+        parser.add_argument('--query', default='',
+                            help='Запрос; по умолчанию два слова из словаря корпуса')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        vocabulary = [f'w{i:x}z' for i in range(options['vocabulary'])]
+        users = make_users(2)
+        me, other = users
+        conversations = []
+        try:
+            for i in range(options['conversations']):
+                members = [me, other] if i < options['member_of'] else [other]
+                conversations.append(make_conversation(members, name=f'bench {i}'))
+            self.fill(conversations, other, vocabulary, options['messages'], rnd)
+
+            query = options['query'] or ' '.join(rnd.sample(vocabulary[:50], 2))
+            scan = measure(lambda: list(self.legacy_search(me, query)), options['repeat'])
+            indexed = measure(lambda: search_messages(me.id, query), options['repeat'])
+            found, _ = search_messages(me.id, query)
+            self.stdout.write(f'vendor: {connection.vendor}, messages: {options["messages"]}, query: {query!r}')
+            self.stdout.write(f'icontains scan: {scan:.2f} ms')
+            self.stdout.write(f'search:         {indexed:.2f} ms ({len(found)} results on the first page)')
+            if connection.vendor != 'mysql':
+                self.stdout.write('FULLTEXT-индекс есть только в MySQL; здесь оба варианта сканируют таблицу')
+        finally:
+            cleanup(users, conversations)
+
+    def fill(self, conversations, sender, vocabulary, count, rnd):
+        # Частоты слов по Ципфу: первые слова словаря встречаются часто, хвост — редко
+        weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+        start = timezone.now() - timedelta(seconds=count)
+        with preserve_auto_now(Message, 'timestamp'):
+            for offset in range(0, count, BATCH_SIZE):
+                Message.objects.bulk_create([
+                    Message(
+                        conversation=conversations[i % len(conversations)],
+                        sender=sender,
+                        content=' '.join(rnd.choices(vocabulary, weights, k=rnd.randint(3, 20))),
+                        timestamp=start + timedelta(seconds=i),
+                    )
+                    for i in range(offset, min(offset + BATCH_SIZE, count))
+                ])
+                self.stdout.write(f'\r{min(offset + BATCH_SIZE, count)}/{count}', ending='')
+        self.stdout.write('')
+
+    def legacy_search(self, user, query):
+        # Единственный вариант до поиска: сканирование с icontains
+        qs = Message.objects.filter(
+            conversation_id__in=ConversationParticipant.objects.filter(user=user).values('conversation_id'),
+            deleted=False,
+        )
+        for word in query.split():
+            qs = qs.filter(content__icontains=word)
+        return qs.order_by('-timestamp', '-id')[:50]
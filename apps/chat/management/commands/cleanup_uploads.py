@@ -0,0 +1,17 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from ...models import UploadSession
+from ...uploads import discard_upload
+
+class Command(BaseCommand):
+    help = 'Удаляет сессии загрузки по частям старше CHAT_UPLOAD_SESSION_TTL вместе с недокачанными файлами'
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(seconds=settings.CHAT_UPLOAD_SESSION_TTL)
+        removed = 0
+        for session in UploadSession.objects.filter(created_at__lt=cutoff).iterator():
+            discard_upload(session)
+            removed += 1
+        self.stdout.write(f'Удалено сессий: {removed}')
@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from apps.users.models import User, Friendship
+from ...history import page_queryset, encode_cursor
+from ...models import Conversation, ConversationParticipant, Message, FileMessage, PinnedMessage
+from ..seed import make_users, make_conversation, fill_messages, cleanup
+
+class Command(BaseCommand):
+    help = 'EXPLAIN для горячих запросов из views.py/consumers.py; ошибка, если какой-то делает полный скан'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=300)
+        parser.add_argument('--conversations', type=int, default=200)
+        parser.add_argument('--messages', type=int, default=200,
+                            help='Сообщений в каждом чате')
+        parser.add_argument('--keep', action='store_true', help='Не удалять сидированные данные')
+        parser.add_argument('--show-plans', action='store_true')
+
+    def handle(self, *args, **options):
+        users, conversations = self.seed(options)
+        try:
+            me = users[0]
+            conv = conversations[0]
+            failures = []
+            for name, qs in self.hot_queries(me, users[1], conv):
+                plan = self.explain(qs)
+                full_scans = self.full_scans(plan)
+                status = self.style.ERROR('FULL SCAN') if full_scans else self.style.SUCCESS('ok')
+                self.stdout.write(f'{name:<28} {status}')
+                if options['show_plans'] or full_scans:
+                    for line in plan:
+                        self.stdout.write(f'    {line}')
+                if full_scans:
+                    failures.append(name)
+        finally:
+            if not options['keep']:
+                cleanup(users, conversations)
+        if failures:
+            raise CommandError(f'Полный скан в запросах: {", ".join(failures)}')
+
+    def seed(self, options):
+        users = make_users(options['users'], prefix='explain')
+        conversations = []
+        for i in range(options['conversations']):
+            members = [users[0]] + [users[(i + k) % len(users)] for k in range(1, 4)]
+            conv = make_conversation(members, name=f'explain {i}')
+            conversations.append(conv)
+            fill_messages(conv, members, options['messages'])
+        FileMessage.objects.bulk_create([
+            FileMessage(message=m, file='chat_files/explain.bin', filename='explain.bin', file_size=1)
+            for m in Message.objects.filter(conversation__in=conversations)[::20]
+        ])
+        Friendship.objects.bulk_create([
+            Friendship(from_user=users[i], to_user=users[(i + k) % len(users)], status='accepted' if k % 2 else 'pending')
+            for i in range(len(users)) for k in range(1, 6)
+        ], ignore_conflicts=True)
+        if connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                for model in (Message, ConversationParticipant, FileMessage, Friendship, User):
+                    cursor.execute(f'ANALYZE TABLE {model._meta.db_table}')
+        elif connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        return users, conversations
+
+    def hot_queries(self, me, friend, conv):
+        last_read = Message.objects.filter(conversation=conv).order_by('-id').values_list('id', flat=True)[10]
+        oldest = list(page_queryset(conv.id)[:50])[-1]
+        return [
+            ('room: membership', Conversation.objects.filter(id=conv.id, participants=me)),
+            ('room: participant', ConversationParticipant.objects.filter(user=me, conversation=conv)),
+            ('room: first page', page_queryset(conv.id)[:51]),
+            ('history: older page', page_queryset(conv.id, encode_cursor(oldest.timestamp, oldest.id))[:51]),
+            ('room: pinned', PinnedMessage.objects.filter(conversation=conv)),
+            ('read: unread tail', Message.objects.filter(conversation=conv, id__gt=last_read).exclude(sender=me)),
+            ('read: seen_up_to', ConversationParticipant.objects.filter(conversation=conv).exclude(user=me)),
+            ('index: inbox', ConversationParticipant.objects.filter(user=me).select_related(
+                'conversation', 'conversation__last_message').order_by('-is_pinned', '-last_activity')),
+            ('fanout: participants', ConversationParticipant.objects.filter(conversation=conv)),
+            ('files: list', FileMessage.objects.filter(message__conversation=conv).order_by('-message__timestamp')),
+            ('friends: accepted', Friendship.objects.filter(Q(from_user=me) | Q(to_user=me), status='accepted')),
+            ('friends: incoming', Friendship.objects.filter(to_user=me, status='pending')),
+            ('friends: outgoing', Friendship.objects.filter(from_user=me, status='pending')),
+            ('friends: are_friends', Friendship.objects.filter(
+                Q(from_user=me, to_user=friend) | Q(from_user=friend, to_user=me), status='accepted')),
+            ('users: tag lookup', User.objects.filter(username=friend.username, discriminator=friend.discriminator)),
+        ]
+
+    def explain(self, qs):
+        sql, params = qs.query.sql_with_params()
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def full_scans(self, plan):
+        vendor = connection.vendor
+        if vendor == 'mysql':
+            return [row for row in plan if row.get('type') == 'ALL']
+        if vendor == 'sqlite':
+            # "SCAN t" без индекса; "SEARCH" и "SCAN t USING ... INDEX" — индексный доступ
+            return [row for row in plan if row['detail'].startswith('SCAN ') and 'INDEX' not in row['detail']]
+        if vendor == 'postgresql':
+            return [row for row in plan if 'Seq Scan' in next(iter(row.values()))]
+        raise CommandError(f'EXPLAIN не поддерживается для {vendor}')
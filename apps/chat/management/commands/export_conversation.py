@@ -0,0 +1,44 @@
+import sys
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ...export import ndjson_stream, zip_stream
+from ...history import InvalidCursor, decode_cursor
+from ...models import Conversation
+
+class Command(BaseCommand):
+    help = 'Выгружает чат в NDJSON или ZIP с вложениями потоком (apps/chat/export.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('conversation_id', type=int)
+        parser.add_argument('--format', choices=('ndjson', 'zip'), default='ndjson')
+        parser.add_argument('--output', '-o', help='Файл; по умолчанию stdout')
+        parser.add_argument('--after', help='Курсор последней выгруженной строки — продолжить с него')
+        parser.add_argument('--chunk-size', type=int, default=settings.CHAT_EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            conversation = Conversation.objects.get(id=options['conversation_id'])
+        except Conversation.DoesNotExist:
+            raise CommandError(f'Чат {options["conversation_id"]} не найден')
+        try:
+            after_key = decode_cursor(options['after']) if options['after'] else None
+        except InvalidCursor:
+            raise CommandError('Некорректный курсор')
+        stream = zip_stream if options['format'] == 'zip' else ndjson_stream
+        if options['output']:
+            # NDJSON с --after дописывается в тот же файл
+            output = open(options['output'], 'ab' if after_key and options['format'] == 'ndjson' else 'wb')
+        else:
+            output = sys.stdout.buffer
+        started = time.perf_counter()
+        written = 0
+        try:
+            for block in stream(conversation, after_key, options['chunk_size']):
+                output.write(block)
+                written += len(block)
+        finally:
+            if options['output']:
+                output.close()
+        if options['output']:
+            self.stdout.write(f'{written} байт за {time.perf_counter() - started:.1f} с -> {options["output"]}')
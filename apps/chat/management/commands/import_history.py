@@ -0,0 +1,48 @@
+import os
+import time
+from django.core.management.base import BaseCommand, CommandError
+from ...importer import run_import
+
+class Command(BaseCommand):
+    help = 'Массовый импорт пользователей, чатов и сообщений из NDJSON (формат — в apps/chat/importer.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON-файл')
+        parser.add_argument('--source', required=True,
+                            help='Имя источника (платформы): повторный запуск с тем же именем не создаёт дубликатов')
+        parser.add_argument('--files', help='Каталог, относительно которого указаны пути вложений')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Процессов для записи сообщений; 1 — в текущем процессе')
+
+    def handle(self, *args, **options):
+        if not os.path.isfile(options['path']):
+            raise CommandError(f'Файл {options["path"]} не найден')
+        if len(options['source']) > 50:
+            raise CommandError('--source длиннее 50 символов')
+        started = time.perf_counter()
+        stats = run_import(
+            options['path'],
+            options['source'],
+            files_root=options['files'],
+            batch_size=options['batch_size'],
+            workers=options['workers'],
+            log=lambda line: self.stdout.write(f'  {line}'),
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Импорт {options["source"]} за {elapsed:.1f} с: '
+            f'{stats["messages"]} сообщений ({stats["messages"] / elapsed:.0f}/с), {stats["files"]} файлов'
+        )
+        if stats['messages_existing']:
+            self.stdout.write(f'Уже были импортированы: {stats["messages_existing"]} сообщений')
+        problems = {key: value for key, value in stats.items() if key in (
+            'invalid_lines', 'users_exhausted', 'messages_orphaned', 'messages_invalid',
+            'unknown_senders', 'files_missing',
+        ) and value}
+        if problems:
+            self.stdout.write(self.style.WARNING(
+                'Пропущено: ' + ', '.join(f'{key}={value}' for key, value in sorted(problems.items()))
+            ))
+        if stats['files']:
+            self.stdout.write('Миниатюры вложений: manage.py backfill_thumbnails')
@@ -0,0 +1,22 @@
+import asyncio
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from ...outbox import OutboxRelay
+
+class Command(BaseCommand):
+    help = 'Рассылает события из OutboxEvent в channel layer (CHAT_OUTBOX_ENABLED); запускается в одном экземпляре'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.CHAT_OUTBOX_BATCH_SIZE)
+        parser.add_argument('--poll-interval', type=float, default=settings.CHAT_OUTBOX_POLL_INTERVAL)
+        parser.add_argument('--once', action='store_true',
+                            help='Разослать накопленное и выйти')
+
+    def handle(self, *args, **options):
+        relay = OutboxRelay(options['batch_size'], options['poll_interval'],
+                            settings.CHAT_OUTBOX_MAX_BACKOFF, settings.CHAT_OUTBOX_COMMIT_LAG)
+        try:
+            asyncio.run(relay.run(once=options['once']))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'Доставлено событий: {relay.delivered}')
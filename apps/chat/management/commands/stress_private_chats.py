@@ -0,0 +1,90 @@
+import random
+import threading
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from ...models import Conversation, ConversationParticipant
+from ..seed import make_users, cleanup
+
+def legacy_get_or_create_private(user1, user2):
+    # Прежний вариант: двойной JOIN по участникам, затем вставка без блокировок
+    qs = Conversation.objects.filter(type='private', participants=user1).filter(participants=user2)
+    if qs.exists():
+        return qs.first(), False
+    conv = Conversation.objects.create(type='private')
+    conv.participants.add(user1, user2)
+    return conv, True
+
+class Command(BaseCommand):
+    help = 'Параллельные вызовы get_or_create_private для одних и тех же пар: проверка отсутствия дубликатов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--calls', type=int, default=50, help='Вызовов на поток')
+        parser.add_argument('--pairs', type=int, default=4)
+        parser.add_argument('--legacy', action='store_true',
+                            help='Прежняя реализация — для сравнения, она создаёт дубликаты')
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        resolve = legacy_get_or_create_private if options['legacy'] else Conversation.objects.get_or_create_private
+        users = make_users(options['pairs'] * 2, prefix='stress')
+        pairs = [(users[i], users[i + 1]) for i in range(0, len(users), 2)]
+        barrier = threading.Barrier(options['threads'])
+        created = Counter()
+        errors = []
+        lock = threading.Lock()
+
+        def worker(index):
+            rnd = random.Random(options['seed'] + index)
+            try:
+                barrier.wait()
+                for _ in range(options['calls']):
+                    user1, user2 = rnd.choice(pairs)
+                    if rnd.random() < 0.5:
+                        user1, user2 = user2, user1
+                    _, was_created = resolve(user1, user2)
+                    if was_created:
+                        with lock:
+                            created[frozenset((user1.id, user2.id))] += 1
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        conversation_ids = set(ConversationParticipant.objects.filter(
+            user__in=users, conversation__type='private'
+        ).values_list('conversation_id', flat=True))
+        conversations = list(Conversation.objects.filter(id__in=conversation_ids))
+        per_pair = Counter()
+        for conversation_id in conversation_ids:
+            members = frozenset(ConversationParticipant.objects.filter(
+                conversation_id=conversation_id
+            ).values_list('user_id', flat=True))
+            per_pair[members] += 1
+        total_calls = options['threads'] * options['calls']
+        self.stdout.write(
+            f'vendor: {connection.vendor}, {options["threads"]} threads x {options["calls"]} calls, '
+            f'{len(pairs)} pairs: {elapsed:.2f} s ({total_calls / elapsed:.0f} calls/s)'
+        )
+        for user1, user2 in pairs:
+            key = frozenset((user1.id, user2.id))
+            self.stdout.write(f'  {user1.id}:{user2.id}  chats: {per_pair[key]}  created=True: {created[key]}')
+        duplicates = sum(count - 1 for count in per_pair.values() if count > 1)
+        try:
+            if errors:
+                raise CommandError(f'{len(errors)} threads failed, first: {errors[0]}')
+            if duplicates:
+                raise CommandError(f'Дубликатов личных чатов: {duplicates}')
+            self.stdout.write('OK: по одному чату на пару')
+        finally:
+            cleanup(users, conversations)
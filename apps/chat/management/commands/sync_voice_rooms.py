@@ -0,0 +1,42 @@
+import time
+from django.core.management.base import BaseCommand
+from ...broadcast import broadcast
+from ...models import VoiceRoom
+from ... import voice
+
+class Command(BaseCommand):
+    help = ('Переносит состояние голосовых комнат из кэша в VoiceRoom.active_users/is_active '
+            'и рассылает user_left для участников, чьё место истекло')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Повторять каждые N секунд; 0 — один проход')
+
+    def handle(self, *args, **options):
+        while True:
+            synced, left = self.sync()
+            if options['verbosity'] > 1 or not options['interval']:
+                self.stdout.write(f'Комнат сверено: {synced}, вышло участников: {left}')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def sync(self):
+        synced = left = 0
+        for room in VoiceRoom.objects.filter(is_active=True).iterator():
+            # user_left — тем, чьё место истекло, в том числе вошедшим после прошлой
+            # сверки. Вышедшие через leave_voice его уже получили и в комнате не лежат
+            for user_id in voice.evict(room.id):
+                broadcast(f'voice_{room.id}', {'type': 'user_left', 'user_id': user_id})
+                left += 1
+            live = voice.member_ids(room.id)
+            stored = set(room.active_users.values_list('id', flat=True))
+            if live != stored:
+                room.active_users.set(live)
+            if not live:
+                VoiceRoom.objects.filter(id=room.id).update(is_active=False)
+                # Вход мог прийти между проверкой и обновлением: тогда комната снова активна
+                if voice.member_ids(room.id):
+                    VoiceRoom.objects.filter(id=room.id).update(is_active=True)
+            synced += 1
+        return synced, left
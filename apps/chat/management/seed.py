@@ -0,0 +1,59 @@
+import secrets
+import statistics
+import time
+from datetime import timedelta
+from django.utils import timezone
+from apps.core.utils import preserve_auto_now
+from apps.users.models import User
+from ..models import Conversation, ConversationParticipant, Message
+
+# Общие помощники для бенчмарков: создают временные данные с префиксом bench_
+
+BATCH_SIZE = 5000
+
+def make_users(count, prefix='bench'):
+    tag = secrets.token_hex(3)
+    users = [
+        User(username=f'{prefix}_{tag}_{i}', email=f'{prefix}_{tag}_{i}@bench.local', discriminator='0001')
+        for i in range(count)
+    ]
+    User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+    return list(User.objects.filter(username__startswith=f'{prefix}_{tag}_').order_by('id'))
+
+def make_conversation(users, conv_type='group', name='bench'):
+    conv = Conversation.objects.create(type=conv_type, name=name)
+    ConversationParticipant.objects.bulk_create(
+        [ConversationParticipant(user=u, conversation=conv) for u in users],
+        batch_size=BATCH_SIZE,
+    )
+    return conv
+
+def fill_messages(conv, senders, count, start=None):
+    # Сообщения с возрастающими timestamp, как в реальной истории
+    start = start or timezone.now() - timedelta(seconds=count)
+    with preserve_auto_now(Message, 'timestamp'):
+        for offset in range(0, count, BATCH_SIZE):
+            Message.objects.bulk_create([
+                Message(
+                    conversation=conv,
+                    sender=senders[i % len(senders)],
+                    content=f'message {i}',
+                    timestamp=start + timedelta(seconds=i),
+                )
+                for i in range(offset, min(offset + BATCH_SIZE, count))
+            ])
+    return Message.objects.filter(conversation=conv).order_by('-id').first()
+
+def measure(fn, repeat=5):
+    # Медиана в миллисекундах
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+def cleanup(users=(), conversations=()):
+    for conv in conversations:
+        conv.delete()
+    User.objects.filter(id__in=[u.id for u in users]).delete()
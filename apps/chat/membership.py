@@ -0,0 +1,103 @@
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from apps.core.generations import bump_generation, get_generation, get_generations
+from apps.core.lru import LocalLRU
+from .models import ConversationParticipant
+
+# Кэш "состоит ли пользователь в чате" по ключу (user_id, conversation_id):
+# локальный LRU процесса -> общий кэш (Redis) -> БД. Кэшируются и отрицательные
+# ответы, поэтому каждое добавление/удаление участника обязано вызвать invalidate().
+# В общем кэше ответы лежат под поколением чата (apps/core/generations.py):
+# invalidate() после коммита увеличивает его, и ответ, прочитанный из БД до
+# изменения, попадает под старое поколение, а не живёт CHAT_MEMBERSHIP_CACHE_TTL.
+# Сброс доходит до общего кэша и LRU текущего процесса; в других процессах
+# устаревший ответ живёт не дольше CHAT_MEMBERSHIP_LOCAL_TTL секунд.
+
+_local = LocalLRU(settings.CHAT_MEMBERSHIP_LOCAL_SIZE, settings.CHAT_MEMBERSHIP_LOCAL_TTL)
+
+def _key(user_id, conversation_id):
+    # Ключ локального LRU
+    return f'chat:member:{int(conversation_id)}:{int(user_id)}'
+
+def _generation_key(conversation_id):
+    return f'chat:member:gen:{int(conversation_id)}'
+
+def _shared_key(user_id, conversation_id, generation):
+    return f'chat:member:{int(conversation_id)}:{generation}:{int(user_id)}'
+
+def is_member(user_id, conversation_id):
+    key = _key(user_id, conversation_id)
+    value = _local.get(key)
+    if value is None:
+        # Поколение — до чтения БД
+        shared_key = _shared_key(user_id, conversation_id, get_generation(_generation_key(conversation_id)))
+        value = cache.get(shared_key)
+        if value is None:
+            value = ConversationParticipant.objects.filter(
+                user_id=user_id, conversation_id=conversation_id
+            ).exists()
+            cache.set(shared_key, value, settings.CHAT_MEMBERSHIP_CACHE_TTL)
+        _local.set(key, value)
+    return value
+
+async def ais_member(user_id, conversation_id):
+    # Попадание в локальный LRU обходится без перехода в пул потоков
+    value = _local.get(_key(user_id, conversation_id))
+    if value is not None:
+        return value
+    return await database_sync_to_async(is_member)(user_id, conversation_id)
+
+def invalidate(conversation_id, *user_ids):
+    # Внутри транзакции поколение растёт после коммита: до него читатель ещё
+    # видит в БД прежний состав
+    keys = [_key(user_id, conversation_id) for user_id in user_ids]
+
+    def bump():
+        for key in keys:
+            _local.delete(key)
+        bump_generation(_generation_key(conversation_id))
+
+    for key in keys:
+        _local.delete(key)
+    transaction.on_commit(bump)
+
+def filter_member_conversations(user_id, conversation_ids):
+    # Пакетная проверка для подписки на много чатов: что не нашлось в кэшах,
+    # проверяется одним запросом к БД
+    keys = {_key(user_id, cid): int(cid) for cid in conversation_ids}
+    allowed, missing = set(), []
+    for key, cid in keys.items():
+        value = _local.get(key)
+        if value is None:
+            missing.append(key)
+        elif value:
+            allowed.add(cid)
+    if missing:
+        generations = get_generations([_generation_key(keys[key]) for key in missing])
+        shared = {
+            _shared_key(user_id, keys[key], generations[_generation_key(keys[key])]): key
+            for key in missing
+        }
+        cached = cache.get_many(list(shared))
+        for shared_key, value in cached.items():
+            _local.set(shared[shared_key], value)
+            if value:
+                allowed.add(keys[shared[shared_key]])
+        unknown = {shared_key: keys[key] for shared_key, key in shared.items() if shared_key not in cached}
+        if unknown:
+            found = set(ConversationParticipant.objects.filter(
+                user_id=user_id, conversation_id__in=unknown.values()
+            ).values_list('conversation_id', flat=True))
+            cache.set_many(
+                {shared_key: cid in found for shared_key, cid in unknown.items()},
+                settings.CHAT_MEMBERSHIP_CACHE_TTL,
+            )
+            for cid in unknown.values():
+                _local.set(_key(user_id, cid), cid in found)
+            allowed |= found
+    return allowed
+
+async def afilter_member_conversations(user_id, conversation_ids):
+    return await database_sync_to_async(filter_member_conversations)(user_id, conversation_ids)
@@ -0,0 +1,45 @@
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def timestamps_to_watermarks(apps, schema_editor):
+    # last_read (дата) -> id последнего сообщения, отправленного не позже этой даты
+    ConversationParticipant = apps.get_model('chat', 'ConversationParticipant')
+    Message = apps.get_model('chat', 'Message')
+    ConversationParticipant.objects.filter(last_read__isnull=False).update(
+        last_read_message=Coalesce(
+            Subquery(
+                Message.objects.filter(
+                    conversation=OuterRef('conversation'),
+                    timestamp__lte=OuterRef('last_read'),
+                ).order_by('-id').values('id')[:1]
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_history_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_read_message',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(timestamps_to_watermarks, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='conversationparticipant',
+            name='last_read',
+        ),
+        migrations.RenameField(
+            model_name='conversationparticipant',
+            old_name='last_read_message',
+            new_name='last_read',
+        ),
+    ]
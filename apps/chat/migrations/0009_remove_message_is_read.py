@@ -0,0 +1,17 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    # Состояние прочтения теперь хранится только в ConversationParticipant.last_read
+
+    dependencies = [
+        ('chat', '0008_conversationparticipant_last_read_watermark'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='message',
+            name='is_read',
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:35
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+
+def backfill_counters(apps, schema_editor):
+    ConversationParticipant = apps.get_model('chat', 'ConversationParticipant')
+    Conversation = apps.get_model('chat', 'Conversation')
+    Message = apps.get_model('chat', 'Message')
+    unread = Message.objects.filter(
+        conversation=OuterRef('conversation'),
+        id__gt=OuterRef('last_read'),
+    ).exclude(sender=OuterRef('user')).order_by().values('conversation').annotate(cnt=Count('id')).values('cnt')
+    ConversationParticipant.objects.update(unread_count=Coalesce(Subquery(unread), 0))
+    # Последняя активность: последнее сообщение чата, иначе дата создания
+    latest = Message.objects.filter(conversation=OuterRef('conversation')).order_by('-id').values('timestamp')[:1]
+    created = Conversation.objects.filter(id=OuterRef('conversation')).values('created_at')[:1]
+    ConversationParticipant.objects.update(last_activity=Coalesce(Subquery(latest), Subquery(created)))
+    # last_message раньше обновлялся только для текстовых сообщений из WebSocket
+    Conversation.objects.update(
+        last_message=Subquery(Message.objects.filter(conversation=OuterRef('pk')).order_by('-id').values('id')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_remove_message_is_read'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='conversationparticipant',
+            name='unread_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='conversationparticipant',
+            index=models.Index(fields=['user', '-is_pinned', '-last_activity'], name='chat_part_inbox'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_conversationparticipant_inbox_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='uid',
+            field=models.UUIDField(blank=True, editable=False, null=True, unique=True),
+        ),
+    ]
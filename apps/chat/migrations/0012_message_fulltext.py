@@ -0,0 +1,35 @@
+from django.db import migrations
+
+# FULLTEXT-индексы для поиска (apps/chat/search.py); создаются только в MySQL
+
+INDEXES = [
+    ('Message', 'content', 'chat_msg_content_ft'),
+    ('FileMessage', 'filename', 'chat_file_name_ft'),
+]
+
+def create_fulltext(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    quote = schema_editor.quote_name
+    for model_name, field, index in INDEXES:
+        table = apps.get_model('chat', model_name)._meta.db_table
+        schema_editor.execute(f'CREATE FULLTEXT INDEX {quote(index)} ON {quote(table)} ({quote(field)})')
+
+def drop_fulltext(apps, schema_editor):
+    if schema_editor.connection.vendor != 'mysql':
+        return
+    quote = schema_editor.quote_name
+    for model_name, field, index in INDEXES:
+        table = apps.get_model('chat', model_name)._meta.db_table
+        schema_editor.execute(f'DROP INDEX {quote(index)} ON {quote(table)}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_message_uid'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fulltext, drop_fulltext),
+    ]
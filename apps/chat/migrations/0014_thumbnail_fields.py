@@ -0,0 +1,39 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:50
+
+import apps.core.thumbnails
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_upload_sessions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversation',
+            name='avatar',
+            field=apps.core.thumbnails.ThumbnailImageField(blank=True, null=True, thumbnail_crop=True, thumbnail_sizes=(64, 256), upload_to='chat_avatars/'),
+        ),
+        migrations.AlterField(
+            model_name='filemessage',
+            name='file',
+            field=apps.core.thumbnails.ThumbnailFileField(thumbnail_sizes=(256, 800), upload_to='chat_files/%Y/%m/%d/'),
+        ),
+        migrations.AlterField(
+            model_name='server',
+            name='avatar',
+            field=apps.core.thumbnails.ThumbnailImageField(blank=True, null=True, thumbnail_crop=True, thumbnail_sizes=(64, 256), upload_to='server_avatars/'),
+        ),
+        migrations.AlterField(
+            model_name='sticker',
+            name='image',
+            field=apps.core.thumbnails.ThumbnailImageField(thumbnail_sizes=(128,), upload_to='stickers/'),
+        ),
+        migrations.AlterField(
+            model_name='stickerpack',
+            name='cover',
+            field=apps.core.thumbnails.ThumbnailImageField(blank=True, null=True, thumbnail_sizes=(128,), upload_to='sticker_packs/'),
+        ),
+    ]
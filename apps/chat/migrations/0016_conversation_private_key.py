@@ -0,0 +1,51 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:05
+
+from itertools import groupby
+from django.db import migrations, models
+
+
+def backfill_private_keys(apps, schema_editor):
+    # Ключ получает старейший личный чат пары; более поздние дубликаты (следствие
+    # прежней гонки) остаются без ключа и доступны из списка чатов как раньше
+    Conversation = apps.get_model('chat', 'Conversation')
+    ConversationParticipant = apps.get_model('chat', 'ConversationParticipant')
+    rows = ConversationParticipant.objects.filter(
+        conversation__type='private'
+    ).order_by('conversation_id').values_list('conversation_id', 'user_id')
+    seen = set()
+    batch = []
+    for conversation_id, members in groupby(rows.iterator(chunk_size=5000), key=lambda row: row[0]):
+        user_ids = sorted({user_id for _, user_id in members})
+        # Чаты, из которых один участник вышел, ключ не получают: пара создаст новый
+        if len(user_ids) != 2:
+            continue
+        key = f'{user_ids[0]}:{user_ids[1]}'
+        if key in seen:
+            continue
+        seen.add(key)
+        batch.append(Conversation(id=conversation_id, private_key=key))
+        if len(batch) >= 1000:
+            Conversation.objects.bulk_update(batch, ['private_key'])
+            batch = []
+    Conversation.objects.bulk_update(batch, ['private_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_outbox_events'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='private_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True),
+        ),
+        migrations.RunPython(backfill_private_keys, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='conversation',
+            name='private_key',
+            field=models.CharField(blank=True, editable=False, max_length=41, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_conversation_private_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='archive_after_days',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='ArchiveSegment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255)),
+                ('first_timestamp', models.DateTimeField()),
+                ('first_id', models.BigIntegerField()),
+                ('last_timestamp', models.DateTimeField()),
+                ('last_id', models.BigIntegerField()),
+                ('count', models.IntegerField()),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('conversation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archive_segments', to='chat.conversation')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['conversation', 'last_timestamp', 'last_id'], name='chat_archive_conv_last')],
+            },
+        ),
+    ]
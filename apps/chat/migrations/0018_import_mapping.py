@@ -0,0 +1,26 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_archive_segments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportMapping',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=50)),
+                ('kind', models.CharField(max_length=20)),
+                ('external_id', models.CharField(max_length=100)),
+                ('internal_id', models.BigIntegerField()),
+            ],
+            options={
+                'unique_together': {('source', 'kind', 'external_id')},
+            },
+        ),
+    ]
@@ -1,15 +1,42 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
 from django.conf import settings
+from django.utils import timezone
+from apps.core.thumbnails import ThumbnailFileField, ThumbnailImageField
 import secrets
+import uuid
+
+def private_key(user1_id, user2_id):
+    # Каноничный ключ пары для личного чата: "<меньший id>:<больший id>"
+    low, high = sorted((int(user1_id), int(user2_id)))
+    return f'{low}:{high}'
 
 class ConversationManager(models.Manager):
     def get_or_create_private(self, user1, user2):
-        qs = self.filter(type='private', participants=user1).filter(participants=user2)
-        if qs.exists():
-            return qs.first(), False
-        conv = self.create(type='private')
-        conv.participants.add(user1, user2)
-        return conv, True
+        # Поиск по уникальному private_key; при гонке двух вставок вторая получает
+        # IntegrityError и забирает чат, созданный первой
+        key = private_key(user1.id, user2.id)
+        conv = self.filter(private_key=key).first()
+        created = False
+        if conv is None:
+            try:
+                with transaction.atomic():
+                    conv = self.create(type='private', private_key=key)
+                    conv.participants.add(user1, user2)
+                created = True
+            except IntegrityError:
+                conv = self.get(private_key=key)
+        from . import membership
+        if not created:
+            # Участник мог удалить чат у себя (delete_chat): возвращаем его в тот же чат
+            missing = [u for u in (user1, user2) if not membership.is_member(u.id, conv.id)]
+            if not missing:
+                return conv, False
+            ConversationParticipant.objects.bulk_create(
+                [ConversationParticipant(user=u, conversation=conv) for u in missing],
+                ignore_conflicts=True,
+            )
+        membership.invalidate(conv.id, user1.id, user2.id)
+        return conv, created
 
 class Conversation(models.Model):
     CONV_TYPE = [
@@ -19,11 +46,16 @@ class Conversation(models.Model):
     ]
     type = models.CharField(max_length=10, choices=CONV_TYPE)
     name = models.CharField(max_length=100, blank=True, null=True)
-    avatar = models.ImageField(upload_to='chat_avatars/', blank=True, null=True)
+    avatar = ThumbnailImageField(upload_to='chat_avatars/', blank=True, null=True, thumbnail_sizes=(64, 256), thumbnail_crop=True)
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, through='ConversationParticipant')
     created_at = models.DateTimeField(auto_now_add=True)
     last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='owned_chats')
+    # Только у личных чатов: пара участников, см. private_key()
+    private_key = models.CharField(max_length=41, unique=True, null=True, blank=True, editable=False)
+    # Через сколько дней сообщения уходят в архив (apps/chat/archive.py):
+    # None — CHAT_ARCHIVE_AFTER_DAYS, 0 — чат не архивируется
+    archive_after_days = models.PositiveIntegerField(null=True, blank=True)
 
     objects = ConversationManager()
 
@@ -32,16 +64,68 @@ class Conversation(models.Model):
             return f'Private chat {self.id}'
         return self.name or f'Group {self.id}'
 
+class ConversationParticipantManager(models.Manager):
+    def mark_read(self, user_id, conversation_id, message_id):
+        # Сдвигает водяной знак прочтения вперёд и пересчитывает счётчик по
+        # хвосту после него. message_id приходит от клиента: знак ставится на
+        # последнее сообщение этого чата не новее него, чужой или выдуманный id
+        # не уводит знак за будущие сообщения.
+        # Пересчёт идёт под блокировкой строки участника: register_messages
+        # увеличивает счётчик в транзакции сообщения под той же блокировкой,
+        # поэтому сообщение попадает либо в пересчёт, либо в инкремент, не в оба.
+        # Знак может оказаться выше прочитанного сообщения при ненулевом счётчике:
+        # импорт старой истории в живой чат (importer.finalize) поднимает знак
+        # над новыми id импортированных сообщений, а живое непрочитанное остаётся
+        # ниже. Такой счётчик пересчитывается и без сдвига знака.
+        # Возвращает новый водяной знак или None, если он не изменился
+        message_id = Message.objects.filter(
+            conversation_id=conversation_id, id__lte=message_id,
+        ).aggregate(top=models.Max('id'))['top']
+        if message_id is None:
+            return None
+        with transaction.atomic():
+            participant = self.select_for_update().filter(
+                models.Q(last_read__lt=message_id) | models.Q(unread_count__gt=0),
+                user_id=user_id,
+                conversation_id=conversation_id,
+            ).values_list('id', 'last_read').first()
+            if participant is None:
+                return None
+            participant, last_read = participant
+            watermark = max(last_read, message_id)
+            # Обычное чтение после блокировки: видит всё, что закоммичено до неё
+            remaining = Message.objects.filter(
+                conversation_id=conversation_id,
+                id__gt=watermark,
+            ).exclude(sender_id=user_id).count()
+            self.filter(id=participant).update(last_read=watermark, unread_count=remaining)
+        return watermark if watermark != last_read else None
+
+    def seen_up_to(self, conversation_id, user_id):
+        # Максимальный id, прочитанный кем-то из остальных участников
+        return self.filter(conversation_id=conversation_id).exclude(user_id=user_id).aggregate(
+            seen=models.Max('last_read')
+        )['seen'] or 0
+
 class ConversationParticipant(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
     joined_at = models.DateTimeField(auto_now_add=True)
-    last_read = models.DateTimeField(null=True, blank=True)
+    last_read = models.BigIntegerField(default=0)  # id последнего прочитанного сообщения
     is_admin = models.BooleanField(default=False)
     is_pinned = models.BooleanField(default=False)  # закреплён ли чат для пользователя
+    # Денормализация для списка чатов, обновляется в services.register_messages
+    unread_count = models.IntegerField(default=0)
+    last_activity = models.DateTimeField(default=timezone.now)
+
+    objects = ConversationParticipantManager()
 
     class Meta:
         unique_together = ('user', 'conversation')
+        indexes = [
+            # Список чатов: закреплённые сверху, затем по последней активности
+            models.Index(fields=['user', '-is_pinned', '-last_activity'], name='chat_part_inbox'),
+        ]
 
 class Message(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
@@ -50,18 +134,78 @@ class Message(models.Model):
     sticker = models.ForeignKey('Sticker', on_delete=models.SET_NULL, null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
     edited_at = models.DateTimeField(null=True, blank=True)
-    is_read = models.BooleanField(default=False)
     deleted = models.BooleanField(default=False)
+    # Клиентский ключ идемпотентности: повторная отправка не создаёт дубликат
+    uid = models.UUIDField(null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # Ключ курсорной пагинации истории (см. history.fetch_page)
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='chat_msg_conv_ts_id'),
+        ]
 
     def __str__(self):
         return f'{self.sender}: {self.content[:20] if self.content else "Стикер"}'
 
 class FileMessage(models.Model):
     message = models.OneToOneField(Message, on_delete=models.CASCADE, related_name='file')
-    file = models.FileField(upload_to='chat_files/%Y/%m/%d/')
+    file = ThumbnailFileField(upload_to='chat_files/%Y/%m/%d/', thumbnail_sizes=(256, 800))
     filename = models.CharField(max_length=255)
-    file_size = models.IntegerField()
+    file_size = models.BigIntegerField()
     file_type = models.CharField(max_length=100, blank=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+
+class UploadSession(models.Model):
+    # Возобновляемая загрузка по частям (apps/chat/uploads.py): части пишутся
+    # сразу в storage_name, FileMessage создаётся только при завершении
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=100, blank=True)
+    storage_name = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)  # ожидаемый хэш всего файла от клиента
+    message = models.OneToOneField(Message, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class OutboxEvent(models.Model):
+    # Событие channel layer, записанное в одной транзакции с изменением данных;
+    # рассылает его relay_outbox (apps/chat/outbox.py)
+    id = models.BigAutoField(primary_key=True)
+    group = models.CharField(max_length=100)
+    event = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+class ImportMapping(models.Model):
+    # Внешний id из импорта (apps/chat/importer.py) -> id в Aura. Сообщениям
+    # строки не нужны: их ключ — детерминированный Message.uid (importer.message_uid)
+    source = models.CharField(max_length=50)
+    kind = models.CharField(max_length=20)  # user | conversation
+    external_id = models.CharField(max_length=100)
+    internal_id = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ('source', 'kind', 'external_id')
+
+class ArchiveSegment(models.Model):
+    # Сжатый NDJSON-файл со старыми сообщениями чата (apps/chat/archive.py).
+    # Границы — ключ истории (timestamp, id) первого и последнего сообщения
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='archive_segments')
+    name = models.CharField(max_length=255)
+    first_timestamp = models.DateTimeField()
+    first_id = models.BigIntegerField()
+    last_timestamp = models.DateTimeField()
+    last_id = models.BigIntegerField()
+    count = models.IntegerField()
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['conversation', 'last_timestamp', 'last_id'], name='chat_archive_conv_last'),
+        ]
 
 class PinnedMessage(models.Model):
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='pinned_messages')
@@ -77,14 +221,14 @@ class StickerPack(models.Model):
     author = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     is_official = models.BooleanField(default=False)
-    cover = models.ImageField(upload_to='sticker_packs/', blank=True, null=True)
+    cover = ThumbnailImageField(upload_to='sticker_packs/', blank=True, null=True, thumbnail_sizes=(128,))
 
     def __str__(self):
         return self.name
 
 class Sticker(models.Model):
     pack = models.ForeignKey(StickerPack, on_delete=models.CASCADE, related_name='stickers')
-    image = models.ImageField(upload_to='stickers/')
+    image = ThumbnailImageField(upload_to='stickers/', thumbnail_sizes=(128,))
     emoji = models.CharField(max_length=10, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -141,7 +285,7 @@ class BotParticipant(models.Model):
 class Server(models.Model):
     name = models.CharField(max_length=100)
     owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='owned_servers')
-    avatar = models.ImageField(upload_to='server_avatars/', blank=True, null=True)
+    avatar = ThumbnailImageField(upload_to='server_avatars/', blank=True, null=True, thumbnail_sizes=(64, 256), thumbnail_crop=True)
     members = models.ManyToManyField(settings.AUTH_USER_MODEL, through='ServerMember')
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from .models import OutboxEvent
+
+logger = logging.getLogger(__name__)
+
+# Доставка событий из OutboxEvent (пишет broadcast.publish) в channel layer.
+#
+# Гарантии:
+# - at-least-once: строка удаляется только после успешного group_send, поэтому
+#   при падении между ними событие уйдёт повторно. Клиент это переносит:
+#   chat_message отбрасывается по id, правки, удаления и закрепления идемпотентны;
+# - порядок внутри группы (чата) — по id строки: события одной группы шлются
+#   последовательно, после первой ошибки остаток группы ждёт повтора;
+#   разные группы пачки шлются параллельно;
+# - рассылаются только строки не выше safe — id, ниже которого все строки уже
+#   закоммичены. Автоинкремент выдаётся при вставке, а коммит бывает позже:
+#   строка 11 может стать видна раньше строки 10. Пропуск в id перед следующей
+#   строкой держит safe, пока не пройдёт CHAT_OUTBOX_COMMIT_LAG секунд, — потом
+#   пропуск считается откатом. После запуска неизвестно, нет ли незакоммиченных
+#   строк ниже первой видимой, поэтому первая рассылка тоже ждёт этот срок;
+# - пауза после ошибки — своя у каждой группы (растёт до CHAT_OUTBOX_MAX_BACKOFF),
+#   пока она идёт, строки группы не выбираются: застрявший чат не задерживает
+#   остальные и не занимает пачку;
+# - relay рассчитан на один экземпляр: два процесса разошлют события дважды
+#   и могут нарушить порядок.
+
+def fetch_ids_after(after, limit):
+    qs = OutboxEvent.objects.order_by('id')
+    if after is not None:
+        qs = qs.filter(id__gt=after)
+    return list(qs.values_list('id', flat=True)[:limit])
+
+def fetch_batch(limit, up_to, skip_groups=()):
+    qs = OutboxEvent.objects.filter(id__lte=up_to).order_by('id')
+    if skip_groups:
+        qs = qs.exclude(group__in=skip_groups)
+    return list(qs.values_list('id', 'group', 'event')[:limit])
+
+def delete_delivered(ids):
+    OutboxEvent.objects.filter(id__in=ids).delete()
+
+class OutboxRelay:
+    def __init__(self, batch_size, poll_interval, max_backoff, commit_lag):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.commit_lag = commit_lag
+        # Все строки с id <= safe закоммичены (или их уже не будет)
+        self.safe = None
+        # (safe, с какого момента) — пропуск в id сразу после safe
+        self.gap = None
+        # Строк выше safe на последнем просмотре
+        self.held = 0
+        self.channel_layer = get_channel_layer()
+        self.delivered = 0
+        # группа -> (когда повторить, текущая пауза)
+        self.backoff = {}
+
+    async def run(self, once=False):
+        while True:
+            fetched, delivered = await self.relay_batch()
+            if once and not fetched and not self.backoff and not self.held:
+                return
+            if fetched < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    def backing_off(self):
+        now = time.monotonic()
+        return [group for group, (until, _) in self.backoff.items() if until > now]
+
+    def failed(self, group):
+        # Channel layer не принял событие группы: повтор с нарастающей паузой
+        _, delay = self.backoff.get(group, (0, self.poll_interval))
+        delay = min(delay * 2, self.max_backoff)
+        self.backoff[group] = (time.monotonic() + delay, delay)
+
+    async def advance(self):
+        # Поднимает safe по непрерывным id; пропуск ждёт commit_lag
+        ids = await database_sync_to_async(fetch_ids_after)(self.safe, self.batch_size)
+        now = time.monotonic()
+        for event_id in ids:
+            if self.safe is None or event_id != self.safe + 1:
+                if self.gap is None or self.gap[0] != self.safe:
+                    self.gap = (self.safe, now)
+                if now - self.gap[1] < self.commit_lag:
+                    break
+            self.safe = event_id
+        self.held = sum(1 for event_id in ids if self.safe is None or event_id > self.safe)
+
+    async def relay_batch(self):
+        # Возвращает (выбрано, доставлено)
+        await self.advance()
+        if self.safe is None:
+            return 0, 0
+        rows = await database_sync_to_async(fetch_batch)(self.batch_size, self.safe, self.backing_off())
+        if not rows:
+            return 0, 0
+        groups = defaultdict(list)
+        for row in rows:
+            groups[row[1]].append(row)
+        results = await asyncio.gather(*(self.send_group(group, events) for group, events in groups.items()))
+        for (group, events), ids in zip(groups.items(), results):
+            if len(ids) < len(events):
+                self.failed(group)
+            else:
+                self.backoff.pop(group, None)
+        delivered = [event_id for ids in results for event_id in ids]
+        if delivered:
+            await database_sync_to_async(delete_delivered)(delivered)
+        self.delivered += len(delivered)
+        return len(rows), len(delivered)
+
+    async def send_group(self, group, events):
+        delivered = []
+        for event_id, _, event in events:
+            try:
+                await self.channel_layer.group_send(group, event)
+            except Exception as e:
+                logger.error(f"Outbox relay failed for {group} (event {event_id}): {e}")
+                break
+            delivered.append(event_id)
+        return delivered
@@ -0,0 +1,191 @@
+import asyncio
+import atexit
+import logging
+import weakref
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from apps.core.events import encode_event
+from apps.core.utils import preserve_auto_now
+from .models import Message
+from .services import register_messages
+
+logger = logging.getLogger(__name__)
+
+# Отложенная пакетная запись сообщений (включается CHAT_WRITE_BEHIND).
+#
+# Гарантии:
+# - сообщение рассылается сразу с uid и pending=True, ещё без id в БД;
+# - оно считается сохранённым только после коммита пакета, тогда в группу
+#   чата уходит message_saved с соответствием uid -> id;
+# - пакет пишется до CHAT_WRITE_BEHIND_RETRIES попыток с растущей паузой;
+#   повторы идут в отдельной задаче, следующие пакеты их не ждут (и могут
+#   получить id раньше). После последней неудачи в группу уходит
+#   message_failed с uid потерянных сообщений;
+# - при штатной остановке процесса (SIGTERM у Daphne, atexit) всё ещё не
+#   записанное пишется синхронно, без message_saved: клиент узнает id после
+#   переподключения;
+# - при падении процесса теряются сообщения, ещё не записанные в БД
+#   (не более одного окна CHAT_WRITE_BEHIND_FLUSH_INTERVAL и пакетов в повторе).
+#   Клиент переотправляет всё, на что не пришёл message_saved; uid уникален,
+#   поэтому повтор не создаёт дубликат и не увеличивает счётчики.
+#
+# Проверки — apps/chat/tests.py (WriteBehindTests).
+
+@dataclass
+class PendingMessage:
+    uid: object
+    conversation_id: int
+    sender_id: int
+    content: str
+    timestamp: datetime
+
+def persist_batch(batch):
+    # Возвращает {conversation_id: [Message]} для всех uid пакета. Уже записанные
+    # uid (повторная отправка) не вставляются и счётчики повторно не трогают
+    uids = [p.uid for p in batch]
+    owners = {p.uid: (p.conversation_id, p.sender_id) for p in batch}
+    with transaction.atomic():
+        existing = set(Message.objects.filter(uid__in=uids).values_list('uid', flat=True))
+        # Время — то, что уже разослано клиентам, а не момент записи пакета.
+        # preserve_auto_now меняет поле глобально; остальной ORM процесса идёт
+        # в том же потоке database_sync_to_async, поэтому параллельных save нет
+        with preserve_auto_now(Message, 'timestamp'):
+            Message.objects.bulk_create([
+                Message(
+                    uid=p.uid,
+                    conversation_id=p.conversation_id,
+                    sender_id=p.sender_id,
+                    content=p.content,
+                    timestamp=p.timestamp,
+                )
+                for p in batch if p.uid not in existing
+            ], ignore_conflicts=True)
+        # Свои uid сверяем с отправителем и чатом: чужой uid не раскрывает чужое сообщение
+        saved = defaultdict(list)
+        created = defaultdict(list)
+        for msg in Message.objects.filter(uid__in=uids):
+            if owners[msg.uid] == (msg.conversation_id, msg.sender_id):
+                saved[msg.conversation_id].append(msg)
+                if msg.uid not in existing:
+                    created[msg.conversation_id].append(msg)
+        for conversation_id, messages in created.items():
+            register_messages(conversation_id, messages)
+    return saved
+
+class MessageWriteBuffer:
+    def __init__(self, flush_interval, max_batch, retries):
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retries = retries
+        self.queue = asyncio.Queue()
+        self.task = None
+        # uid -> PendingMessage: в очереди, в записи или ждут повтора
+        self.unsaved = {}
+        self.retrying = set()
+
+    def submit(self, uid, conversation_id, sender_id, content):
+        pending = PendingMessage(uid, int(conversation_id), sender_id, content, timezone.now())
+        self.unsaved[uid] = pending
+        self.queue.put_nowait(pending)
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return pending
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.flush(batch)
+            except Exception as e:
+                logger.error(f"Write-behind batch dropped: {e}")
+
+    async def flush(self, batch, attempt=1):
+        try:
+            saved = await database_sync_to_async(persist_batch)(batch)
+        except Exception as e:
+            logger.error(f"Write-behind flush failed (attempt {attempt}/{self.retries}): {e}")
+            if attempt < self.retries:
+                task = asyncio.get_running_loop().create_task(self.retry(batch, attempt + 1))
+                self.retrying.add(task)
+                task.add_done_callback(self.retrying.discard)
+            else:
+                await self.report(batch, 'message_failed', failed_events(batch))
+            return
+        await self.report(batch, 'message_saved', saved_events(saved))
+
+    async def retry(self, batch, attempt):
+        await asyncio.sleep(self.flush_interval * 2 ** attempt)
+        await self.flush(batch, attempt)
+
+    async def report(self, batch, event_type, events):
+        # Пакет закрыт (записан или потерян); ошибка рассылки не должна остановить run
+        channel_layer = get_channel_layer()
+        for conversation_id, payload in events.items():
+            try:
+                await channel_layer.group_send(f'chat_{conversation_id}', encode_event(
+                    event_type, conversation_id=conversation_id, **payload,
+                ))
+            except Exception as e:
+                logger.error(f"Write-behind {event_type} for chat {conversation_id} not sent: {e}")
+        for p in batch:
+            # Повтор uid мог встать в очередь заново — его запись ещё впереди
+            if self.unsaved.get(p.uid) is p:
+                del self.unsaved[p.uid]
+
+    def flush_on_exit(self):
+        # atexit: цикл событий уже остановлен, потоки пула завершены —
+        # недописанное пишется здесь синхронно. Пакеты, которые успели
+        # закоммититься без ответа, повторно не вставятся (uid)
+        pending = list(self.unsaved.values())
+        for offset in range(0, len(pending), self.max_batch):
+            try:
+                persist_batch(pending[offset:offset + self.max_batch])
+            except Exception:
+                logger.exception(f"Write-behind shutdown flush lost {len(pending) - offset} messages")
+                return
+        self.unsaved.clear()
+
+def failed_events(batch):
+    failed = defaultdict(list)
+    for p in batch:
+        failed[p.conversation_id].append(str(p.uid))
+    return {conversation_id: {'uids': uids} for conversation_id, uids in failed.items()}
+
+def saved_events(saved):
+    return {
+        conversation_id: {'messages': [
+            {'uid': str(m.uid), 'id': m.id, 'timestamp': m.timestamp.isoformat()}
+            for m in messages
+        ]}
+        for conversation_id, messages in saved.items()
+    }
+
+_buffers = weakref.WeakKeyDictionary()
+
+def get_write_buffer():
+    # Один буфер на цикл событий процесса
+    loop = asyncio.get_running_loop()
+    if loop not in _buffers:
+        _buffers[loop] = MessageWriteBuffer(
+            settings.CHAT_WRITE_BEHIND_FLUSH_INTERVAL,
+            settings.CHAT_WRITE_BEHIND_MAX_BATCH,
+            settings.CHAT_WRITE_BEHIND_RETRIES,
+        )
+        atexit.register(_buffers[loop].flush_on_exit)
+    return _buffers[loop]
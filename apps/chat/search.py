@@ -0,0 +1,70 @@
+import re
+from django.conf import settings
+from django.db import NotSupportedError, connection, models
+from django.db.models import Lookup, Q
+from .history import before_cursor, encode_cursor, PAGE_SIZE
+from .models import ConversationParticipant, Message
+
+# Поиск по сообщениям. В MySQL работает через FULLTEXT-индексы на
+# Message.content и FileMessage.filename (миграция 0012): InnoDB сам
+# поддерживает индекс при создании и редактировании, а удалённые сообщения
+# (deleted=True) отсекаются фильтром. На остальных СУБД (разработка на sqlite)
+# используется icontains — без индекса, только для небольших баз.
+#
+# Результаты — только из чатов пользователя, от новых к старым, курсор тот же,
+# что и у истории (timestamp, id).
+
+MAX_TERMS = 8
+
+class FullTextMatch(Lookup):
+    lookup_name = 'fulltext'
+
+    def as_mysql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'MATCH ({lhs}) AGAINST ({rhs} IN BOOLEAN MODE)', lhs_params + rhs_params
+
+    def as_sql(self, compiler, connection):
+        raise NotSupportedError('fulltext lookup is only supported on MySQL')
+
+models.CharField.register_lookup(FullTextMatch)
+models.TextField.register_lookup(FullTextMatch)
+
+def parse_terms(query):
+    # Слова короче CHAT_SEARCH_MIN_TERM не попадают в FULLTEXT-индекс InnoDB
+    words = re.findall(r'\w+', query.lower())
+    return [w for w in words if len(w) >= settings.CHAT_SEARCH_MIN_TERM][:MAX_TERMS]
+
+def match(field, terms):
+    if connection.vendor == 'mysql':
+        # Все слова обязательны, каждое — как префикс
+        return Q(**{f'{field}__fulltext': ' '.join(f'+{term}*' for term in terms)})
+    condition = Q()
+    for term in terms:
+        condition &= Q(**{f'{field}__icontains': term})
+    return condition
+
+def search_messages(user_id, query, before=None, limit=PAGE_SIZE):
+    # Возвращает (сообщения от новых к старым, курсор следующей страницы или None)
+    terms = parse_terms(query)
+    if not terms:
+        return [], None
+    qs = Message.objects.filter(
+        conversation_id__in=ConversationParticipant.objects.filter(user_id=user_id).values('conversation_id'),
+        deleted=False,
+    )
+    if before:
+        qs = qs.filter(before_cursor(before))
+    qs = qs.select_related('sender', 'sticker', 'file').order_by('-timestamp', '-id')
+    # Текст и имена файлов — два отдельных запроса, каждый по своему индексу
+    # (OR между MATCH по разным таблицам индексы не использует); слияние в памяти
+    found = {}
+    for condition in (match('content', terms), match('file__filename', terms)):
+        for message in qs.filter(condition)[:limit + 1]:
+            found[message.id] = message
+    rows = sorted(found.values(), key=lambda m: (m.timestamp, m.id), reverse=True)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].timestamp, rows[-1].id)
+    return rows, next_cursor
@@ -0,0 +1,130 @@
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from apps.core.events import encode_event
+from .broadcast import chat_message_event, file_message_event, publish
+from .models import Conversation, ConversationParticipant, FileMessage, Message, PinnedMessage
+
+def register_messages(conversation_id, messages):
+    # Вызывается в транзакции, сохранившей сообщения одного чата: двигает
+    # last_message и обновляет счётчики непрочитанного и last_activity
+    # участников. UPDATE блокирует строки участников до коммита сообщений —
+    # так инкремент не пересекается с пересчётом в mark_read
+    messages = sorted(messages, key=lambda m: m.id)
+    if not messages:
+        return
+    last = messages[-1]
+    # Для отправителя: его последнее сообщение считается прочитанным,
+    # непрочитанными остаются только чужие сообщения после него
+    own_last = {}
+    for m in messages:
+        own_last[m.sender_id] = m.id
+    with transaction.atomic():
+        Conversation.objects.filter(
+            Q(last_message__isnull=True) | Q(last_message_id__lt=last.id),
+            id=conversation_id,
+        ).update(last_message=last)
+        participants = ConversationParticipant.objects.filter(conversation_id=conversation_id)
+        others = participants.exclude(user_id__in=own_last.keys())
+        # Водяной знак уже за пакетом (прочтение закоммичено раньше): счётчик не растёт
+        others.filter(last_read__lt=last.id).update(
+            unread_count=F('unread_count') + len(messages),
+            last_activity=last.timestamp,
+        )
+        others.filter(last_read__gte=last.id).update(last_activity=last.timestamp)
+        for sender_id, last_own_id in own_last.items():
+            after = sum(1 for m in messages if m.id > last_own_id and m.sender_id != sender_id)
+            participants.filter(user_id=sender_id).update(
+                unread_count=after,
+                last_read=Greatest(F('last_read'), Value(last_own_id)),
+                last_activity=last.timestamp,
+            )
+
+# Изменения из представлений: данные и событие для чата пишутся в одной
+# транзакции (publish, см. broadcast.py). Async-представления вызывают их через acommit()
+
+def create_file_message(user, conversation_id, uploaded_file):
+    with transaction.atomic():
+        message = Message.objects.create(
+            conversation_id=conversation_id,
+            sender=user,
+            content='📎 Файл'
+        )
+        file_msg = FileMessage.objects.create(
+            message=message,
+            file=uploaded_file,
+            filename=uploaded_file.name,
+            file_size=uploaded_file.size,
+            file_type=uploaded_file.content_type
+        )
+        register_messages(conversation_id, [message])
+        publish(f'chat_{conversation_id}', file_message_event(user, message, file_msg))
+    return file_msg
+
+def create_sticker_message(user, conversation_id, sticker):
+    with transaction.atomic():
+        message = Message.objects.create(
+            conversation_id=conversation_id,
+            sender=user,
+            sticker=sticker,
+            content=''
+        )
+        register_messages(conversation_id, [message])
+        publish(f'chat_{conversation_id}', chat_message_event(
+            user, message,
+            content='',
+            sticker_id=sticker.id,
+            sticker_url=sticker.image.thumbnail_url(128),
+        ))
+    return message
+
+def edit_message(message, content):
+    with transaction.atomic():
+        message.content = content
+        message.edited_at = timezone.now()
+        message.save()
+        publish(f'chat_{message.conversation_id}', encode_event(
+            'edit_message',
+            conversation_id=message.conversation_id,
+            id=message.id,
+            content=content,
+            edited_at=message.edited_at.isoformat(),
+        ))
+
+def delete_message(message):
+    with transaction.atomic():
+        message.deleted = True
+        message.save()
+        publish(f'chat_{message.conversation_id}', encode_event(
+            'delete_message',
+            conversation_id=message.conversation_id,
+            id=message.id,
+        ))
+
+def pin_message(message, user):
+    # Возвращает True, если закреплённое сообщение чата заменено
+    with transaction.atomic():
+        pinned, created = PinnedMessage.objects.get_or_create(
+            conversation_id=message.conversation_id,
+            defaults={'message': message, 'pinned_by': user}
+        )
+        if not created:
+            pinned.message = message
+            pinned.pinned_by = user
+            pinned.save()
+        publish(f'chat_{message.conversation_id}', encode_event(
+            'pin_message',
+            conversation_id=message.conversation_id,
+            message_id=message.id,
+            content=message.content[:50],
+        ))
+    return not created
+
+def unpin_message(conversation_id):
+    with transaction.atomic():
+        PinnedMessage.objects.filter(conversation_id=conversation_id).delete()
+        publish(f'chat_{conversation_id}', encode_event(
+            'unpin_message',
+            conversation_id=conversation_id,
+        ))
@@ -0,0 +1,23 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from apps.core.thumbnails import thumbnails_ready
+from . import stickers
+from .archive import archive_storage
+from .models import ArchiveSegment, Sticker, StickerPack
+
+@receiver([post_save, post_delete], sender=StickerPack)
+@receiver([post_save, post_delete], sender=Sticker)
+def sticker_catalog_changed(sender, **kwargs):
+    transaction.on_commit(stickers.invalidate)
+
+@receiver(thumbnails_ready, sender=StickerPack)
+@receiver(thumbnails_ready, sender=Sticker)
+def sticker_thumbnails_ready(sender, **kwargs):
+    # В каталоге лежали URL оригиналов, теперь есть копии
+    stickers.invalidate()
+
+@receiver(post_delete, sender=ArchiveSegment)
+def archive_segment_deleted(sender, instance, **kwargs):
+    # Файл сегмента удаляется вместе со строкой (в том числе при удалении чата)
+    transaction.on_commit(lambda: archive_storage.delete(instance.name))
@@ -0,0 +1,70 @@
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from apps.core.generations import bump_generation, get_generation
+from apps.core.lru import LocalLRU
+from .models import StickerPack
+
+# Каталог стикеров — компактный JSON (наборы, id, emoji, URL копий), версия —
+# хэш содержимого. Хранится в LRU процесса и в общем кэше; сигналы на
+# StickerPack/Sticker (signals.py) сбрасывают оба. Другие процессы увидят
+# новую версию не позже чем через STICKER_MANIFEST_LOCAL_TTL секунд.
+# Текущая версия лежит под поколением каталога (apps/core/generations.py):
+# каталог, собранный из БД до изменения, не вернёт старую версию после сброса.
+#
+# Страница чата получает только версию и загружает каталог с
+# /chat/stickers/manifest/?v=<версия>, который браузер кэширует надолго.
+
+GENERATION_KEY = 'stickers:gen'
+STICKER_THUMBNAIL_SIZE = 128
+
+_local = LocalLRU(4, settings.STICKER_MANIFEST_LOCAL_TTL)
+
+class Manifest:
+    __slots__ = ('version', 'text', 'data')
+
+    def __init__(self, version, text):
+        self.version = version
+        self.text = text
+        self.data = json.loads(text)
+
+def _manifest_key(version):
+    return f'stickers:manifest:{version}'
+
+def build_manifest_text():
+    packs = []
+    for pack in StickerPack.objects.prefetch_related('stickers').order_by('-is_official', 'id'):
+        packs.append({
+            'id': pack.id,
+            'name': pack.name,
+            'cover': pack.cover.thumbnail_url(STICKER_THUMBNAIL_SIZE) if pack.cover else None,
+            'stickers': [
+                {'id': s.id, 'emoji': s.emoji, 'url': s.image.thumbnail_url(STICKER_THUMBNAIL_SIZE)}
+                for s in sorted(pack.stickers.all(), key=lambda s: s.id)
+            ],
+        })
+    return json.dumps({'packs': packs}, ensure_ascii=False, separators=(',', ':'))
+
+def get_manifest():
+    manifest = _local.get('current')
+    if manifest is not None:
+        return manifest
+    # Поколение — до чтения БД
+    version_key = f'stickers:version:{get_generation(GENERATION_KEY)}'
+    version = cache.get(version_key)
+    text = cache.get(_manifest_key(version)) if version else None
+    if text is None:
+        text = build_manifest_text()
+        version = hashlib.sha1(text.encode()).hexdigest()[:16]
+        cache.set_many({
+            _manifest_key(version): text,
+            version_key: version,
+        }, settings.STICKER_MANIFEST_CACHE_TTL)
+    manifest = Manifest(version, text)
+    _local.set('current', manifest)
+    return manifest
+
+def invalidate():
+    _local.clear()
+    bump_generation(GENERATION_KEY)
@@ -0,0 +1,499 @@
+import asyncio
+import base64
+import json
+import os
+import tempfile
+import uuid
+from datetime import timedelta
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import Max
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from apps.users.models import User
+from . import membership, outbox, persistence
+from .downloads import serve_file
+from .history import InvalidCursor, decode_cursor, encode_cursor
+from .importer import run_import
+from .models import Conversation, ConversationParticipant, FileMessage, Message, OutboxEvent, private_key
+from .outbox import OutboxRelay
+from .persistence import MessageWriteBuffer, PendingMessage, persist_batch
+from .services import register_messages
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+FLUSH_INTERVAL = 0.02
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class WriteBehindTests(TransactionTestCase):
+    # Гарантии отложенной записи из persistence.py. TransactionTestCase:
+    # запись идёт в потоках database_sync_to_async, им нужны закоммиченные данные
+
+    def setUp(self):
+        self.alice = User.objects.create(username='alice', email='alice@example.com', discriminator='0001')
+        self.bob = User.objects.create(username='bob', email='bob@example.com', discriminator='0001')
+        self.conversation = Conversation.objects.create(type='group', name='wb')
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(user=user, conversation=self.conversation)
+            for user in (self.alice, self.bob)
+        ])
+
+    def unread(self, user):
+        return ConversationParticipant.objects.get(user=user, conversation=self.conversation).unread_count
+
+    def run_with_events(self, scenario, retries=3):
+        # scenario(buffer) отправляет сообщения; возвращает события группы чата
+        # в порядке прихода, когда в буфере не останется незаписанного
+        async def main():
+            layer = get_channel_layer()
+            channel = await layer.new_channel()
+            await layer.group_add(f'chat_{self.conversation.id}', channel)
+            buffer = MessageWriteBuffer(FLUSH_INTERVAL, 100, retries)
+            await scenario(buffer)
+            async with asyncio.timeout(5):
+                while buffer.unsaved:
+                    await asyncio.sleep(FLUSH_INTERVAL)
+            buffer.task.cancel()
+            events = []
+            while True:
+                try:
+                    event = await asyncio.wait_for(layer.receive(channel), FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    return events
+                events.append(json.loads(event['text']))
+        return async_to_sync(main)()
+
+    def test_ack_maps_uid_to_id(self):
+        uids = [uuid.uuid4(), uuid.uuid4()]
+        submitted = []
+
+        async def scenario(buffer):
+            submitted.append(buffer.submit(uids[0], self.conversation.id, self.alice.id, 'one'))
+            submitted.append(buffer.submit(uids[1], self.conversation.id, self.bob.id, 'two'))
+
+        events = self.run_with_events(scenario)
+        self.assertEqual([e['type'] for e in events], ['message_saved'])
+        acked = {m['uid']: m['id'] for m in events[0]['messages']}
+        # Сохранено время из submit — то, что видели клиенты
+        self.assertEqual(
+            {m['uid']: m['timestamp'] for m in events[0]['messages']},
+            {str(p.uid): p.timestamp.isoformat() for p in submitted},
+        )
+        self.assertEqual(acked, {
+            str(m.uid): m.id for m in Message.objects.filter(conversation=self.conversation)
+        })
+        self.assertEqual(set(acked), {str(uid) for uid in uids})
+
+    def test_uid_is_idempotent(self):
+        uid = uuid.uuid4()
+        sent_at = timezone.now() - timedelta(minutes=5)
+        pending = PendingMessage(uid, self.conversation.id, self.alice.id, 'once', sent_at)
+        first = persist_batch([pending])
+        second = persist_batch([pending])
+        self.assertEqual(Message.objects.filter(uid=uid).count(), 1)
+        # Время разосланного сообщения, а не момент записи пакета
+        self.assertEqual(Message.objects.get(uid=uid).timestamp, sent_at)
+        self.assertEqual(first[self.conversation.id][0].id, second[self.conversation.id][0].id)
+        # Повтор не увеличивает счётчик второй раз
+        self.assertEqual(self.unread(self.bob), 1)
+        # Чужой uid не раскрывает чужое сообщение
+        stolen = PendingMessage(uid, self.conversation.id, self.bob.id, 'other', sent_at)
+        self.assertEqual(persist_batch([stolen]), {})
+
+    def test_retry_then_ack(self):
+        uid = uuid.uuid4()
+        calls = []
+
+        def flaky(batch):
+            calls.append(len(batch))
+            if len(calls) == 1:
+                raise RuntimeError('db down')
+            return persist_batch(batch)
+
+        async def scenario(buffer):
+            buffer.submit(uid, self.conversation.id, self.alice.id, 'retry')
+
+        with mock.patch.object(persistence, 'persist_batch', flaky):
+            events = self.run_with_events(scenario)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([e['type'] for e in events], ['message_saved'])
+        self.assertEqual(Message.objects.filter(uid=uid).count(), 1)
+        self.assertEqual(self.unread(self.bob), 1)
+
+    def test_retry_does_not_block_later_batches(self):
+        stuck, later = uuid.uuid4(), uuid.uuid4()
+        failures = []
+
+        def fail_first_stuck(batch):
+            if any(p.uid == stuck for p in batch) and not failures:
+                failures.append(1)
+                raise RuntimeError('db down')
+            return persist_batch(batch)
+
+        async def scenario(buffer):
+            buffer.submit(stuck, self.conversation.id, self.alice.id, 'stuck')
+            # Следующий пакет — уже после первой неудачи, пока пакет ждёт повтора
+            while not failures:
+                await asyncio.sleep(FLUSH_INTERVAL / 4)
+            buffer.submit(later, self.conversation.id, self.alice.id, 'later')
+
+        with mock.patch.object(persistence, 'persist_batch', fail_first_stuck):
+            events = self.run_with_events(scenario)
+        acked = [m['uid'] for e in events for m in e['messages']]
+        self.assertEqual(acked, [str(later), str(stuck)])
+
+    def test_message_failed_after_last_attempt(self):
+        uid = uuid.uuid4()
+
+        async def scenario(buffer):
+            buffer.submit(uid, self.conversation.id, self.alice.id, 'lost')
+
+        with mock.patch.object(persistence, 'persist_batch', side_effect=RuntimeError('db down')) as persist:
+            events = self.run_with_events(scenario, retries=2)
+        self.assertEqual(persist.call_count, 2)
+        self.assertEqual(events, [{
+            'type': 'message_failed', 'conversation_id': self.conversation.id, 'uids': [str(uid)],
+        }])
+        self.assertFalse(Message.objects.filter(uid=uid).exists())
+
+    def test_shutdown_flush_writes_buffered_messages(self):
+        uids = [uuid.uuid4(), uuid.uuid4()]
+
+        async def main():
+            buffer = MessageWriteBuffer(FLUSH_INTERVAL, 100, 3)
+            for uid in uids:
+                buffer.submit(uid, self.conversation.id, self.alice.id, 'buffered')
+            # Процесс останавливается раньше, чем run забрал пакет
+            buffer.task.cancel()
+            return buffer
+
+        buffer = async_to_sync(main)()
+        self.assertEqual(len(buffer.unsaved), 2)
+        async_to_sync(database_sync_to_async(buffer.flush_on_exit))()
+        self.assertEqual(buffer.unsaved, {})
+        self.assertEqual(Message.objects.filter(uid__in=uids).count(), 2)
+        self.assertEqual(self.unread(self.bob), 2)
+
+class HistoryCursorTests(TestCase):
+    def test_round_trip(self):
+        ts = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(ts, 42)), (ts, 42))
+
+    def test_malformed_cursors_are_invalid(self):
+        def raw(text):
+            return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+        for cursor in ['???', raw('v2:0:1'), raw('v1:x:1'), raw('v1:0'),
+                       raw(f'v1:{10 ** 20}:71'), raw(f'v1:0:{2 ** 63}'), raw('v1:0:0')]:
+            with self.subTest(cursor=cursor), self.assertRaises(InvalidCursor):
+                decode_cursor(cursor)
+
+    def test_history_rejects_overflowing_cursor(self):
+        cache.clear()
+        membership._local.clear()
+        user = User.objects.create(username='alice', email='alice@example.com', discriminator='0001')
+        conversation = Conversation.objects.create(type='group', name='h')
+        ConversationParticipant.objects.create(user=user, conversation=conversation)
+        self.client.force_login(user)
+        response = self.client.get(
+            reverse('chat:history', args=[conversation.id]),
+            {'before': 'djE6OTk5OTk5OTk5OTk5OTk5OTk5OTk5OTk6NzE'},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'invalid cursor')
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER)
+class OutboxRelayTests(TransactionTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(outbox.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.relay = OutboxRelay(100, 0, 1, commit_lag=2)
+
+    def add(self, event_id, group='chat_1'):
+        OutboxEvent.objects.create(id=event_id, group=group, event={'type': 'chat_event', 'n': event_id})
+
+    def relay_batch(self):
+        return async_to_sync(self.relay.relay_batch)()
+
+    def test_waits_for_rows_below_first_seen_after_start(self):
+        self.add(5)
+        self.assertEqual(self.relay_batch(), (0, 0))
+        self.now += 2
+        self.assertEqual(self.relay_batch(), (1, 1))
+
+    def test_gap_holds_later_rows_until_commit_lag(self):
+        self.add(1)
+        self.relay_batch()
+        self.now += 2
+        self.assertEqual(self.relay_batch(), (1, 1))
+        # 2 ещё не закоммичена: 3 того же чата ждёт
+        self.add(3)
+        self.assertEqual(self.relay_batch(), (0, 0))
+        self.assertEqual(self.relay.held, 1)
+        self.add(2)
+        self.assertEqual(self.relay_batch(), (2, 2))
+        # Откат: пропуск 4 отпускается через commit_lag
+        self.add(5)
+        self.assertEqual(self.relay_batch(), (0, 0))
+        self.now += 2
+        self.assertEqual(self.relay_batch(), (1, 1))
+        self.assertFalse(OutboxEvent.objects.exists())
+
+class UploadMembershipTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        # id пользователей и чатов между тестами повторяются: ответы прошлых тестов не нужны
+        cache.clear()
+        membership._local.clear()
+        self.user = User.objects.create(username='alice', email='alice@example.com', discriminator='0001')
+        self.conversation = Conversation.objects.create(type='group', name='up')
+        ConversationParticipant.objects.create(user=self.user, conversation=self.conversation)
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('chat:upload_init', args=[self.conversation.id]),
+                                    {'filename': 'a.bin', 'size': 4})
+        self.upload_id = response.json()['upload_id']
+
+    def remove_from_chat(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ConversationParticipant.objects.filter(user=self.user, conversation=self.conversation).delete()
+            membership.invalidate(self.conversation.id, self.user.id)
+
+    def chunk(self, offset, data):
+        return self.client.post(reverse('chat:upload_chunk', args=[self.upload_id]), data,
+                                content_type='application/octet-stream', HTTP_X_UPLOAD_OFFSET=str(offset))
+
+    def finalize(self):
+        return self.client.post(reverse('chat:upload_finalize', args=[self.upload_id]))
+
+    def test_removed_member_cannot_append(self):
+        self.assertEqual(self.chunk(0, b'ab').status_code, 200)
+        self.remove_from_chat()
+        self.assertEqual(self.chunk(2, b'cd').status_code, 403)
+
+    def test_removed_member_cannot_finalize(self):
+        self.assertEqual(self.chunk(0, b'abcd').status_code, 200)
+        self.remove_from_chat()
+        self.assertEqual(self.finalize().status_code, 403)
+        self.assertFalse(Message.objects.filter(conversation=self.conversation).exists())
+
+class ImportMergeTests(TestCase):
+    # Старая история, влитая в живой личный чат (importer.finalize)
+    def setUp(self):
+        cache.clear()
+        membership._local.clear()
+        self.alice = User.objects.create(username='alice', email='alice@example.com', discriminator='0001')
+        self.bob = User.objects.create(username='bob', email='bob@example.com', discriminator='0001')
+        self.conversation, _ = Conversation.objects.get_or_create_private(self.alice, self.bob)
+        self.live = Message.objects.create(conversation=self.conversation, sender=self.bob, content='live')
+        register_messages(self.conversation.id, [self.live])
+        records = [
+            {'kind': 'user', 'id': 'u1', 'username': 'alice', 'email': 'alice@example.com'},
+            {'kind': 'user', 'id': 'u2', 'username': 'bob', 'email': 'bob@example.com'},
+            {'kind': 'conversation', 'id': 'c1', 'type': 'private', 'participants': ['u1', 'u2']},
+            {'kind': 'message', 'id': 'm1', 'conversation': 'c1', 'sender': 'u2',
+             'content': 'old', 'timestamp': '2015-01-01T00:00:00'},
+            {'kind': 'message', 'id': 'm2', 'conversation': 'c1', 'sender': 'u1',
+             'content': 'older reply', 'timestamp': '2015-01-02T00:00:00'},
+        ]
+        spool = tempfile.NamedTemporaryFile('w', suffix='.ndjson', delete=False)
+        self.addCleanup(os.unlink, spool.name)
+        with spool:
+            spool.writelines(json.dumps(record) + '\n' for record in records)
+        self.path = spool.name
+
+    def run_import(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return run_import(self.path, 'test', workers=1, log=lambda line: None)
+
+    def participant(self, user):
+        return ConversationParticipant.objects.get(user=user, conversation=self.conversation)
+
+    def test_merge_keeps_live_unread_and_covers_imported(self):
+        stats = self.run_import()
+        self.assertEqual(stats['messages'], 2)
+        top = Message.objects.filter(conversation=self.conversation).aggregate(top=Max('id'))['top']
+        alice = self.participant(self.alice)
+        self.assertEqual((alice.last_read, alice.unread_count), (top, 1))
+        self.assertEqual(self.participant(self.bob).unread_count, 0)
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_id, self.live.id)
+        # Клиент читает самое позднее по времени — живое сообщение с меньшим id
+        self.assertIsNone(ConversationParticipant.objects.mark_read(self.alice.id, self.conversation.id, self.live.id))
+        self.assertEqual(self.participant(self.alice).unread_count, 0)
+
+    def test_rerun_counts_only_inserted_messages(self):
+        self.run_import()
+        stats = self.run_import()
+        self.assertEqual((stats['messages'], stats['messages_existing']), (0, 2))
+        self.assertEqual(self.participant(self.alice).unread_count, 1)
+
+class ReadWatermarkTests(TestCase):
+    # ConversationParticipantManager.mark_read: знак — реальное сообщение чата,
+    # счётчик — хвост после знака без своих сообщений
+    def setUp(self):
+        self.alice = User.objects.create(username='alice', email='alice@example.com', discriminator='0001')
+        self.bob = User.objects.create(username='bob', email='bob@example.com', discriminator='0001')
+        self.conversation = Conversation.objects.create(type='group', name='rw')
+        ConversationParticipant.objects.bulk_create([
+            ConversationParticipant(user=user, conversation=self.conversation)
+            for user in (self.alice, self.bob)
+        ])
+        self.messages = []
+        for sender, text in [(self.bob, 'one'), (self.alice, 'mine'), (self.bob, 'two'), (self.bob, 'three')]:
+            message = Message.objects.create(conversation=self.conversation, sender=sender, content=text)
+            # Своё сообщение register_messages засчитал бы alice как прочитанное
+            if sender == self.bob:
+                register_messages(self.conversation.id, [message])
+            self.messages.append(message)
+
+    def mark_read(self, message_id):
+        return ConversationParticipant.objects.mark_read(self.alice.id, self.conversation.id, message_id)
+
+    def state(self):
+        participant = ConversationParticipant.objects.get(user=self.alice, conversation=self.conversation)
+        return participant.last_read, participant.unread_count
+
+    def test_counter_before_reading(self):
+        self.assertEqual(self.state(), (0, 3))
+
+    def test_recount_tail_without_own_messages(self):
+        self.assertEqual(self.mark_read(self.messages[0].id), self.messages[0].id)
+        self.assertEqual(self.state(), (self.messages[0].id, 2))
+
+    def test_id_above_max_is_clamped(self):
+        last = self.messages[-1]
+        self.assertEqual(self.mark_read(last.id + 1000), last.id)
+        self.assertEqual(self.state(), (last.id, 0))
+
+    def test_foreign_id_is_clamped_to_this_chat(self):
+        other = Conversation.objects.create(type='group', name='other')
+        foreign = Message.objects.create(conversation=other, sender=self.bob, content='x')
+        # Чужой id больше последнего сообщения чата: знак — последнее сообщение не новее него
+        self.assertEqual(self.mark_read(foreign.id), self.messages[-1].id)
+        self.assertEqual(self.state(), (self.messages[-1].id, 0))
+
+    def test_watermark_never_moves_back(self):
+        self.mark_read(self.messages[2].id)
+        self.assertIsNone(self.mark_read(self.messages[0].id))
+        self.assertEqual(self.state(), (self.messages[2].id, 1))
+
+    def test_id_before_first_message_is_ignored(self):
+        self.assertIsNone(self.mark_read(self.messages[0].id - 1))
+        self.assertEqual(self.state(), (0, 3))
+
+class PrivateConversationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        membership._local.clear()
+        self.alice = User.objects.create(username='alice', email='alice@example.com', discriminator='0001')
+        self.bob = User.objects.create(username='bob', email='bob@example.com', discriminator='0001')
+
+    def test_reversed_pair_returns_same_conversation(self):
+        first, created = Conversation.objects.get_or_create_private(self.alice, self.bob)
+        self.assertTrue(created)
+        second, created = Conversation.objects.get_or_create_private(self.bob, self.alice)
+        self.assertFalse(created)
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(first.private_key, private_key(self.bob.id, self.alice.id))
+        self.assertEqual(Conversation.objects.filter(type='private').count(), 1)
+
+    def test_concurrent_insert_falls_back_to_existing_row(self):
+        existing, _ = Conversation.objects.get_or_create_private(self.alice, self.bob)
+        # Вторая вставка не увидела чат при поиске: гонка двух запросов
+        with mock.patch.object(Conversation.objects, 'filter', return_value=Conversation.objects.none()):
+            conversation, created = Conversation.objects.get_or_create_private(self.bob, self.alice)
+        self.assertFalse(created)
+        self.assertEqual(conversation.id, existing.id)
+        self.assertEqual(Conversation.objects.filter(type='private').count(), 1)
+        self.assertEqual(ConversationParticipant.objects.filter(conversation=existing).count(), 2)
+
+@override_settings(CHAT_DOWNLOAD_OFFLOAD='')
+class ServeFileTests(SimpleTestCase):
+    # Range / If-Range / ETag в downloads.serve_file
+    DATA = b'0123456789'
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        name = default_storage.save('chat_files/data.bin', ContentFile(self.DATA))
+        self.file_msg = FileMessage(file=name, filename='data.bin', file_size=len(self.DATA),
+                                    file_type='application/octet-stream', sha256='abc')
+        self.etag = '"abc"'
+
+    def get(self, **headers):
+        response = serve_file(RequestFactory().get('/', headers=headers), self.file_msg)
+        if response.streaming:
+            async def read():
+                return b''.join([chunk async for chunk in response.streaming_content])
+            response.body = async_to_sync(read)()
+        return response
+
+    def assertFull(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.DATA)
+        self.assertEqual(response['Content-Length'], str(len(self.DATA)))
+        self.assertNotIn('Content-Range', response)
+
+    def assertPartial(self, response, start, end):
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.body, self.DATA[start:end + 1])
+        self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{len(self.DATA)}')
+        self.assertEqual(response['Content-Length'], str(end - start + 1))
+
+    def test_full_file(self):
+        response = self.get()
+        self.assertFull(response)
+        self.assertEqual(response['ETag'], self.etag)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_single_ranges(self):
+        for header, start, end in [
+            ('bytes=2-5', 2, 5),
+            ('bytes=7-', 7, 9),
+            ('bytes=-3', 7, 9),
+            ('bytes=-100', 0, 9),
+            ('bytes=8-100', 8, 9),
+        ]:
+            with self.subTest(header):
+                self.assertPartial(self.get(Range=header), start, end)
+
+    def test_unsatisfiable_range(self):
+        for header in ['bytes=10-', 'bytes=5-2', 'bytes=-0']:
+            with self.subTest(header):
+                response = self.get(Range=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response['Content-Range'], f'bytes */{len(self.DATA)}')
+
+    def test_multi_range_and_malformed_header_serve_whole_file(self):
+        for header in ['bytes=0-1,4-5', 'items=0-1', 'bytes=-', 'bytes=a-b']:
+            with self.subTest(header):
+                self.assertFull(self.get(Range=header))
+
+    def test_if_range(self):
+        self.assertPartial(self.get(Range='bytes=2-5', If_Range=self.etag), 2, 5)
+        # Клиент держит другую версию файла: отдаётся целиком
+        self.assertFull(self.get(Range='bytes=2-5', If_Range='"old"'))
+
+    def test_if_none_match(self):
+        for header in [self.etag, f'W/{self.etag}', f'"old", {self.etag}', '*']:
+            with self.subTest(header):
+                response = self.get(If_None_Match=header)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response['ETag'], self.etag)
+        self.assertFull(self.get(If_None_Match='"old"'))
+
+    def test_etag_without_checksum_tracks_size_and_mtime(self):
+        self.file_msg.sha256 = ''
+        etag = self.get()['ETag']
+        self.assertRegex(etag, r'^"[0-9a-f]+-[0-9a-f]+"$')
+        self.assertEqual(self.get(If_None_Match=etag).status_code, 304)
@@ -0,0 +1,163 @@
+import hashlib
+import os
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from apps.core.lru import LocalLRU
+from . import membership
+from .models import FileMessage, Message, UploadSession
+from .broadcast import file_message_event, publish
+from .services import register_messages
+
+# Возобновляемая загрузка файлов по частям:
+#   init     — сессия и имя итогового файла в хранилище (пустой файл создаётся сразу);
+#   chunk    — тело запроса потоком пишется в итоговый файл со смещения offset,
+#              которое обязано совпадать с уже принятым объёмом (received);
+#   status   — сколько байт принято: с этого места клиент продолжает после обрыва;
+#   finalize — проверка размера и SHA-256 всего файла, затем FileMessage + сообщение
+#              и событие для чата в одной транзакции.
+# Память ограничена CHUNK_BLOCK байтами на запрос, копирования из временных файлов нет.
+# SHA-256 всего файла считается по ходу приёма частей (_running) и при finalize
+# только сравнивается. Состояние hashlib не сериализуется, поэтому живёт в
+# процессе: если части принимали разные процессы или процесс перезапускался,
+# finalize перечитывает файл целиком.
+# Участие в чате проверяется не только при init, но и на каждой части и при
+# finalize: удалённый из чата не допишет файл и не опубликует его.
+# Части пишутся прямо по пути хранилища, поэтому нужен FileSystemStorage.
+
+CHUNK_BLOCK = 64 * 1024
+
+# id сессии -> (принято байт, sha256 принятой части)
+_running = LocalLRU(1024, 24 * 3600)
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.status = status
+        self.extra = extra
+
+def start_upload(user, conversation, filename, total_size, file_type='', sha256=''):
+    filename = os.path.basename(filename)[:255]
+    if not filename:
+        raise UploadError('filename is required')
+    if total_size < 0 or total_size > settings.CHAT_UPLOAD_MAX_SIZE:
+        raise UploadError('file is too large', status=413)
+    field = FileMessage._meta.get_field('file')
+    storage_name = default_storage.get_available_name(field.generate_filename(None, filename))
+    path = default_storage.path(storage_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Резервируем имя: get_available_name больше его не выдаст
+    open(path, 'xb').close()
+    return UploadSession.objects.create(
+        user=user,
+        conversation=conversation,
+        filename=filename,
+        file_type=file_type[:100],
+        storage_name=storage_name,
+        total_size=total_size,
+        sha256=sha256.lower(),
+    )
+
+def check_member(session):
+    if not membership.is_member(session.user_id, session.conversation_id):
+        raise UploadError('not a participant', status=403)
+
+def append_chunk(session, offset, stream, length, chunk_sha256=''):
+    # Возвращает новый объём принятых байт
+    if session.message_id:
+        raise UploadError('upload is already finalized', status=409, offset=session.received)
+    check_member(session)
+    if offset != session.received:
+        raise UploadError('offset mismatch', status=409, offset=session.received)
+    if length <= 0 or length > settings.CHAT_UPLOAD_CHUNK_MAX:
+        raise UploadError('invalid chunk size', status=413, offset=session.received)
+    if offset + length > session.total_size:
+        raise UploadError('chunk exceeds declared size', status=416, offset=session.received)
+    digest = hashlib.sha256()
+    # Продолжаем хэш всего файла копией: неудачная часть его не испортит
+    state = _running.get(session.id)
+    if state is not None and state[0] == offset:
+        running = state[1].copy()
+    else:
+        running = hashlib.sha256() if offset == 0 else None
+    written = 0
+    with open(default_storage.path(session.storage_name), 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            block = stream.read(min(CHUNK_BLOCK, length - written))
+            if not block:
+                break
+            f.write(block)
+            digest.update(block)
+            if running is not None:
+                running.update(block)
+            written += len(block)
+    if written != length:
+        raise UploadError('incomplete chunk', offset=session.received)
+    if chunk_sha256 and digest.hexdigest() != chunk_sha256.lower():
+        # Записанные байты лежат за received и будут перезаписаны повтором части
+        raise UploadError('chunk checksum mismatch', offset=session.received)
+    # Условное обновление: параллельный запрос с тем же offset продвинет received только один раз
+    updated = UploadSession.objects.filter(id=session.id, received=offset).update(received=offset + length)
+    if not updated:
+        session.refresh_from_db(fields=['received'])
+        raise UploadError('offset mismatch', status=409, offset=session.received)
+    session.received = offset + length
+    if running is not None:
+        _running.set(session.id, (session.received, running))
+    return session.received
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def finalize_upload(session):
+    # Возвращает (FileMessage, created); повторный вызов отдаёт уже созданный файл
+    if session.message_id:
+        return FileMessage.objects.select_related('message').get(message_id=session.message_id), False
+    check_member(session)
+    if session.received != session.total_size:
+        raise UploadError('upload is incomplete', status=409, offset=session.received)
+    path = default_storage.path(session.storage_name)
+    # Хвост от оборванных частей за пределами объявленного размера
+    os.truncate(path, session.total_size)
+    state = _running.get(session.id)
+    if state is not None and state[0] == session.total_size:
+        sha256 = state[1].hexdigest()
+    else:
+        sha256 = file_sha256(path)
+    if session.sha256 and sha256 != session.sha256:
+        raise UploadError('file checksum mismatch', status=422, offset=session.received)
+    with transaction.atomic():
+        locked = UploadSession.objects.select_for_update().get(id=session.id)
+        if locked.message_id:
+            return FileMessage.objects.select_related('message').get(message_id=locked.message_id), False
+        message = Message.objects.create(
+            conversation_id=session.conversation_id,
+            sender_id=session.user_id,
+            content='📎 Файл',
+        )
+        file_msg = FileMessage.objects.create(
+            message=message,
+            file=session.storage_name,
+            filename=session.filename,
+            file_size=session.total_size,
+            file_type=session.file_type,
+            sha256=sha256,
+        )
+        locked.message = message
+        locked.save(update_fields=['message'])
+        register_messages(session.conversation_id, [message])
+        publish(f'chat_{session.conversation_id}', file_message_event(session.user, message, file_msg))
+    session.message = message
+    _running.delete(session.id)
+    return file_msg, True
+
+def discard_upload(session):
+    if not session.message_id:
+        default_storage.delete(session.storage_name)
+    _running.delete(session.id)
+    session.delete()
@@ -6,6 +6,9 @@ app_name = 'chat'
 urlpatterns = [
     path('', views.index, name='index'),
     path('room/<int:conversation_id>/', views.room, name='room'),
+    path('history/<int:conversation_id>/', views.history, name='history'),
+    path('search/', views.search, name='search'),
+    path('export/<int:conversation_id>/', views.export_conversation, name='export'),
     path('server/<int:server_id>/', views.server_detail, name='server'),
     path('channel/<int:channel_id>/', views.channel_detail, name='channel'),
     # Создание чатов
@@ -19,6 +22,10 @@ urlpatterns = [
     path('join/<str:token>/', views.join_via_invite, name='join_via_invite'),
     # Загрузка файлов
     path('upload/<int:conversation_id>/', views.upload_file, name='upload_file'),
+    path('upload/<int:conversation_id>/init/', views.upload_init, name='upload_init'),
+    path('upload/session/<uuid:upload_id>/', views.upload_status, name='upload_status'),
+    path('upload/session/<uuid:upload_id>/chunk/', views.upload_chunk, name='upload_chunk'),
+    path('upload/session/<uuid:upload_id>/finalize/', views.upload_finalize, name='upload_finalize'),
     # Редактирование канала
     path('edit/<int:conversation_id>/', views.edit_channel, name='edit_channel'),
     # Голосовые комнаты
@@ -27,6 +34,7 @@ urlpatterns = [
     path('voice/leave/<int:voice_room_id>/', views.leave_voice, name='leave_voice'),
     # Стикеры
     path('stickers/', views.sticker_packs, name='sticker_packs'),
+    path('stickers/manifest/', views.sticker_manifest, name='sticker_manifest'),
     path('send_sticker/<int:conversation_id>/<int:sticker_id>/', views.send_sticker, name='send_sticker'),
     # Редактирование/удаление сообщений
     path('edit_message/<int:message_id>/', views.edit_message, name='edit_message'),
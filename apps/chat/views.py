@@ -1,44 +1,38 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, OuterRef, Subquery, F, Count, IntegerField
-from django.db.models.functions import Coalesce
-from django.http import Http404, JsonResponse, FileResponse
+from django.db.models import Q
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
-from .models import Conversation, Message, Server, Channel, ConversationParticipant, Invite, FileMessage, VoiceRoom, StickerPack, Sticker, PinnedMessage
+from django.views.decorators.http import require_POST
+from django.conf import settings
+from asgiref.sync import sync_to_async
+from .models import Conversation, Message, Server, Channel, ConversationParticipant, Invite, FileMessage, VoiceRoom, Sticker, PinnedMessage, UploadSession
 from apps.users.models import User
 from .forms import CreateGroupForm, CreatePrivateChatForm, EditChannelForm
+from .downloads import etag_matches, serve_file
+from .export import ndjson_stream, zip_stream
+from .history import fetch_page, serialize_message, clamp_limit, decode_cursor, InvalidCursor
+from .search import search_messages
+from .stickers import get_manifest
+from .uploads import UploadError, start_upload, append_chunk, finalize_upload
+from . import membership, services, voice
+from .broadcast import abroadcast, acommit
+from apps.core.async_views import aiterate, alogin_required, aget_object_or_404
 import secrets
-import os
-import mimetypes
 
 @login_required
 def index(request):
-    # Подзапрос для количества непрочитанных сообщений
-    unread_subquery = Message.objects.filter(
-        conversation=OuterRef('pk'),
-        timestamp__gt=OuterRef('conversationparticipant__last_read')
-    ).exclude(sender=request.user).values('conversation').annotate(cnt=Count('id')).values('cnt')
-
-    conversations = Conversation.objects.filter(
-        participants=request.user
-    ).annotate(
-        last_msg_content=Subquery(
-            Message.objects.filter(conversation=OuterRef('pk')).order_by('-timestamp').values('content')[:1]
-        ),
-        unread_count=Coalesce(Subquery(unread_subquery), 0, output_field=IntegerField()),
-        is_pinned=Subquery(
-            ConversationParticipant.objects.filter(
-                user=request.user,
-                conversation=OuterRef('pk')
-            ).values('is_pinned')[:1]
-        )
-    ).order_by(
-        F('is_pinned').desc(),
-        F('last_message__timestamp').desc(nulls_last=True)
-    ).select_related('last_message')
-    return render(request, 'chat/index.html', {'conversations': conversations})
+    # Счётчики и порядок денормализованы в ConversationParticipant:
+    # один проход по индексу chat_part_inbox без подзапросов на каждый чат
+    participants = ConversationParticipant.objects.filter(
+        user=request.user
+    ).select_related(
+        'conversation', 'conversation__last_message'
+    ).order_by('-is_pinned', '-last_activity')
+    return render(request, 'chat/index.html', {'participants': participants})
 
 @login_required
 def room(request, conversation_id):
@@ -54,19 +48,15 @@ def room(request, conversation_id):
                     owner=request.user
                 )
                 fav.participants.add(request.user)
+                membership.invalidate(fav.id, request.user.id)
                 return redirect('chat:room', conversation_id=fav.id)
             conversation, created = Conversation.objects.get_or_create_private(request.user, other_user)
             return redirect('chat:room', conversation_id=conversation.id)
         except User.DoesNotExist:
             raise Http404("Чат не найден")
     
-    # Помечаем сообщения как прочитанные
-    Message.objects.filter(conversation=conversation).exclude(sender=request.user).update(is_read=True)
-    # Обновляем last_read
     participant = ConversationParticipant.objects.get(user=request.user, conversation=conversation)
-    participant.last_read = timezone.now()
-    participant.save()
-    
+
     # Получаем закреплённое сообщение (если есть)
     try:
         pinned = PinnedMessage.objects.get(conversation=conversation)
@@ -74,7 +64,14 @@ def room(request, conversation_id):
     except PinnedMessage.DoesNotExist:
         pinned_msg = None
 
-    messages_list = Message.objects.filter(conversation=conversation).select_related('sender', 'sticker').prefetch_related('file').order_by('timestamp')
+    # Только последняя страница; более старые подгружаются через chat:history
+    messages_list, history_cursor = fetch_page(conversation.id)
+    # Прочтение — сдвиг водяного знака участника, без записи в сами сообщения
+    if messages_list:
+        participant.last_read = ConversationParticipant.objects.mark_read(
+            request.user.id, conversation.id, messages_list[-1].id
+        ) or participant.last_read
+    seen_up_to = ConversationParticipant.objects.seen_up_to(conversation.id, request.user.id)
     is_admin = participant.is_admin or conversation.type in ['private', 'favorite']
     
     invites = None
@@ -87,19 +84,80 @@ def room(request, conversation_id):
     except VoiceRoom.DoesNotExist:
         pass
     
-    sticker_packs = StickerPack.objects.all().prefetch_related('stickers')
-    
     return render(request, 'chat/room.html', {
         'conversation': conversation,
         'messages': messages_list,
+        'history_cursor': history_cursor,
+        'seen_up_to': seen_up_to,
         'pinned_message': pinned_msg,
         'is_admin': is_admin,
         'invites': invites,
         'participant': participant,
         'voice_room': voice_room,
-        'sticker_packs': sticker_packs,
+        'sticker_manifest_version': get_manifest().version,
     })
 
+@login_required
+def history(request, conversation_id):
+    if not membership.is_member(request.user.id, conversation_id):
+        raise Http404("Чат не найден")
+    try:
+        page, next_cursor = fetch_page(
+            conversation_id,
+            before=request.GET.get('before'),
+            limit=clamp_limit(request.GET.get('limit')),
+        )
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'error': 'invalid cursor'}, status=400)
+    return JsonResponse({
+        'status': 'ok',
+        'messages': [serialize_message(m) for m in page],
+        'next_cursor': next_cursor,
+    })
+
+# --- Выгрузка чата (см. export.py) ---
+@alogin_required
+async def export_conversation(request, conversation_id):
+    if not await membership.ais_member(request.user.id, conversation_id):
+        raise Http404("Чат не найден")
+    conversation = await aget_object_or_404(Conversation, id=conversation_id)
+    after = request.GET.get('after')
+    try:
+        after_key = decode_cursor(after) if after else None
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'error': 'invalid cursor'}, status=400)
+    if request.GET.get('format') == 'zip':
+        stream, content_type, filename = zip_stream, 'application/zip', f'chat-{conversation_id}.zip'
+    else:
+        stream, content_type, filename = ndjson_stream, 'application/x-ndjson', f'chat-{conversation_id}.ndjson'
+    return StreamingHttpResponse(
+        aiterate(stream(conversation, after_key)),
+        content_type=content_type,
+        headers={
+            'Content-Disposition': content_disposition_header(True, filename),
+            'Cache-Control': 'private, no-store',
+        },
+    )
+
+# --- Поиск по сообщениям ---
+@login_required
+def search(request):
+    try:
+        found, next_cursor = search_messages(
+            request.user.id,
+            request.GET.get('q', ''),
+            before=request.GET.get('before'),
+            limit=clamp_limit(request.GET.get('limit')),
+        )
+    except InvalidCursor:
+        return JsonResponse({'status': 'error', 'error': 'invalid cursor'}, status=400)
+    results = []
+    for message in found:
+        data = serialize_message(message)
+        data['conversation_id'] = message.conversation_id
+        results.append(data)
+    return JsonResponse({'status': 'ok', 'results': results, 'next_cursor': next_cursor})
+
 @login_required
 def server_detail(request, server_id):
     server = get_object_or_404(Server, id=server_id, members=request.user)
@@ -125,6 +183,7 @@ def create_group(request):
             group.type = 'group'
             group.save()
             group.participants.add(request.user, through_defaults={'is_admin': True})
+            membership.invalidate(group.id, request.user.id)
             messages.success(request, 'Группа создана')
             return redirect('chat:room', conversation_id=group.id)
     else:
@@ -166,6 +225,7 @@ def favorite_chat(request):
     )
     if created:
         fav.participants.add(request.user)
+        membership.invalidate(fav.id, request.user.id)
     return redirect('chat:room', conversation_id=fav.id)
 
 # --- Приглашения ---
@@ -200,57 +260,104 @@ def join_via_invite(request, token):
         messages.error(request, 'Приглашение уже использовано максимальное количество раз')
         return redirect('chat:index')
     
-    if invite.conversation.participants.filter(id=request.user.id).exists():
+    if membership.is_member(request.user.id, invite.conversation_id):
         messages.info(request, 'Вы уже участник этого чата')
         return redirect('chat:room', conversation_id=invite.conversation.id)
     
     invite.conversation.participants.add(request.user)
+    membership.invalidate(invite.conversation_id, request.user.id)
     invite.uses += 1
     invite.save()
     messages.success(request, f'Вы присоединились к чату {invite.conversation.name}')
     return redirect('chat:room', conversation_id=invite.conversation.id)
 
 # --- Загрузка файлов ---
-@login_required
+@alogin_required
 @csrf_exempt
-def upload_file(request, conversation_id):
-    if request.method == 'POST' and request.FILES.get('file'):
-        conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
-        uploaded_file = request.FILES['file']
-        
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=request.user,
-            content='📎 Файл'
-        )
-        file_msg = FileMessage.objects.create(
-            message=message,
-            file=uploaded_file,
-            filename=uploaded_file.name,
-            file_size=uploaded_file.size,
-            file_type=uploaded_file.content_type
-        )
-        
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'chat_{conversation_id}',
-            {
-                'type': 'chat_message',
-                'id': message.id,
-                'sender_id': request.user.id,
-                'sender_name': request.user.get_display_name(),
-                'sender_avatar': request.user.avatar.url if request.user.avatar else None,
-                'content': f'📎 [{uploaded_file.name}]({file_msg.file.url})',
-                'file_url': file_msg.file.url,
-                'filename': uploaded_file.name,
-                'timestamp': message.timestamp.isoformat(),
-            }
+async def upload_file(request, conversation_id):
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error'}, status=400)
+    if not await membership.ais_member(request.user.id, conversation_id):
+        raise Http404("Чат не найден")
+    # Разбор multipart и запись временных файлов — в пуле потоков, не в цикле событий
+    files = await sync_to_async(lambda: request.FILES, thread_sensitive=False)()
+    if not files.get('file'):
+        return JsonResponse({'status': 'error'}, status=400)
+    file_msg = await acommit(services.create_file_message, request.user, conversation_id, files['file'])
+    return JsonResponse({'status': 'ok', 'file_url': file_msg.file.url})
+
+# --- Загрузка файлов по частям (см. uploads.py) ---
+def upload_error(error):
+    return JsonResponse({'status': 'error', 'error': str(error), **error.extra}, status=error.status)
+
+@login_required
+@require_POST
+def upload_init(request, conversation_id):
+    if not membership.is_member(request.user.id, conversation_id):
+        raise Http404("Чат не найден")
+    conversation = get_object_or_404(Conversation, id=conversation_id)
+    try:
+        total_size = int(request.POST.get('size', ''))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'error': 'size is required'}, status=400)
+    try:
+        session = start_upload(
+            request.user,
+            conversation,
+            request.POST.get('filename', ''),
+            total_size,
+            file_type=request.POST.get('content_type', ''),
+            sha256=request.POST.get('sha256', ''),
         )
-        
-        return JsonResponse({'status': 'ok', 'file_url': file_msg.file.url})
-    return JsonResponse({'status': 'error'}, status=400)
+    except UploadError as e:
+        return upload_error(e)
+    return JsonResponse({
+        'status': 'ok',
+        'upload_id': str(session.id),
+        'offset': 0,
+        'chunk_size': settings.CHAT_UPLOAD_CHUNK_SIZE,
+    })
+
+@login_required
+@require_POST
+def upload_chunk(request, upload_id):
+    # Тело запроса — сырые байты части (application/octet-stream), смещение в X-Upload-Offset
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+    try:
+        offset = int(request.headers.get('X-Upload-Offset', ''))
+        length = int(request.headers.get('Content-Length', ''))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'error': 'offset and length are required'}, status=400)
+    try:
+        received = append_chunk(session, offset, request, length, request.headers.get('X-Chunk-Sha256', ''))
+    except UploadError as e:
+        return upload_error(e)
+    return JsonResponse({'status': 'ok', 'offset': received})
+
+@login_required
+def upload_status(request, upload_id):
+    session = get_object_or_404(UploadSession, id=upload_id, user=request.user)
+    return JsonResponse({
+        'status': 'ok',
+        'offset': session.received,
+        'size': session.total_size,
+        'finalized': session.message_id is not None,
+    })
+
+@login_required
+@require_POST
+def upload_finalize(request, upload_id):
+    session = get_object_or_404(UploadSession.objects.select_related('user'), id=upload_id, user=request.user)
+    try:
+        file_msg, _ = finalize_upload(session)
+    except UploadError as e:
+        return upload_error(e)
+    return JsonResponse({
+        'status': 'ok',
+        'message_id': file_msg.message_id,
+        'file_url': file_msg.file.url,
+        'sha256': file_msg.sha256,
+    })
 
 # --- Редактирование канала ---
 @login_required
@@ -279,24 +386,26 @@ def voice_room(request, conversation_id):
     if created:
         voice_room.name = f"Voice of {conversation.name}"
         voice_room.save()
+    active_ids = voice.member_ids(voice_room.id)
     return render(request, 'chat/voice_room.html', {
         'conversation': conversation,
         'voice_room': voice_room,
+        'active_users': User.objects.filter(id__in=active_ids),
+        'in_room': request.user.id in active_ids,
     })
 
-@login_required
-def join_voice(request, voice_room_id):
-    voice_room = get_object_or_404(VoiceRoom, id=voice_room_id)
-    if request.user not in voice_room.conversation.participants.all():
+@alogin_required
+async def join_voice(request, voice_room_id):
+    voice_room = await aget_object_or_404(VoiceRoom, id=voice_room_id)
+    if not await membership.ais_member(request.user.id, voice_room.conversation_id):
         messages.error(request, 'Вы не участник этого чата')
         return redirect('chat:index')
-    voice_room.active_users.add(request.user)
-    voice_room.is_active = True
-    voice_room.save()
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
+    if not await voice.join(voice_room.id, request.user.id):
+        return redirect('chat:voice_room', conversation_id=voice_room.conversation_id)
+    if not voice_room.is_active:
+        # Запись только при входе в неактивную комнату: по is_active её находит sync_voice_rooms
+        await VoiceRoom.objects.filter(id=voice_room.id, is_active=False).aupdate(is_active=True)
+    await abroadcast(
         f'voice_{voice_room.id}',
         {
             'type': 'user_joined',
@@ -304,101 +413,62 @@ def join_voice(request, voice_room_id):
             'username': request.user.get_display_name(),
         }
     )
-    return redirect('chat:voice_room', conversation_id=voice_room.conversation.id)
+    return redirect('chat:voice_room', conversation_id=voice_room.conversation_id)
 
-@login_required
-def leave_voice(request, voice_room_id):
-    voice_room = get_object_or_404(VoiceRoom, id=voice_room_id)
-    voice_room.active_users.remove(request.user)
-    if voice_room.active_users.count() == 0:
-        voice_room.is_active = False
-    voice_room.save()
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'voice_{voice_room.id}',
-        {
-            'type': 'user_left',
-            'user_id': request.user.id,
-        }
-    )
-    return redirect('chat:room', conversation_id=voice_room.conversation.id)
+@alogin_required
+async def leave_voice(request, voice_room_id):
+    voice_room = await aget_object_or_404(VoiceRoom, id=voice_room_id)
+    if await voice.leave(voice_room.id, request.user.id):
+        await abroadcast(
+            f'voice_{voice_room.id}',
+            {
+                'type': 'user_left',
+                'user_id': request.user.id,
+            }
+        )
+    return redirect('chat:room', conversation_id=voice_room.conversation_id)
 
 # --- Стикеры ---
 @login_required
 def sticker_packs(request):
-    packs = StickerPack.objects.all().prefetch_related('stickers')
-    return render(request, 'chat/sticker_packs.html', {'packs': packs})
+    return render(request, 'chat/sticker_packs.html', {'packs': get_manifest().data['packs']})
 
 @login_required
-def send_sticker(request, conversation_id, sticker_id):
-    conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
-    sticker = get_object_or_404(Sticker, id=sticker_id)
-    message = Message.objects.create(
-        conversation=conversation,
-        sender=request.user,
-        sticker=sticker,
-        content=''
-    )
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'chat_{conversation_id}',
-        {
-            'type': 'chat_message',
-            'id': message.id,
-            'sender_id': request.user.id,
-            'sender_name': request.user.get_display_name(),
-            'sender_avatar': request.user.avatar.url if request.user.avatar else None,
-            'content': '',
-            'sticker_id': sticker.id,
-            'sticker_url': sticker.image.url,
-            'timestamp': message.timestamp.isoformat(),
-        }
-    )
-    return redirect('chat:room', conversation_id=conversation.id)
+def sticker_manifest(request):
+    manifest = get_manifest()
+    etag = f'"{manifest.version}"'
+    # По ссылке с актуальной версией содержимое неизменно
+    if request.GET.get('v') == manifest.version:
+        cache_control = 'private, max-age=31536000, immutable'
+    else:
+        cache_control = 'private, max-age=0, must-revalidate'
+    headers = {'ETag': etag, 'Cache-Control': cache_control}
+    if etag_matches(request.headers.get('If-None-Match', ''), etag):
+        return HttpResponse(status=304, headers=headers)
+    return HttpResponse(manifest.text, content_type='application/json', headers=headers)
+
+@alogin_required
+async def send_sticker(request, conversation_id, sticker_id):
+    if not await membership.ais_member(request.user.id, conversation_id):
+        raise Http404("Чат не найден")
+    sticker = await aget_object_or_404(Sticker, id=sticker_id)
+    await acommit(services.create_sticker_message, request.user, conversation_id, sticker)
+    return redirect('chat:room', conversation_id=conversation_id)
 
 # --- Редактирование и удаление сообщений ---
-@login_required
-def edit_message(request, message_id):
-    message = get_object_or_404(Message, id=message_id, sender=request.user)
+@alogin_required
+async def edit_message(request, message_id):
+    message = await aget_object_or_404(Message, id=message_id, sender=request.user)
     if request.method == 'POST':
-        new_content = request.POST.get('content')
-        message.content = new_content
-        message.edited_at = timezone.now()
-        message.save()
-        from channels.layers import get_channel_layer
-        from asgiref.sync import async_to_sync
-        channel_layer = get_channel_layer()
-        async_to_sync(channel_layer.group_send)(
-            f'chat_{message.conversation.id}',
-            {
-                'type': 'edit_message',
-                'id': message.id,
-                'content': new_content,
-                'edited_at': message.edited_at.isoformat(),
-            }
-        )
+        await acommit(services.edit_message, message, request.POST.get('content'))
         return JsonResponse({'status': 'ok'})
-    return render(request, 'chat/edit_message.html', {'message': message})
+    # Шаблон и контекст-процессоры обращаются к ORM синхронно
+    return await sync_to_async(render)(request, 'chat/edit_message.html', {'message': message})
 
-@login_required
-def delete_message(request, message_id):
-    message = get_object_or_404(Message, id=message_id, sender=request.user)
-    message.deleted = True
-    message.save()
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'chat_{message.conversation.id}',
-        {
-            'type': 'delete_message',
-            'id': message.id,
-        }
-    )
+@alogin_required
+async def delete_message(request, message_id):
+    message = await aget_object_or_404(Message, id=message_id, sender=request.user)
+    await acommit(services.delete_message, message)
     return JsonResponse({'status': 'ok'})
 
 # --- Боты (базовая заглушка) ---
@@ -423,59 +493,37 @@ def pin_chat(request, conversation_id):
 def delete_chat(request, conversation_id):
     participant = get_object_or_404(ConversationParticipant, user=request.user, conversation_id=conversation_id)
     participant.delete()
+    membership.invalidate(conversation_id, request.user.id)
     messages.success(request, 'Чат удалён')
     return redirect('chat:index')
 
 # --- Закрепление сообщения ---
-@login_required
-def pin_message(request, message_id):
-    message = get_object_or_404(Message, id=message_id)
-    conversation = message.conversation
-    participant = ConversationParticipant.objects.get(user=request.user, conversation=conversation)
-    if not (participant.is_admin or message.sender == request.user):
+@alogin_required
+async def pin_message(request, message_id):
+    message = await aget_object_or_404(Message, id=message_id)
+    conversation_id = message.conversation_id
+    participant = await ConversationParticipant.objects.filter(
+        user=request.user, conversation_id=conversation_id
+    ).afirst()
+    if participant is None:
+        raise Http404("Чат не найден")
+    if not (participant.is_admin or message.sender_id == request.user.id):
         messages.error(request, 'Недостаточно прав')
-        return redirect('chat:room', conversation_id=conversation.id)
+        return redirect('chat:room', conversation_id=conversation_id)
     
-    pinned, created = PinnedMessage.objects.get_or_create(
-        conversation=conversation,
-        defaults={'message': message, 'pinned_by': request.user}
-    )
-    if not created:
-        pinned.message = message
-        pinned.pinned_by = request.user
-        pinned.save()
+    if await acommit(services.pin_message, message, request.user):
         messages.success(request, 'Закреплённое сообщение изменено')
     else:
         messages.success(request, 'Сообщение закреплено')
-    
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'chat_{conversation.id}',
-        {
-            'type': 'pin_message',
-            'message_id': message.id,
-            'content': message.content[:50],
-        }
-    )
-    return redirect('chat:room', conversation_id=conversation.id)
+    return redirect('chat:room', conversation_id=conversation_id)
 
-@login_required
-def unpin_message(request, conversation_id):
-    conversation = get_object_or_404(Conversation, id=conversation_id, participants=request.user)
-    PinnedMessage.objects.filter(conversation=conversation).delete()
+@alogin_required
+async def unpin_message(request, conversation_id):
+    if not await membership.ais_member(request.user.id, conversation_id):
+        raise Http404("Чат не найден")
+    await acommit(services.unpin_message, conversation_id)
     messages.success(request, 'Сообщение откреплено')
-    from channels.layers import get_channel_layer
-    from asgiref.sync import async_to_sync
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'chat_{conversation.id}',
-        {
-            'type': 'unpin_message',
-        }
-    )
-    return redirect('chat:room', conversation_id=conversation.id)
+    return redirect('chat:room', conversation_id=conversation_id)
 
 # --- Ответ на сообщение (заглушка) ---
 @login_required
@@ -499,15 +547,7 @@ def file_list(request, conversation_id):
 # --- Скачивание файла ---
 @login_required
 def download_file(request, file_id):
-    file_msg = get_object_or_404(FileMessage, id=file_id)
-    if request.user not in file_msg.message.conversation.participants.all():
+    file_msg = get_object_or_404(FileMessage.objects.select_related('message'), id=file_id)
+    if not membership.is_member(request.user.id, file_msg.message.conversation_id):
         raise Http404
-    file_path = file_msg.file.path
-    if not os.path.exists(file_path):
-        raise Http404("Файл не найден на сервере")
-    content_type, encoding = mimetypes.guess_type(file_path)
-    if content_type is None:
-        content_type = 'application/octet-stream'
-    response = FileResponse(open(file_path, 'rb'), content_type=content_type)
-    response['Content-Disposition'] = f'attachment; filename="{file_msg.filename}"'
-    return response
\ No newline at end of file
+    return serve_file(request, file_msg)
\ No newline at end of file
@@ -0,0 +1,85 @@
+import time
+from django.conf import settings
+from django.core.cache import cache
+from apps.core import shared_redis
+
+# Состояние голосовых комнат в Redis, без записей в БД на каждый вход:
+#   voice:room:<комната> — участники: отсортированное множество user_id -> срок
+#       (время + VOICE_MEMBER_TTL). Сокет VoiceConsumer продлевает срок раз в
+#       VOICE_HEARTBEAT_INTERVAL; участник с упавшей вкладкой выпадает по score.
+#       Список комнаты — один ZRANGEBYSCORE, без перебора участников чата.
+#       Истёкшие записи удаляет только sync_voice_rooms (evict) и рассылает по
+#       ним user_left; срок самого ключа — лишь уборка брошенных комнат;
+#   voice:peer:<комната>:<пользователь> — channel_name сокета участника для
+#       адресного сигналинга WebRTC (кэш Django): offer/answer/candidate уходят
+#       одним channel_layer.send вместо рассылки всей группе voice_<id>. Один
+#       сокет на пользователя в комнате: новое подключение заменяет запись.
+# В VoiceRoom.active_users/is_active состояние переносит команда sync_voice_rooms
+# (для отчётов и админки); is_active ещё ставится при входе в пустую комнату,
+# по нему команда находит комнаты для сверки.
+
+ROOM_KEY_TTL = 24 * 3600
+
+def _room_key(voice_room_id):
+    return shared_redis.key(f'voice:room:{voice_room_id}')
+
+def _peer_key(voice_room_id, user_id):
+    return f'voice:peer:{voice_room_id}:{user_id}'
+
+async def join(voice_room_id, user_id):
+    # True, если пользователя в комнате ещё не было (или его место истекло)
+    now = time.time()
+    ttl = settings.VOICE_MEMBER_TTL
+    async with shared_redis.get_async_client().pipeline(transaction=True) as pipe:
+        pipe.zscore(_room_key(voice_room_id), user_id)
+        pipe.zadd(_room_key(voice_room_id), {user_id: now + ttl})
+        pipe.expire(_room_key(voice_room_id), ROOM_KEY_TTL)
+        previous, _, _ = await pipe.execute()
+    return previous is None or previous <= now
+
+async def leave(voice_room_id, user_id):
+    # True, если пользователь был в комнате
+    return bool(await shared_redis.get_async_client().zrem(_room_key(voice_room_id), user_id))
+
+async def is_member(voice_room_id, user_id):
+    expires = await shared_redis.get_async_client().zscore(_room_key(voice_room_id), user_id)
+    return expires is not None and expires > time.time()
+
+async def heartbeat(voice_room_id, user_id, channel_name):
+    # False, если участник уже вышел (или истёк) — сокет тогда закрывается
+    now = time.time()
+    ttl = settings.VOICE_MEMBER_TTL
+    client = shared_redis.get_async_client()
+    if not await is_member(voice_room_id, user_id):
+        return False
+    async with client.pipeline(transaction=True) as pipe:
+        pipe.zadd(_room_key(voice_room_id), {user_id: now + ttl}, xx=True)
+        pipe.expire(_room_key(voice_room_id), ROOM_KEY_TTL)
+        await pipe.execute()
+    await cache.aset(_peer_key(voice_room_id, user_id), channel_name, ttl)
+    return True
+
+def member_ids(voice_room_id):
+    # Кто сейчас в комнате
+    return {int(uid) for uid in shared_redis.get_client().zrangebyscore(_room_key(voice_room_id), time.time(), '+inf')}
+
+def evict(voice_room_id):
+    # Удаляет истёкшие места; возвращает id удалённых участников
+    now = time.time()
+    with shared_redis.get_client().pipeline(transaction=True) as pipe:
+        pipe.zrangebyscore(_room_key(voice_room_id), '-inf', now)
+        pipe.zremrangebyscore(_room_key(voice_room_id), '-inf', now)
+        expired, _ = pipe.execute()
+    return {int(uid) for uid in expired}
+
+async def register_peer(voice_room_id, user_id, channel_name):
+    await cache.aset(_peer_key(voice_room_id, user_id), channel_name, settings.VOICE_MEMBER_TTL)
+
+async def unregister_peer(voice_room_id, user_id, channel_name):
+    key = _peer_key(voice_room_id, user_id)
+    # Запись могла уже принадлежать новому сокету того же пользователя
+    if await cache.aget(key) == channel_name:
+        await cache.adelete(key)
+
+async def get_peer_channel(voice_room_id, user_id):
+    return await cache.aget(_peer_key(voice_room_id, user_id))
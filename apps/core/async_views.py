@@ -0,0 +1,43 @@
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.auth.views import redirect_to_login
+from django.http import Http404
+
+# Помощники для async-представлений: в Django 4.2 нет request.auser(),
+# асинхронного login_required и get_object_or_404.
+
+async def aget_user(request):
+    # request.user ленивый: загрузка сессии и пользователя — синхронный ORM,
+    # поэтому один переход в пул потоков, дальше объект уже загружен
+    user = request.user
+    await sync_to_async(lambda: user.is_authenticated)()
+    return user
+
+def alogin_required(view_func):
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        user = await aget_user(request)
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+async def aiterate(iterator, thread_sensitive=True):
+    # Синхронный генератор (ORM, файлы) как async-итератор для StreamingHttpResponse:
+    # синхронный Django под ASGI сначала целиком собирает в список. Каждый
+    # блок — один переход в поток thread_sensitive, где живёт соединение с БД;
+    # генератору без ORM (чтение файла) хватает общего пула: thread_sensitive=False
+    done = object()
+    step = sync_to_async(next, thread_sensitive=thread_sensitive)
+    while True:
+        chunk = await step(iterator, done)
+        if chunk is done:
+            return
+        yield chunk
+
+async def aget_object_or_404(klass, *args, **kwargs):
+    queryset = klass._default_manager.all() if hasattr(klass, '_default_manager') else klass
+    try:
+        return await queryset.aget(*args, **kwargs)
+    except queryset.model.DoesNotExist:
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
@@ -0,0 +1,92 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from django.conf import settings
+
+# Структурный журнал событий для горячих путей (WebSocket-consumer'ы).
+#
+# - Каждое событие увеличивает счётчик; счётчики раз в EVENT_LOG_FLUSH_INTERVAL
+#   секунд уходят одной строкой "event_counters" вместо строки на событие.
+# - Отдельная строка пишется только для доли событий EVENT_LOG_SAMPLE_RATES
+#   (по имени события, по умолчанию EVENT_LOG_DEFAULT_RATE) и не чаще
+#   EVENT_LOG_RATE_LIMIT строк в секунду на событие. WARNING и выше не
+#   сэмплируются, но тоже ограничены по частоте.
+# - Запись собирается лениво: значения-функции вызываются, только если строка
+#   действительно пишется, а при выключенном уровне не делается ничего.
+# - Поля с телами сообщений (REDACTED_FIELDS) заменяются длиной, пока не
+#   включён EVENT_LOG_BODIES.
+
+REDACTED_FIELDS = {'content', 'text', 'text_data'}
+
+class EventLog:
+    def __init__(self, name):
+        self.logger = logging.getLogger(name)
+        self.counters = Counter()
+        self.window = {}
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+
+    def info(self, event, **fields):
+        self.log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        self.log(logging.WARNING, event, fields)
+
+    def error(self, event, exc_info=False, **fields):
+        self.log(logging.ERROR, event, fields, exc_info)
+
+    def log(self, level, event, fields, exc_info=False):
+        now = time.monotonic()
+        with self.lock:
+            self.counters[event] += 1
+            if now - self.last_flush >= settings.EVENT_LOG_FLUSH_INTERVAL:
+                self.flush(now)
+        if not self.logger.isEnabledFor(level):
+            return
+        if level < logging.WARNING:
+            rate = settings.EVENT_LOG_SAMPLE_RATES.get(event, settings.EVENT_LOG_DEFAULT_RATE)
+            if rate < 1 and random.random() >= rate:
+                return
+        if not self.allow(event, now):
+            return
+        self.logger.log(level, '%s', _Record(event, fields), exc_info=exc_info)
+
+    def allow(self, event, now):
+        # Окно в одну секунду на событие; лишнее отражается только в счётчиках
+        with self.lock:
+            started, count = self.window.get(event, (now, 0))
+            if now - started >= 1:
+                started, count = now, 0
+            if count >= settings.EVENT_LOG_RATE_LIMIT:
+                self.counters['eventlog.dropped'] += 1
+                return False
+            self.window[event] = (started, count + 1)
+            return True
+
+    def flush(self, now=None):
+        # Вызывается под self.lock
+        self.last_flush = now or time.monotonic()
+        if self.counters and self.logger.isEnabledFor(logging.INFO):
+            self.logger.info('%s', _Record('event_counters', dict(self.counters)))
+        self.counters.clear()
+
+class _Record:
+    # Строка собирается при форматировании, то есть только если её пишет хендлер
+    __slots__ = ('event', 'fields')
+
+    def __init__(self, event, fields):
+        self.event = event
+        self.fields = fields
+
+    def __str__(self):
+        record = {'event': self.event}
+        for key, value in self.fields.items():
+            if callable(value):
+                value = value()
+            if key in REDACTED_FIELDS and not settings.EVENT_LOG_BODIES and value is not None:
+                key, value = f'{key}_len', len(value)
+            record[key] = value
+        return json.dumps(record, default=str, ensure_ascii=False)
@@ -0,0 +1,11 @@
+import json
+
+# События для group_send с заранее закодированным кадром: JSON собирается
+# один раз у отправителя, а consumer'ы получателей пересылают поле text
+# клиенту как есть, без json.dumps на каждого участника группы.
+
+def encode_frame(event_type, **payload):
+    return json.dumps({'type': event_type, **payload})
+
+def encode_event(event_type, **payload):
+    return {'type': event_type, 'text': encode_frame(event_type, **payload)}
@@ -0,0 +1,41 @@
+import time
+from django.core.cache import cache
+
+# Поколения для кэша, который заполняют читатели: значение кладётся под ключ
+# с текущим поколением, изменение данных увеличивает поколение после коммита.
+# Читатель, загрузивший из БД старые данные до коммита, запишет их под старое
+# поколение, которое уже никто не читает, — с delete такая запись пережила бы
+# сброс на весь TTL.
+#
+# Поколение без срока жизни. Если Redis его вытеснит, новое начинается с
+# текущего времени в наносекундах, а не с 1: старые ключи не совпадут.
+
+def _fresh():
+    return time.time_ns()
+
+def get_generation(key):
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, _fresh(), None)
+        value = cache.get(key) or _fresh()
+    return value
+
+def get_generations(keys):
+    # {ключ: поколение} одним запросом для тёплых ключей
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            found[key] = get_generation(key)
+    return found
+
+def bump_generation(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключа нет: ставим безусловно — читатель мог успеть завести
+        # поколение и записать под ним данные, прочитанные до коммита
+        cache.set(key, _fresh(), None)
+
+def bump_generations(keys):
+    for key in keys:
+        bump_generation(key)
@@ -0,0 +1,55 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from apps.core.thumbnails import generate_thumbnails, is_image_name, thumbnail_fields, thumbnails_ready
+
+JOBS_PER_WORKER = 4
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие уменьшенные копии для уже загруженных изображений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--model', action='append', default=[],
+                            help='Только указанные модели (app_label.Model), можно несколько раз')
+
+    def handle(self, *args, **options):
+        self.created = self.failed = 0
+        window = options['workers'] * JOBS_PER_WORKER
+        with ThreadPoolExecutor(options['workers']) as pool:
+            for model, field in thumbnail_fields():
+                if options['model'] and model._meta.label not in options['model']:
+                    continue
+                names = (
+                    model._default_manager
+                    .exclude(Q(**{f'{field.attname}__isnull': True}) | Q(**{field.attname: ''}))
+                    .values_list(field.attname, flat=True)
+                    .iterator(chunk_size=2000)
+                )
+                images = 0
+                jobs = {}
+                for name in names:
+                    if not is_image_name(name):
+                        continue
+                    images += 1
+                    # Не больше window задач в очереди: таблица может быть любого размера
+                    if len(jobs) >= window:
+                        done, _ = wait(jobs, return_when=FIRST_COMPLETED)
+                        self.collect(model, field, jobs, done)
+                    jobs[pool.submit(generate_thumbnails, field.storage, name,
+                                     field.thumbnail_sizes, field.thumbnail_crop)] = name
+                self.collect(model, field, jobs, list(jobs))
+                self.stdout.write(f'{model._meta.label}.{field.name}: {images} images')
+        self.stdout.write(f'Создано копий: {self.created}, ошибок: {self.failed}')
+
+    def collect(self, model, field, jobs, done):
+        for job in done:
+            name = jobs.pop(job)
+            try:
+                count = job.result()
+                self.created += count
+                if count:
+                    thumbnails_ready.send(sender=model, name=name)
+            except Exception as e:
+                self.failed += 1
+                self.stderr.write(f'{model._meta.label}.{field.name}: {name}: {e}')
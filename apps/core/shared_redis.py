@@ -0,0 +1,31 @@
+import asyncio
+import weakref
+import redis
+import redis.asyncio
+from django.conf import settings
+
+# Прямой клиент Redis (REDIS_URL — тот же сервер, что у кэша и channel layer)
+# для структур, которых нет в API кэша Django: отсортированные множества,
+# где score — срок жизни элемента (присутствие, участники голосовых комнат).
+# Ключи получают префикс кэша (KEY_PREFIX), чтобы не пересекаться с другими
+# приложениями на том же сервере.
+
+_async_clients = weakref.WeakKeyDictionary()
+_client = None
+
+def key(name):
+    return f'{settings.CACHES["default"].get("KEY_PREFIX", "")}:{name}'
+
+def get_client():
+    # Для синхронного кода (представления, management-команды)
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+def get_async_client():
+    # Соединения redis.asyncio привязаны к циклу событий: клиент на цикл
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        _async_clients[loop] = redis.asyncio.Redis.from_url(settings.REDIS_URL)
+    return _async_clients[loop]
@@ -0,0 +1,10 @@
+from django import template
+
+register = template.Library()
+
+@register.filter
+def thumbnail_url(field_file, size):
+    # {{ user.avatar|thumbnail_url:64 }} — см. apps/core/thumbnails.py
+    if not field_file:
+        return ''
+    return field_file.thumbnail_url(size)
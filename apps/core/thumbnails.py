@@ -0,0 +1,185 @@
+import hashlib
+import logging
+import os
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import models, transaction
+from django.db.models.fields.files import FieldFile, ImageFieldFile
+from django.db.models.signals import post_save
+from django.dispatch import Signal
+from PIL import Image, ImageOps, features
+from .lru import LocalLRU
+
+logger = logging.getLogger(__name__)
+
+# Уменьшенные копии изображений (аватары, стикеры, картинки во вложениях).
+#
+# Поля ThumbnailImageField / ThumbnailFileField после сохранения модели (и коммита
+# транзакции) ставят исходный файл в пул потоков; там Pillow готовит копии всех
+# размеров поля. Копия лежит рядом с оригиналом:
+#     <каталог оригинала>/thumbs/<sha1 имени оригинала>_<размер>.<webp|jpg>
+# Имя в хранилище не перезаписывается (новая загрузка получает новое имя), поэтому
+# по нему однозначно определяется содержимое и копии не нужно инвалидировать.
+# Ключ — имя, а не хэш содержимого: так thumbnail_url не читает файл при отрисовке.
+# Одинаковые загрузки получают разные имена и свои копии — дедупликации нет.
+#
+# field_file.thumbnail_url(size) отдаёт наименьшую готовую копию не меньше size,
+# а пока её нет — оригинал. В шаблонах: {{ user.avatar|thumbnail_url:64 }}.
+# После создания копий отправляется сигнал thumbnails_ready(sender=модель, name=имя):
+# по нему сбрасываются кэши, где уже лежат URL оригиналов.
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'}
+THUMBNAIL_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+THUMBNAIL_EXT = 'webp' if THUMBNAIL_FORMAT == 'WEBP' else 'jpg'
+
+# Готовая копия уже не исчезнет — положительный ответ хранится бессрочно.
+# Отрицательные — с коротким TTL: иначе каждая отрисовка до появления копии
+# (или после неудачной генерации) шла бы в storage.exists()
+_ready = LocalLRU(settings.THUMBNAIL_READY_CACHE_SIZE, ttl=float('inf'))
+_missing = LocalLRU(settings.THUMBNAIL_READY_CACHE_SIZE, ttl=settings.THUMBNAIL_MISS_TTL)
+# Имена оригиналов, уже отправленных в пул (или упавших при генерации): повторно
+# не ставятся до истечения THUMBNAIL_RETRY_TTL, сколько бы раз ни сохранялась модель
+_scheduled = LocalLRU(settings.THUMBNAIL_READY_CACHE_SIZE, ttl=settings.THUMBNAIL_RETRY_TTL)
+_executor = None
+
+thumbnails_ready = Signal()
+
+def thumbnail_name(name, size):
+    digest = hashlib.sha1(name.encode()).hexdigest()[:20]
+    return posixpath.join(posixpath.dirname(name), 'thumbs', f'{digest}_{size}.{THUMBNAIL_EXT}')
+
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+def render_thumbnail(image, size, crop):
+    if crop:
+        # Квадрат для аватаров
+        image = ImageOps.fit(image, (size, size), Image.LANCZOS)
+    else:
+        image = image.copy()
+        image.thumbnail((size, size), Image.LANCZOS)
+    buffer = BytesIO()
+    if THUMBNAIL_FORMAT == 'JPEG':
+        image.convert('RGB').save(buffer, 'JPEG', quality=settings.THUMBNAIL_QUALITY, optimize=True)
+    else:
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+        image.save(buffer, 'WEBP', quality=settings.THUMBNAIL_QUALITY, method=4)
+    return buffer.getvalue()
+
+def generate_thumbnails(storage, name, sizes, crop):
+    # Возвращает число созданных копий; уже существующие пропускаются
+    missing = [size for size in sizes if not storage.exists(thumbnail_name(name, size))]
+    if not missing:
+        return 0
+    with storage.open(name, 'rb') as f:
+        with Image.open(f) as image:
+            image.seek(0)  # у анимированных GIF/WebP — первый кадр
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    for size in missing:
+        target = thumbnail_name(name, size)
+        # Хранилище не перезаписывает файлы: при гонке двух воркеров второй получил бы другое имя
+        if not storage.exists(target):
+            storage.save(target, ContentFile(render_thumbnail(image, size, crop)))
+        _ready.set(target, True)
+        _missing.delete(target)
+    return len(missing)
+
+def _generate_safely(model, storage, name, sizes, crop):
+    try:
+        if generate_thumbnails(storage, name, sizes, crop):
+            thumbnails_ready.send(sender=model, name=name)
+    except Exception as e:
+        # Срок до повтора отсчитывается от неудачи
+        _scheduled.set(name, True)
+        logger.error(f"Thumbnail generation failed for {name}: {e}")
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+    return _executor
+
+def schedule(model, storage, name, sizes, crop):
+    if _scheduled.get(name):
+        return
+    _scheduled.set(name, True)
+    if settings.THUMBNAIL_SYNC:
+        _generate_safely(model, storage, name, sizes, crop)
+    else:
+        get_executor().submit(_generate_safely, model, storage, name, sizes, crop)
+
+class ThumbnailMixin:
+    # Для FieldFile: доступ к уменьшенным копиям
+    def thumbnail_url(self, size):
+        if not self.name:
+            return None
+        if not is_image_name(self.name):
+            return self.url
+        sizes = sorted(self.field.thumbnail_sizes)
+        size = next((s for s in sizes if s >= int(size)), sizes[-1])
+        target = thumbnail_name(self.name, size)
+        if _ready.get(target):
+            return self.storage.url(target)
+        if _missing.get(target):
+            return self.url
+        if self.storage.exists(target):
+            _ready.set(target, True)
+            return self.storage.url(target)
+        _missing.set(target, True)
+        return self.url
+
+class ThumbnailFieldFile(ThumbnailMixin, FieldFile):
+    pass
+
+class ThumbnailImageFieldFile(ThumbnailMixin, ImageFieldFile):
+    pass
+
+class ThumbnailFieldMixin:
+    def __init__(self, *args, thumbnail_sizes=(128,), thumbnail_crop=False, **kwargs):
+        self.thumbnail_sizes = tuple(thumbnail_sizes)
+        self.thumbnail_crop = thumbnail_crop
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        kwargs['thumbnail_sizes'] = self.thumbnail_sizes
+        if self.thumbnail_crop:
+            kwargs['thumbnail_crop'] = True
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        if not cls._meta.abstract:
+            post_save.connect(self.schedule_thumbnails, sender=cls, weak=False,
+                              dispatch_uid=f'thumbnails:{cls._meta.label}.{name}')
+
+    def schedule_thumbnails(self, sender, instance, raw=False, **kwargs):
+        field_file = getattr(instance, self.attname)
+        if raw or not field_file or not is_image_name(field_file.name):
+            return
+        name, storage = field_file.name, field_file.storage
+        # Модели сохраняются часто (User — на каждое изменение статуса): если все копии
+        # уже известны как готовые или файл недавно ставился в пул, ничего не отправляем
+        if _scheduled.get(name) or all(_ready.get(thumbnail_name(name, size)) for size in self.thumbnail_sizes):
+            return
+        transaction.on_commit(lambda: schedule(sender, storage, name, self.thumbnail_sizes, self.thumbnail_crop))
+
+class ThumbnailImageField(ThumbnailFieldMixin, models.ImageField):
+    attr_class = ThumbnailImageFieldFile
+
+class ThumbnailFileField(ThumbnailFieldMixin, models.FileField):
+    # Обычный файл; копии делаются только для изображений по расширению
+    attr_class = ThumbnailFieldFile
+
+def thumbnail_fields():
+    # (модель, поле) для всех полей с копиями — для backfill_thumbnails
+    from django.apps import apps
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, ThumbnailFieldMixin):
+                yield model, field
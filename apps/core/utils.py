@@ -1,4 +1,19 @@
 import random
+from contextlib import contextmanager
 
 def generate_discriminator():
-    return f'{random.randint(1000, 9999)}'
\ No newline at end of file
+    return f'{random.randint(1000, 9999)}'
+
+@contextmanager
+def preserve_auto_now(model, *field_names):
+    # Временно отключает auto_now/auto_now_add, чтобы bulk_create сохранял
+    # переданные даты (сидирование бенчмарков, импорт истории)
+    fields = [model._meta.get_field(name) for name in field_names]
+    saved = [(f.auto_now, f.auto_now_add) for f in fields]
+    for f in fields:
+        f.auto_now = f.auto_now_add = False
+    try:
+        yield
+    finally:
+        for f, (auto_now, auto_now_add) in zip(fields, saved):
+            f.auto_now, f.auto_now_add = auto_now, auto_now_add
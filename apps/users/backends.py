@@ -0,0 +1,30 @@
+from django.contrib.auth.backends import ModelBackend
+from .models import User
+
+class EmailOrTagBackend(ModelBackend):
+    # Вход по email, по полному ID "никнейм#1234" или по никнейму, если он
+    # принадлежит одному пользователю (никнеймы больше не уникальны)
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        identifier = username if username is not None else kwargs.get(User.USERNAME_FIELD)
+        if not identifier or password is None:
+            return None
+        user = self.find_user(identifier.strip())
+        if user is None:
+            # Хэшируем пароль и для несуществующего пользователя: время ответа не выдаёт аккаунты
+            User().set_password(password)
+            return None
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
+
+    def find_user(self, identifier):
+        if '@' in identifier:
+            lookup = {'email__iexact': identifier}
+        elif '#' in identifier:
+            username, _, discriminator = identifier.rpartition('#')
+            lookup = {'username': username, 'discriminator': discriminator}
+        else:
+            lookup = {'username': identifier}
+        users = list(User.objects.filter(**lookup)[:2])
+        return users[0] if len(users) == 1 else None
@@ -1,79 +1,78 @@
 import json
-import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db import models
-from .models import Friendship
+from apps.core.eventlog import EventLog
+from .friends import aget_friend_ids, friends_among
+from .presence import PresenceService, public_status
 
-logger = logging.getLogger(__name__)
+log = EventLog(__name__)
 User = get_user_model()
 
-class StatusConsumer(AsyncWebsocketConsumer):
+class PresenceMixin:
+    # Присутствие пользователя и статусы друзей; используется StatusConsumer
+    # и общим сокетом EventsConsumer (apps/chat/consumers.py)
+    async def presence_connect(self):
+        self.user_group_name = f'user_{self.user.id}'
+        await self.channel_layer.group_add(self.user_group_name, self.channel_name)
+        self.presence = PresenceService(self.channel_layer)
+        await self.accept()
+        friend_ids = await aget_friend_ids(self.user.id)
+        await self.presence.connected(self.user.id, self.channel_name, self.user.manual_status, friend_ids)
+        # Снимок статусов друзей вместо ожидания отдельных событий
+        await self.send(text_data=json.dumps({
+            'type': 'presence_snapshot',
+            'statuses': await self.presence.snapshot(friend_ids),
+            'heartbeat_interval': settings.PRESENCE_HEARTBEAT_INTERVAL,
+        }))
+
+    async def presence_disconnect(self):
+        await self.presence.disconnected(self.user.id, self.channel_name, await aget_friend_ids(self.user.id))
+        await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
+
+    async def handle_presence_frame(self, data):
+        if data['type'] == 'heartbeat':
+            if not await self.presence.heartbeat(self.user.id, self.channel_name):
+                await self.presence.connected(
+                    self.user.id, self.channel_name, self.user.manual_status, await aget_friend_ids(self.user.id)
+                )
+        elif data['type'] == 'status_change':
+            new_status = data['status']
+            if new_status not in dict(User._meta.get_field('manual_status').choices):
+                return
+            self.user.manual_status = new_status
+            await database_sync_to_async(self.user.save)(update_fields=['manual_status'])
+            await self.presence.set_status(self.user.id, public_status(new_status), await aget_friend_ids(self.user.id))
+            log.info('presence.status_change', user_id=self.user.id, status=new_status)
+        elif data['type'] == 'presence_query':
+            # Статусы произвольного списка пользователей (например, участников чата),
+            # но только тех, кто в друзьях
+            candidate_ids = {int(uid) for uid in data.get('user_ids', [])}
+            allowed = await database_sync_to_async(friends_among)(self.user.id, candidate_ids)
+            await self.send(text_data=json.dumps({
+                'type': 'presence_snapshot',
+                'statuses': await self.presence.snapshot(allowed),
+                'heartbeat_interval': settings.PRESENCE_HEARTBEAT_INTERVAL,
+            }))
+
+    async def friend_status(self, event):
+        await self.send(text_data=event['text'])
+
+class StatusConsumer(PresenceMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope['user']
         if self.user.is_anonymous:
-            logger.warning("Anonymous user rejected from status socket")
+            log.warning('ws.reject', socket='status', reason='anonymous')
             await self.close(code=4001)
         else:
-            self.user_group_name = f'user_{self.user.id}'
-            await self.channel_layer.group_add(self.user_group_name, self.channel_name)
-
-            # Устанавливаем статус онлайн, если не невидимка
-            if self.user.manual_status != 'invisible':
-                await self.set_online_status(True)
-            await self.accept()
-            logger.info(f"User {self.user.id} connected to status socket")
+            await self.presence_connect()
+            log.info('ws.connect', socket='status', user_id=self.user.id)
 
     async def disconnect(self, close_code):
-        if hasattr(self, 'user') and not self.user.is_anonymous:
-            await self.set_online_status(False)
-            await self.channel_layer.group_discard(self.user_group_name, self.channel_name)
-            logger.info(f"User {self.user.id} disconnected from status socket, code {close_code}")
+        if hasattr(self, 'presence'):
+            await self.presence_disconnect()
+            log.info('ws.disconnect', socket='status', user_id=self.user.id, code=close_code)
 
     async def receive(self, text_data):
-        data = json.loads(text_data)
-        if data['type'] == 'status_change':
-            new_status = data['status']
-            self.user.manual_status = new_status
-            await database_sync_to_async(self.user.save)()
-            if new_status != 'invisible':
-                await self.broadcast_status_to_friends(new_status)
-            logger.info(f"User {self.user.id} changed status to {new_status}")
-
-    async def set_online_status(self, is_online):
-        status = 'online' if is_online else 'offline'
-        await self.broadcast_status_to_friends(status)
-
-    async def broadcast_status_to_friends(self, status):
-        friends = await self.get_friends()
-        for friend in friends:
-            await self.channel_layer.group_send(
-                f'user_{friend.id}',
-                {
-                    'type': 'friend_status',
-                    'user_id': self.user.id,
-                    'status': status,
-                }
-            )
-
-    @database_sync_to_async
-    def get_friends(self):
-        friendships = Friendship.objects.filter(
-            (models.Q(from_user=self.user) | models.Q(to_user=self.user)),
-            status='accepted'
-        ).select_related('from_user', 'to_user')
-        friends = []
-        for fs in friendships:
-            if fs.from_user == self.user:
-                friends.append(fs.to_user)
-            else:
-                friends.append(fs.from_user)
-        return friends
-
-    async def friend_status(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'friend_status',
-            'user_id': event['user_id'],
-            'status': event['status'],
-        }))
\ No newline at end of file
+        await self.handle_presence_frame(json.loads(text_data))
@@ -1,6 +1,12 @@
 from django import forms
 from django.contrib.auth.forms import AuthenticationForm
-from .models import User, Friendship
+from .models import User, Friendship, UsernameSlots
+
+def clean_username_slots(username):
+    # Окончательная проверка — при выделении номера в User.save()
+    if UsernameSlots.objects.is_full(username):
+        raise forms.ValidationError('Все номера для этого никнейма заняты, выберите другой')
+    return username
 
 class UserRegistrationForm(forms.ModelForm):
     password = forms.CharField(widget=forms.PasswordInput, label='Пароль')
@@ -16,6 +22,9 @@ class UserRegistrationForm(forms.ModelForm):
             'bio': 'О себе',
         }
 
+    def clean_username(self):
+        return clean_username_slots(self.cleaned_data['username'])
+
     def clean(self):
         cleaned_data = super().clean()
         password = cleaned_data.get('password')
@@ -25,7 +34,7 @@ class UserRegistrationForm(forms.ModelForm):
         return cleaned_data
 
 class LoginForm(AuthenticationForm):
-    username = forms.CharField(label='Email или никнейм')
+    username = forms.CharField(label='Email, ID (никнейм#1234) или никнейм')
 
 class AddFriendForm(forms.Form):
     friend_id = forms.CharField(label='ID друга (никнейм#цифры)')
@@ -71,6 +80,12 @@ class ChangeUsernameForm(forms.ModelForm):
         fields = ['username']
         labels = {'username': 'Новый никнейм'}
 
+    def clean_username(self):
+        username = self.cleaned_data['username']
+        if username == self.instance._loaded_username:
+            return username
+        return clean_username_slots(username)
+
 class ChangeBioForm(forms.ModelForm):
     class Meta:
         model = User
@@ -0,0 +1,49 @@
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from apps.core.generations import bump_generations, get_generation
+from .models import Friendship
+
+# Граф дружбы в общем кэше: friends:<id>:<поколение> -> frozenset id друзей.
+# Промах читает БД один раз; принятие заявки и удаление дружбы после коммита
+# увеличивают поколение обоих пользователей (см. signals.py и
+# apps/core/generations.py), и следующее чтение загружает множество заново.
+# Правка закэшированного множества на месте (get + set) теряла ребро при
+# одновременных изменениях дружбы одного пользователя.
+
+def _generation_key(user_id):
+    return f'friends:gen:{user_id}'
+
+def _key(user_id):
+    return f'friends:{user_id}:{get_generation(_generation_key(user_id))}'
+
+def _load(user_id):
+    rows = Friendship.objects.filter(
+        Q(from_user_id=user_id) | Q(to_user_id=user_id),
+        status='accepted'
+    ).values_list('from_user_id', 'to_user_id')
+    return frozenset(to_id if from_id == user_id else from_id for from_id, to_id in rows)
+
+def get_friend_ids(user_id):
+    # Поколение читается до запроса к БД: иначе загруженное до коммита
+    # множество легло бы под новое поколение
+    key = _key(user_id)
+    friend_ids = cache.get(key)
+    if friend_ids is None:
+        friend_ids = _load(user_id)
+        cache.set(key, friend_ids, settings.FRIEND_GRAPH_CACHE_TTL)
+    return friend_ids
+
+aget_friend_ids = database_sync_to_async(get_friend_ids)
+
+def friends_among(user_id, candidate_ids):
+    # Какие из candidate_ids — друзья user_id; при тёплом кэше без запросов к БД
+    return get_friend_ids(user_id).intersection(candidate_ids)
+
+def are_friends(user_id, other_id):
+    return other_id in get_friend_ids(user_id)
+
+def invalidate(user_id, friend_id):
+    # Ребро между пользователями изменилось: вызывается после коммита
+    bump_generations([_generation_key(user_id), _generation_key(friend_id)])
@@ -0,0 +1,119 @@
+import random
+import secrets
+import statistics
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.models import Count
+from ...models import (
+    DISCRIMINATOR_MAX, DISCRIMINATOR_MIN, User, UsernameSlots, format_discriminator,
+)
+
+BATCH_SIZE = 5000
+
+def legacy_discriminator(username):
+    # Прежний подход: случайный номер и проверка, пока не найдётся свободный.
+    # Возвращает (номер, число запросов)
+    attempts = 0
+    while True:
+        attempts += 1
+        discriminator = format_discriminator(random.randint(DISCRIMINATOR_MIN, DISCRIMINATOR_MAX))
+        if not User.objects.filter(username=username, discriminator=discriminator).exists():
+            return discriminator, attempts
+
+def fill_username(username, count):
+    # count пользователей с одним никнеймом на случайных номерах, карта собирается из таблицы
+    numbers = random.sample(range(DISCRIMINATOR_MIN, DISCRIMINATOR_MAX + 1), count)
+    User.objects.bulk_create([
+        User(username=username, email=f'{username}_{n}@bench.local', discriminator=format_discriminator(n))
+        for n in numbers
+    ], batch_size=BATCH_SIZE)
+    UsernameSlots.objects.rebuild(username)
+
+class Command(BaseCommand):
+    help = 'Выделение discriminator для никнейма, у которого уже много пользователей: карта UsernameSlots против случайных попыток'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--existing', type=int, default=9000, help='Пользователей с этим никнеймом заранее')
+        parser.add_argument('--registrations', type=int, default=500)
+        parser.add_argument('--threads', type=int, default=8, help='Потоков в проверке параллельных регистраций')
+
+    def handle(self, *args, **options):
+        existing = options['existing']
+        registrations = options['registrations']
+        if existing + registrations > DISCRIMINATOR_MAX - DISCRIMINATOR_MIN + 1:
+            raise CommandError('existing + registrations больше числа доступных номеров')
+        tag = secrets.token_hex(3)
+        legacy_name, slots_name, race_name = (f'bench_{tag}_{kind}' for kind in ('legacy', 'slots', 'race'))
+        try:
+            for username in (legacy_name, slots_name):
+                fill_username(username, existing)
+
+            legacy_ms, attempts = [], []
+            for i in range(registrations):
+                started = time.perf_counter()
+                discriminator, tries = legacy_discriminator(legacy_name)
+                User.objects.create(username=legacy_name, email=f'{legacy_name}_new{i}@bench.local',
+                                    discriminator=discriminator)
+                legacy_ms.append((time.perf_counter() - started) * 1000)
+                attempts.append(tries)
+
+            slots_ms = []
+            for i in range(registrations):
+                started = time.perf_counter()
+                User.objects.create(username=slots_name, email=f'{slots_name}_new{i}@bench.local')
+                slots_ms.append((time.perf_counter() - started) * 1000)
+
+            self.stdout.write(
+                f'vendor: {connection.vendor}, {existing} existing users, {registrations} registrations'
+            )
+            self.stdout.write(
+                f'  random retries: median {statistics.median(legacy_ms):.2f} ms, '
+                f'max {max(legacy_ms):.2f} ms, attempts median {statistics.median(attempts)}, max {max(attempts)}'
+            )
+            self.stdout.write(
+                f'  UsernameSlots:  median {statistics.median(slots_ms):.2f} ms, max {max(slots_ms):.2f} ms'
+            )
+            self.check_concurrent(race_name, options['threads'], registrations)
+        finally:
+            names = (legacy_name, slots_name, race_name)
+            # Карты удаляются первыми: сигнал post_delete тогда не трогает их для каждого пользователя
+            UsernameSlots.objects.filter(username__in=names).delete()
+            User.objects.filter(username__in=names).delete()
+
+    def check_concurrent(self, username, threads, registrations):
+        # Параллельные регистрации одного никнейма не должны получить одинаковый номер
+        if connection.vendor == 'sqlite':
+            self.stdout.write('  concurrent: пропущено, SQLite не поддерживает SELECT ... FOR UPDATE')
+            return
+        barrier = threading.Barrier(threads)
+        per_thread = max(registrations // threads, 1)
+        errors = []
+
+        def worker(index):
+            try:
+                barrier.wait()
+                for i in range(per_thread):
+                    User.objects.create(username=username, email=f'{username}_{index}_{i}@bench.local')
+            except Exception as e:
+                errors.append(repr(e))
+            finally:
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        if errors:
+            raise CommandError(f'{len(errors)} threads failed, first: {errors[0]}')
+        duplicates = User.objects.filter(username=username).values('discriminator').annotate(
+            n=Count('id')).filter(n__gt=1).count()
+        if duplicates:
+            raise CommandError(f'Повторяющихся номеров: {duplicates}')
+        self.stdout.write(
+            f'  concurrent: {threads} threads x {per_thread} registrations in {elapsed:.2f} s, без повторов'
+        )
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_remove_user_chat_wallpaper'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['from_user', 'status'], name='users_friend_from_status'),
+        ),
+        migrations.AddIndex(
+            model_name='friendship',
+            index=models.Index(fields=['to_user', 'status'], name='users_friend_to_status'),
+        ),
+    ]
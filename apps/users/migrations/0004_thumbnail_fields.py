@@ -0,0 +1,19 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:50
+
+import apps.core.thumbnails
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_friendship_status_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=apps.core.thumbnails.ThumbnailImageField(blank=True, null=True, thumbnail_crop=True, thumbnail_sizes=(64, 256), upload_to='avatars/'),
+        ),
+    ]
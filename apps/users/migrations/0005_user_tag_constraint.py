@@ -0,0 +1,34 @@
+# Generated by Django 4.2.5 on 2026-10-18 11:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_thumbnail_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsernameSlots',
+            fields=[
+                ('username', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('taken', models.BinaryField()),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='discriminator',
+            field=models.CharField(blank=True, editable=False, max_length=4),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='username',
+            field=models.CharField(max_length=32, verbose_name='Никнейм'),
+        ),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(fields=('username', 'discriminator'), name='users_user_tag'),
+        ),
+    ]
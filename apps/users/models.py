@@ -1,16 +1,116 @@
 import random
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, models, transaction
 from django.contrib.auth.models import AbstractUser
 from django.db.models import Q
+from apps.core.thumbnails import ThumbnailImageField
+
+# Полный ID пользователя — username#discriminator: никнейм не уникален,
+# уникальна пара. Номер выделяет UsernameSlots (битовая карта занятых номеров
+# для каждого никнейма) под блокировкой строки этого никнейма, поэтому
+# параллельные регистрации с одним именем не получают одинаковый номер,
+# а поиск свободного не зависит от числа уже занятых.
+
+DISCRIMINATOR_MIN = 1
+DISCRIMINATOR_MAX = 9999
+_ALL_SLOTS = ((1 << (DISCRIMINATOR_MAX + 1)) - 1) ^ ((1 << DISCRIMINATOR_MIN) - 1)
 
 def generate_discriminator():
+    # Прежнее значение по умолчанию; нужно только для старых миграций
     return f'{random.randint(1000, 9999)}'
 
+def format_discriminator(number):
+    return f'{number:04d}'
+
+def pick_free(free):
+    # Первый свободный номер не меньше случайного: O(размер карты), без повторных попыток
+    start = random.randint(DISCRIMINATOR_MIN, DISCRIMINATOR_MAX)
+    above = free >> start << start
+    pick = above or free
+    return (pick & -pick).bit_length() - 1
+
+class UsernameSlotsManager(models.Manager):
+    def allocate(self, username, preferred=None):
+        # Вызывается внутри transaction.atomic() вместе с сохранением пользователя
+        slots = self.lock(username)
+        taken = slots.taken_bits()
+        free = _ALL_SLOTS & ~taken
+        if not free:
+            raise ValidationError('Все номера для этого никнейма заняты', code='username_exhausted')
+        number = int(preferred) if preferred else None
+        if number is None or not free >> number & 1:
+            number = pick_free(free)
+        slots.set_taken_bits(taken | 1 << number)
+        slots.save(update_fields=['taken'])
+        return format_discriminator(number)
+
+    def allocate_many(self, username, count):
+        # Для массовых вставок (импорт): count номеров за одну блокировку строки
+        slots = self.lock(username)
+        taken = slots.taken_bits()
+        numbers = []
+        for _ in range(count):
+            free = _ALL_SLOTS & ~taken
+            if not free:
+                raise ValidationError('Все номера для этого никнейма заняты', code='username_exhausted')
+            number = pick_free(free)
+            taken |= 1 << number
+            numbers.append(format_discriminator(number))
+        slots.set_taken_bits(taken)
+        slots.save(update_fields=['taken'])
+        return numbers
+
+    def release(self, username, discriminator):
+        with transaction.atomic():
+            slots = self.select_for_update().filter(username=username).first()
+            if slots is not None:
+                slots.set_taken_bits(slots.taken_bits() & ~(1 << int(discriminator)))
+                slots.save(update_fields=['taken'])
+
+    def lock(self, username):
+        # Строка создаётся из уже существующих пользователей при первом обращении к никнейму
+        slots = self.select_for_update().filter(username=username).first()
+        if slots is None:
+            self.get_or_create(username=username, defaults={'taken': lambda: self.bitmap_from_users(username)})
+            slots = self.select_for_update().get(username=username)
+        return slots
+
+    def rebuild(self, username):
+        # Карта могла разойтись с таблицей пользователей (массовые вставки, ручные правки)
+        self.update_or_create(username=username, defaults={'taken': self.bitmap_from_users(username)})
+
+    def is_full(self, username):
+        slots = self.filter(username=username).first()
+        return slots is not None and not _ALL_SLOTS & ~slots.taken_bits()
+
+    def bitmap_from_users(self, username):
+        taken = 0
+        for discriminator in User.objects.filter(username=username).values_list('discriminator', flat=True):
+            if discriminator.isdigit():
+                taken |= 1 << int(discriminator)
+        return _to_bytes(taken)
+
+def _to_bytes(bits):
+    return bits.to_bytes((DISCRIMINATOR_MAX + 8) // 8, 'little')
+
+class UsernameSlots(models.Model):
+    username = models.CharField(max_length=32, primary_key=True)
+    # Бит N — занят ли discriminator N
+    taken = models.BinaryField()
+
+    objects = UsernameSlotsManager()
+
+    def taken_bits(self):
+        return int.from_bytes(self.taken, 'little')
+
+    def set_taken_bits(self, bits):
+        self.taken = _to_bytes(bits)
+
 class User(AbstractUser):
-    username = models.CharField(max_length=32, unique=True, verbose_name='Никнейм')
+    username = models.CharField(max_length=32, verbose_name='Никнейм')
     email = models.EmailField(unique=True)
-    discriminator = models.CharField(max_length=4, default=generate_discriminator, editable=False)
-    avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
+    discriminator = models.CharField(max_length=4, blank=True, editable=False)
+    avatar = ThumbnailImageField(upload_to='avatars/', blank=True, null=True, thumbnail_sizes=(64, 256), thumbnail_crop=True)
     bio = models.TextField(max_length=500, blank=True)
     manual_status = models.CharField(
         max_length=20,
@@ -24,6 +124,52 @@ class User(AbstractUser):
     )
     last_activity = models.DateTimeField(auto_now=True)
 
+    # Никнейм не уникален; вход по email или username#discriminator (apps/users/backends.py)
+    USERNAME_FIELD = 'email'
+    REQUIRED_FIELDS = ['username']
+
+    _loaded_username = None
+
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            models.UniqueConstraint(fields=['username', 'discriminator'], name='users_user_tag'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_username = instance.__dict__.get('username')
+        return instance
+
+    def save(self, *args, **kwargs):
+        renamed = self._loaded_username is not None and self.username != self._loaded_username
+        if self.discriminator and not renamed:
+            super().save(*args, **kwargs)
+        else:
+            for attempt in range(2):
+                try:
+                    with transaction.atomic():
+                        self.save_with_discriminator(renamed, *args, **kwargs)
+                    break
+                except IntegrityError:
+                    # Номер занят в обход карты: пересобираем её и пробуем ещё раз
+                    if attempt:
+                        raise
+                    UsernameSlots.objects.rebuild(self.username)
+        self._loaded_username = self.username
+
+    def save_with_discriminator(self, renamed, *args, **kwargs):
+        previous = self.discriminator
+        # При смене никнейма номер по возможности сохраняется
+        self.discriminator = UsernameSlots.objects.allocate(self.username, preferred=previous or None)
+        try:
+            super().save(*args, **kwargs)
+        except IntegrityError:
+            self.discriminator = previous
+            raise
+        if renamed:
+            UsernameSlots.objects.release(self._loaded_username, previous)
+
     def get_display_name(self):
         return f'{self.username}#{self.discriminator}'
 
@@ -41,4 +187,9 @@ class Friendship(models.Model):
     )
 
     class Meta:
-        unique_together = ('from_user', 'to_user')
\ No newline at end of file
+        unique_together = ('from_user', 'to_user')
+        indexes = [
+            # Друзья и заявки: (from_user OR to_user) + status, см. views.friends_list и friend_requests
+            models.Index(fields=['from_user', 'status'], name='users_friend_from_status'),
+            models.Index(fields=['to_user', 'status'], name='users_friend_to_status'),
+        ]
\ No newline at end of file
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+import weakref
+from django.conf import settings
+from django.core.cache import cache
+from apps.core import shared_redis
+from apps.core.events import encode_event
+from .friends import aget_friend_ids
+
+logger = logging.getLogger(__name__)
+
+# Присутствие пользователей в Redis (apps/core/shared_redis.py):
+#   presence:conns:<id>  — сокеты пользователя: отсортированное множество
+#       channel_name -> срок (время + PRESENCE_TTL), heartbeat клиента его продлевает;
+#   presence:online      — пользователи, которым разослан не-офлайн статус:
+#       id -> самый поздний срок их сокетов (ставит set_status, продлевает heartbeat);
+#   presence:status:<id> — последний разосланный друзьям статус (кэш Django, тот же TTL).
+# Сокет упавшего процесса disconnect не вызывает — его запись просто истекает.
+# Каждый процесс раз в PRESENCE_HEARTBEAT_INTERVAL секунд смотрит presence:online
+# по score и рассылает offline тем, у кого не осталось живых сокетов. Снятие
+# пользователя из presence:online — один Lua-скрипт, поэтому offline рассылает
+# ровно один процесс.
+# Уход в офлайн после закрытия сокета откладывается на PRESENCE_OFFLINE_GRACE
+# секунд: быстрый переподключаемый клиент не порождает пару offline/online у всех друзей.
+
+ONLINE_KEY = 'presence:online'
+SWEEP_BATCH = 500
+
+# Снимает истёкшие сокеты; если живых не осталось — убирает пользователя из
+# presence:online. 1 — офлайн рассылает вызвавший
+CLAIM_OFFLINE = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) > 0 then
+    return 0
+end
+return redis.call('ZREM', KEYS[2], ARGV[2])
+"""
+
+def _conns_key(user_id):
+    return shared_redis.key(f'presence:conns:{user_id}')
+
+def _status_key(user_id):
+    return f'presence:status:{user_id}'
+
+def public_status(manual_status):
+    # Невидимка для друзей выглядит как офлайн
+    return 'offline' if manual_status == 'invisible' else manual_status
+
+def connected_status(manual_status):
+    # Статус при подключении: онлайн, если пользователь не выбрал "не активен" или невидимку
+    if manual_status in ('invisible', 'idle'):
+        return public_status(manual_status)
+    return 'online'
+
+class PresenceService:
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.ttl = settings.PRESENCE_TTL
+
+    async def connected(self, user_id, channel_name, manual_status, friend_ids):
+        await self.touch(user_id, channel_name)
+        _cancel_offline(user_id)
+        _ensure_sweeper(self)
+        await self.set_status(user_id, connected_status(manual_status), friend_ids)
+
+    async def touch(self, user_id, channel_name):
+        expires = time.time() + self.ttl
+        async with shared_redis.get_async_client().pipeline(transaction=True) as pipe:
+            pipe.zadd(_conns_key(user_id), {channel_name: expires})
+            pipe.expire(_conns_key(user_id), self.ttl)
+            pipe.zadd(shared_redis.key(ONLINE_KEY), {user_id: expires}, xx=True, gt=True)
+            await pipe.execute()
+
+    async def heartbeat(self, user_id, channel_name):
+        # False, если статус уже снят (процесс счёл сокет истёкшим) — тогда
+        # сокет объявляется заново через connected()
+        await self.touch(user_id, channel_name)
+        return await cache.atouch(_status_key(user_id), self.ttl)
+
+    async def disconnected(self, user_id, channel_name, friend_ids):
+        client = shared_redis.get_async_client()
+        await client.zrem(_conns_key(user_id), channel_name)
+        if not await client.zcount(_conns_key(user_id), time.time(), '+inf'):
+            _schedule_offline(user_id, self._offline_after_grace(user_id, friend_ids))
+
+    async def claim_offline(self, user_id):
+        # Пользователь мог переподключиться к другому процессу
+        client = shared_redis.get_async_client()
+        claimed = await client.register_script(CLAIM_OFFLINE)(
+            keys=[_conns_key(user_id), shared_redis.key(ONLINE_KEY)],
+            args=[time.time(), user_id],
+        )
+        return bool(claimed)
+
+    async def _offline_after_grace(self, user_id, friend_ids):
+        await asyncio.sleep(settings.PRESENCE_OFFLINE_GRACE)
+        if await self.claim_offline(user_id):
+            await self.announce_offline(user_id, friend_ids)
+
+    async def sweep(self):
+        # Офлайн для пользователей, чьи сокеты истекли без disconnect; возвращает их число
+        client = shared_redis.get_async_client()
+        expired = await client.zrangebyscore(
+            shared_redis.key(ONLINE_KEY), '-inf', time.time(), start=0, num=SWEEP_BATCH
+        )
+        offline = 0
+        for raw_id in expired:
+            user_id = int(raw_id)
+            if await self.claim_offline(user_id):
+                await self.announce_offline(user_id, await aget_friend_ids(user_id))
+                offline += 1
+        return offline
+
+    async def sweep_forever(self):
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Presence sweep failed: {e}")
+
+    async def announce_offline(self, user_id, friend_ids):
+        # После claim_offline: ключ статуса к этому времени мог истечь вместе
+        # с сокетами, поэтому рассылка без сравнения с прежним статусом
+        await cache.adelete(_status_key(user_id))
+        await self.fan_out(user_id, 'offline', friend_ids)
+
+    async def set_status(self, user_id, status, friend_ids):
+        # Рассылает статус, только если он действительно изменился
+        previous = await cache.aget(_status_key(user_id), 'offline')
+        client = shared_redis.get_async_client()
+        if status == 'offline':
+            await cache.adelete(_status_key(user_id))
+            await client.zrem(shared_redis.key(ONLINE_KEY), user_id)
+        else:
+            await cache.aset(_status_key(user_id), status, self.ttl)
+            await client.zadd(shared_redis.key(ONLINE_KEY), {user_id: time.time() + self.ttl}, gt=True)
+        if previous != status:
+            await self.fan_out(user_id, status, friend_ids)
+
+    async def fan_out(self, user_id, status, friend_ids):
+        event = encode_event('friend_status', user_id=user_id, status=status)
+        friend_ids = list(friend_ids)
+        batch = settings.PRESENCE_FANOUT_BATCH
+        # Пачки параллельных group_send вместо последовательного await на каждого друга
+        for start in range(0, len(friend_ids), batch):
+            results = await asyncio.gather(*[
+                self.channel_layer.group_send(f'user_{friend_id}', event)
+                for friend_id in friend_ids[start:start + batch]
+            ], return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error(f"Presence fan-out failed for user {user_id}: {result}")
+
+    async def snapshot(self, user_ids):
+        # Статусы друзей одним MGET; отсутствующие — офлайн
+        user_ids = list(user_ids)
+        found = await cache.aget_many([_status_key(uid) for uid in user_ids])
+        return {uid: found.get(_status_key(uid), 'offline') for uid in user_ids}
+
+_offline_tasks = {}
+_sweepers = weakref.WeakKeyDictionary()
+
+def _ensure_sweeper(service):
+    # Одна задача просмотра на цикл событий процесса
+    loop = asyncio.get_running_loop()
+    task = _sweepers.get(loop)
+    if task is None or task.done():
+        _sweepers[loop] = loop.create_task(service.sweep_forever())
+
+def _schedule_offline(user_id, coro):
+    _cancel_offline(user_id)
+    task = asyncio.get_running_loop().create_task(coro)
+    _offline_tasks[user_id] = task
+    task.add_done_callback(lambda t: _offline_tasks.pop(user_id, None) if _offline_tasks.get(user_id) is t else None)
+
+def _cancel_offline(user_id):
+    task = _offline_tasks.pop(user_id, None)
+    if task is not None:
+        task.cancel()
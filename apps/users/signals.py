@@ -0,0 +1,19 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from . import friends
+from .models import Friendship, User, UsernameSlots
+
+@receiver(post_save, sender=Friendship)
+def friendship_saved(sender, instance, **kwargs):
+    transaction.on_commit(lambda: friends.invalidate(instance.from_user_id, instance.to_user_id))
+
+@receiver(post_delete, sender=Friendship)
+def friendship_deleted(sender, instance, **kwargs):
+    transaction.on_commit(lambda: friends.invalidate(instance.from_user_id, instance.to_user_id))
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Освобождаем номер в карте никнейма
+    if instance.discriminator.isdigit():
+        UsernameSlots.objects.release(instance.username, instance.discriminator)
@@ -10,6 +10,7 @@ from .forms import (
     ChangePasswordForm, ChangeEmailForm, ChangeUsernameForm,
     ChangeBioForm, ChangeStatusForm
 )
+from .friends import get_friend_ids, are_friends
 from apps.chat.models import Conversation
 
 def register_view(request):
@@ -19,7 +20,7 @@ def register_view(request):
             user = form.save(commit=False)
             user.set_password(form.cleaned_data['password'])
             user.save()
-            login(request, user)
+            login(request, user, backend='apps.users.backends.EmailOrTagBackend')
             return redirect('chat:index')
     else:
         form = UserRegistrationForm()
@@ -46,16 +47,7 @@ def profile_view(request):
 
 @login_required
 def friends_list(request):
-    friendships = Friendship.objects.filter(
-        (Q(from_user=request.user) | Q(to_user=request.user)),
-        status='accepted'
-    ).select_related('from_user', 'to_user')
-    friends = []
-    for fs in friendships:
-        if fs.from_user == request.user:
-            friends.append(fs.to_user)
-        else:
-            friends.append(fs.from_user)
+    friends = User.objects.filter(id__in=get_friend_ids(request.user.id))
     return render(request, 'users/friends.html', {'friends': friends})
 
 @login_required
@@ -102,13 +94,9 @@ def handle_request(request, friendship_id, action):
 @login_required
 def user_profile(request, user_id):
     profile_user = get_object_or_404(User, id=user_id)
-    are_friends = Friendship.objects.filter(
-        (Q(from_user=request.user, to_user=profile_user) | Q(from_user=profile_user, to_user=request.user)),
-        status='accepted'
-    ).exists()
     context = {
         'profile_user': profile_user,
-        'are_friends': are_friends,
+        'are_friends': are_friends(request.user.id, profile_user.id),
     }
     return render(request, 'users/user_profile.html', context)
 
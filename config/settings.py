@@ -39,7 +39,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'apps.core.middleware.AsyncWhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -106,19 +106,118 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379')
+
 CHANNEL_LAYERS = {
     'default': {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
-            'hosts': [os.getenv('REDIS_URL', 'redis://localhost:6379')],
+            'hosts': [REDIS_URL],
         },
     },
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'aura',
+    },
+}
+
 AUTH_USER_MODEL = 'users.User'
+# ModelBackend оставлен для сессий, созданных до EmailOrTagBackend
+AUTHENTICATION_BACKENDS = [
+    'apps.users.backends.EmailOrTagBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
 CRISPY_ALLOWED_TEMPLATE_PACKS = 'bootstrap5'
 CRISPY_TEMPLATE_PACK = 'bootstrap5'
 
 LOGIN_URL = '/users/login/'
 LOGIN_REDIRECT_URL = '/'
-LOGOUT_REDIRECT_URL = '/users/login/'
\ No newline at end of file
+LOGOUT_REDIRECT_URL = '/users/login/'
+
+# Чат
+CHAT_HISTORY_PAGE_SIZE = int(os.getenv('CHAT_HISTORY_PAGE_SIZE', '50'))
+# Отложенная пакетная запись сообщений из WebSocket (см. apps/chat/persistence.py)
+CHAT_WRITE_BEHIND = os.getenv('CHAT_WRITE_BEHIND', 'False') == 'True'
+CHAT_WRITE_BEHIND_FLUSH_INTERVAL = float(os.getenv('CHAT_WRITE_BEHIND_FLUSH_INTERVAL', '0.05'))
+CHAT_WRITE_BEHIND_MAX_BATCH = int(os.getenv('CHAT_WRITE_BEHIND_MAX_BATCH', '100'))
+CHAT_WRITE_BEHIND_RETRIES = int(os.getenv('CHAT_WRITE_BEHIND_RETRIES', '3'))
+# Кэш членства в чатах: локальный LRU перед общим кэшем (см. apps/chat/membership.py)
+CHAT_MEMBERSHIP_CACHE_TTL = int(os.getenv('CHAT_MEMBERSHIP_CACHE_TTL', '300'))
+CHAT_MEMBERSHIP_LOCAL_TTL = float(os.getenv('CHAT_MEMBERSHIP_LOCAL_TTL', '5'))
+CHAT_MEMBERSHIP_LOCAL_SIZE = int(os.getenv('CHAT_MEMBERSHIP_LOCAL_SIZE', '10000'))
+# Максимум подписок на чаты у одного сокета ws/events/
+CHAT_MAX_SUBSCRIPTIONS = int(os.getenv('CHAT_MAX_SUBSCRIPTIONS', '500'))
+# Transactional outbox: события представлений пишутся в OutboxEvent и рассылаются
+# командой relay_outbox (см. apps/chat/outbox.py). Без него — group_send после коммита.
+# Включать вместе с процессом relay из Procfile, ровно один экземпляр:
+#     heroku ps:scale relay=1 && heroku config:set CHAT_OUTBOX_ENABLED=True
+# Без запущенного relay события с включённым outbox копятся в таблице и не доходят.
+CHAT_OUTBOX_ENABLED = os.getenv('CHAT_OUTBOX_ENABLED', 'False') == 'True'
+CHAT_OUTBOX_BATCH_SIZE = int(os.getenv('CHAT_OUTBOX_BATCH_SIZE', '500'))
+CHAT_OUTBOX_POLL_INTERVAL = float(os.getenv('CHAT_OUTBOX_POLL_INTERVAL', '0.05'))
+CHAT_OUTBOX_MAX_BACKOFF = float(os.getenv('CHAT_OUTBOX_MAX_BACKOFF', '5'))
+# Сколько секунд пропуск в id OutboxEvent считается незакоммиченной транзакцией
+CHAT_OUTBOX_COMMIT_LAG = float(os.getenv('CHAT_OUTBOX_COMMIT_LAG', '2'))
+# Архив старой истории (см. apps/chat/archive.py): сегменты лежат вне MEDIA_ROOT,
+# горизонт в днях переопределяется у чата полем archive_after_days, 0 — без архива
+CHAT_ARCHIVE_ROOT = os.getenv('CHAT_ARCHIVE_ROOT', str(BASE_DIR / 'archive'))
+CHAT_ARCHIVE_AFTER_DAYS = int(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', '365'))
+CHAT_ARCHIVE_BATCH_SIZE = int(os.getenv('CHAT_ARCHIVE_BATCH_SIZE', '2000'))
+CHAT_ARCHIVE_CACHE_SEGMENTS = int(os.getenv('CHAT_ARCHIVE_CACHE_SEGMENTS', '64'))
+# Выгрузка чата (см. apps/chat/export.py): сообщений в одном запросе к БД
+CHAT_EXPORT_CHUNK_SIZE = int(os.getenv('CHAT_EXPORT_CHUNK_SIZE', '1000'))
+# Загрузка файлов по частям (см. apps/chat/uploads.py)
+CHAT_UPLOAD_CHUNK_SIZE = int(os.getenv('CHAT_UPLOAD_CHUNK_SIZE', str(4 * 1024 * 1024)))
+CHAT_UPLOAD_CHUNK_MAX = int(os.getenv('CHAT_UPLOAD_CHUNK_MAX', str(16 * 1024 * 1024)))
+CHAT_UPLOAD_MAX_SIZE = int(os.getenv('CHAT_UPLOAD_MAX_SIZE', str(2 * 1024 * 1024 * 1024)))
+CHAT_UPLOAD_SESSION_TTL = int(os.getenv('CHAT_UPLOAD_SESSION_TTL', str(24 * 3600)))
+# Отдача вложений фронт-прокси после проверки прав (см. apps/chat/downloads.py):
+# '' — отдаёт Django, 'x-accel' — nginx (internal-локация с префиксом ниже), 'x-sendfile' — Apache/lighttpd
+CHAT_DOWNLOAD_OFFLOAD = os.getenv('CHAT_DOWNLOAD_OFFLOAD', '')
+CHAT_DOWNLOAD_ACCEL_PREFIX = os.getenv('CHAT_DOWNLOAD_ACCEL_PREFIX', '/protected-media/')
+# Каталог стикеров (см. apps/chat/stickers.py)
+STICKER_MANIFEST_CACHE_TTL = int(os.getenv('STICKER_MANIFEST_CACHE_TTL', '86400'))
+STICKER_MANIFEST_LOCAL_TTL = float(os.getenv('STICKER_MANIFEST_LOCAL_TTL', '30'))
+# Голосовые комнаты (см. apps/chat/voice.py): место участника живёт VOICE_MEMBER_TTL секунд
+# и продлевается сокетом раз в VOICE_HEARTBEAT_INTERVAL
+VOICE_MEMBER_TTL = int(os.getenv('VOICE_MEMBER_TTL', '45'))
+VOICE_HEARTBEAT_INTERVAL = int(os.getenv('VOICE_HEARTBEAT_INTERVAL', '15'))
+# Минимальная длина слова в поиске (innodb_ft_min_token_size в MySQL)
+CHAT_SEARCH_MIN_TERM = int(os.getenv('CHAT_SEARCH_MIN_TERM', '3'))
+# Присутствие (см. apps/users/presence.py)
+PRESENCE_TTL = int(os.getenv('PRESENCE_TTL', '90'))
+PRESENCE_HEARTBEAT_INTERVAL = int(os.getenv('PRESENCE_HEARTBEAT_INTERVAL', '30'))
+PRESENCE_OFFLINE_GRACE = float(os.getenv('PRESENCE_OFFLINE_GRACE', '10'))
+PRESENCE_FANOUT_BATCH = int(os.getenv('PRESENCE_FANOUT_BATCH', '100'))
+FRIEND_GRAPH_CACHE_TTL = int(os.getenv('FRIEND_GRAPH_CACHE_TTL', '86400'))
+# Журнал событий WebSocket (см. apps/core/eventlog.py).
+# EVENT_LOG_SAMPLE_RATES: "событие=доля,..." — доля событий, попадающих в лог строкой
+EVENT_LOG_SAMPLE_RATES = {
+    name.strip(): float(rate)
+    for name, rate in (
+        item.split('=') for item in os.getenv(
+            'EVENT_LOG_SAMPLE_RATES',
+            'ws.frame=0.001,ws.connect=0.01,ws.disconnect=0.01,chat.message=0.001,chat.subscribe=0.01'
+        ).split(',') if item
+    )
+}
+EVENT_LOG_DEFAULT_RATE = float(os.getenv('EVENT_LOG_DEFAULT_RATE', '1.0'))
+EVENT_LOG_RATE_LIMIT = int(os.getenv('EVENT_LOG_RATE_LIMIT', '20'))
+EVENT_LOG_FLUSH_INTERVAL = float(os.getenv('EVENT_LOG_FLUSH_INTERVAL', '60'))
+EVENT_LOG_BODIES = os.getenv('EVENT_LOG_BODIES', 'False') == 'True'
+# Уменьшенные копии изображений (см. apps/core/thumbnails.py)
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+THUMBNAIL_QUALITY = int(os.getenv('THUMBNAIL_QUALITY', '80'))
+THUMBNAIL_READY_CACHE_SIZE = int(os.getenv('THUMBNAIL_READY_CACHE_SIZE', '50000'))
+# Сколько секунд помнить, что копии ещё нет (thumbnail_url отдаёт оригинал без storage.exists)
+THUMBNAIL_MISS_TTL = int(os.getenv('THUMBNAIL_MISS_TTL', '60'))
+# Через сколько секунд сохранение модели снова ставит тот же файл в пул (после постановки или ошибки)
+THUMBNAIL_RETRY_TTL = int(os.getenv('THUMBNAIL_RETRY_TTL', '600'))
+# Генерировать в том же потоке (тесты, отладка)
+THUMBNAIL_SYNC = os.getenv('THUMBNAIL_SYNC', 'False') == 'True'
+# Размер аватара отправителя в событиях чата и истории
+THUMBNAIL_AVATAR_SIZE = int(os.getenv('THUMBNAIL_AVATAR_SIZE', '64'))
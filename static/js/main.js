@@ -1,7 +1,7 @@
-// Инициализация WebSocket статусов, если пользователь авторизован
+// Инициализация общего WebSocket (статусы и чаты), если пользователь авторизован
 document.addEventListener('DOMContentLoaded', function() {
     if (document.querySelector('.user-menu') || document.querySelector('.sidebar')) {
-        initStatusSocket();
+        initEventSocket();
     }
 
     const sendBtn = document.getElementById('send-message');
@@ -52,18 +52,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const file = e.target.files[0];
             if (file && window.conversationId) {
                 console.log('File selected:', file.name);
-                const formData = new FormData();
-                formData.append('file', file);
                 try {
-                    const response = await fetch(`/chat/upload/${window.conversationId}/`, {
-                        method: 'POST',
-                        body: formData,
-                        headers: {
-                            'X-CSRFToken': getCookie('csrftoken')
-                        }
-                    });
-                    if (!response.ok) throw new Error('Upload failed');
-                    const data = await response.json();
+                    const data = await uploadFileChunked(window.conversationId, file);
                     console.log('File uploaded:', data);
                     // Очищаем input, чтобы можно было загрузить тот же файл повторно
                     fileInput.value = '';
@@ -111,18 +101,8 @@ function initFileDragAndDrop(conversationId) {
     async function handleDrop(e) {
         const files = e.dataTransfer.files;
         if (files.length > 0) {
-            const formData = new FormData();
-            formData.append('file', files[0]);
             try {
-                const response = await fetch(`/chat/upload/${conversationId}/`, {
-                    method: 'POST',
-                    body: formData,
-                    headers: {
-                        'X-CSRFToken': getCookie('csrftoken')
-                    }
-                });
-                if (!response.ok) throw new Error('Upload failed');
-                const data = await response.json();
+                const data = await uploadFileChunked(conversationId, files[0]);
                 console.log('File uploaded:', data);
             } catch (error) {
                 console.error('Upload error:', error);
@@ -132,6 +112,73 @@ function initFileDragAndDrop(conversationId) {
     }
 }
 
+// Загрузка по частям с продолжением после обрыва (см. apps/chat/uploads.py).
+// upload_id хранится в localStorage, поэтому повторный выбор того же файла
+// продолжает загрузку с принятого сервером смещения.
+async function uploadFileChunked(conversationId, file) {
+    const storageKey = `upload:${conversationId}:${file.name}:${file.size}:${file.lastModified}`;
+    const csrf = {'X-CSRFToken': getCookie('csrftoken')};
+    let uploadId = localStorage.getItem(storageKey);
+    let offset = 0;
+    let chunkSize = 4 * 1024 * 1024;
+
+    if (uploadId) {
+        const response = await fetch(`/chat/upload/session/${uploadId}/`);
+        if (response.ok) {
+            offset = (await response.json()).offset;
+        } else {
+            uploadId = null;
+        }
+    }
+    if (!uploadId) {
+        const formData = new FormData();
+        formData.append('filename', file.name);
+        formData.append('size', file.size);
+        formData.append('content_type', file.type);
+        const response = await fetch(`/chat/upload/${conversationId}/init/`, {
+            method: 'POST', body: formData, headers: csrf
+        });
+        if (!response.ok) throw new Error('Upload init failed');
+        const data = await response.json();
+        uploadId = data.upload_id;
+        chunkSize = data.chunk_size;
+        localStorage.setItem(storageKey, uploadId);
+    }
+
+    let failures = 0;
+    while (offset < file.size) {
+        const chunk = await file.slice(offset, offset + chunkSize).arrayBuffer();
+        const digest = await crypto.subtle.digest('SHA-256', chunk);
+        const hex = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+        try {
+            const response = await fetch(`/chat/upload/session/${uploadId}/chunk/`, {
+                method: 'POST',
+                body: chunk,
+                headers: {...csrf, 'Content-Type': 'application/octet-stream',
+                          'X-Upload-Offset': offset, 'X-Chunk-Sha256': hex}
+            });
+            const data = await response.json();
+            // При 409 сервер сообщает, сколько байт у него уже есть
+            if (response.ok || response.status === 409) {
+                offset = data.offset;
+                failures = 0;
+                continue;
+            }
+            throw new Error(data.error || 'Chunk upload failed');
+        } catch (error) {
+            if (++failures > 5) throw error;
+            await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+        }
+    }
+
+    const response = await fetch(`/chat/upload/session/${uploadId}/finalize/`, {
+        method: 'POST', headers: csrf
+    });
+    if (!response.ok) throw new Error('Upload finalize failed');
+    localStorage.removeItem(storageKey);
+    return response.json();
+}
+
 // Вспомогательная функция для получения CSRF токена
 function getCookie(name) {
     let cookieValue = null;
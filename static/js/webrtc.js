@@ -1,6 +1,7 @@
 let voiceSocket = null;
-let peerConnection = null;
 let localStream = null;
+// Соединение с каждым участником комнаты: user_id -> RTCPeerConnection
+const peerConnections = new Map();
 const config = { iceServers: [{ urls: 'stun:stun.l.google.com:19302' }] };
 
 function initVoiceSocket(roomId) {
@@ -13,7 +14,17 @@ function initVoiceSocket(roomId) {
 
     voiceSocket.onmessage = function(e) {
         const data = JSON.parse(e.data);
-        handleVoiceSignal(data);
+        if (data.type === 'user_joined') {
+            addParticipant(data);
+        } else if (data.type === 'user_left') {
+            removeParticipant(data.user_id);
+            closePeer(data.user_id);
+        } else if (data.type === 'peer_unavailable') {
+            // Участник ещё не подключил сокет или уже ушёл
+            closePeer(data.target_id);
+        } else {
+            handleVoiceSignal(data);
+        }
     };
 
     voiceSocket.onclose = function() {
@@ -21,53 +32,121 @@ function initVoiceSocket(roomId) {
     };
 }
 
-function handleVoiceSignal(data) {
-    if (!peerConnection) {
-        createPeerConnection();
+// Сигналы адресные: сервер доставляет их только участнику target_id
+function sendSignal(targetId, payload) {
+    if (voiceSocket && voiceSocket.readyState === WebSocket.OPEN) {
+        voiceSocket.send(JSON.stringify({ ...payload, target_id: targetId }));
     }
+}
+
+function handleVoiceSignal(data) {
+    const peerId = data.sender_id;
     switch (data.type) {
-        case 'offer':
-            peerConnection.setRemoteDescription(new RTCSessionDescription(data))
-                .then(() => peerConnection.createAnswer())
-                .then(answer => peerConnection.setLocalDescription(answer))
-                .then(() => {
-                    voiceSocket.send(JSON.stringify({
-                        type: 'answer',
-                        sdp: peerConnection.localDescription.sdp
-                    }));
-                })
+        case 'offer': {
+            const existing = peerConnections.get(peerId);
+            if (existing && existing.signalingState === 'have-local-offer') {
+                // Встречные offer: уступает участник с большим id
+                if (window.currentUserId < peerId) return;
+                closePeer(peerId);
+            }
+            const pc = getPeerConnection(peerId);
+            pc.setRemoteDescription(new RTCSessionDescription({ type: 'offer', sdp: data.sdp }))
+                .then(() => pc.createAnswer())
+                .then(answer => pc.setLocalDescription(answer))
+                .then(() => sendSignal(peerId, { type: 'answer', sdp: pc.localDescription.sdp }))
                 .catch(error => console.error('Error handling offer:', error));
             break;
-        case 'answer':
-            peerConnection.setRemoteDescription(new RTCSessionDescription(data))
+        }
+        case 'answer': {
+            const pc = peerConnections.get(peerId);
+            if (!pc) return;
+            pc.setRemoteDescription(new RTCSessionDescription({ type: 'answer', sdp: data.sdp }))
                 .catch(error => console.error('Error handling answer:', error));
             break;
-        case 'candidate':
-            peerConnection.addIceCandidate(new RTCIceCandidate(data))
-                .catch(error => console.error('Error adding ICE candidate:', error));
+        }
+        case 'candidate': {
+            const pc = peerConnections.get(peerId);
+            if (!pc) return;
+            pc.addIceCandidate(new RTCIceCandidate({
+                candidate: data.candidate,
+                sdpMid: data.sdpMid,
+                sdpMLineIndex: data.sdpMLineIndex
+            })).catch(error => console.error('Error adding ICE candidate:', error));
             break;
+        }
     }
 }
 
-function createPeerConnection() {
-    peerConnection = new RTCPeerConnection(config);
-    peerConnection.onicecandidate = (event) => {
+function getPeerConnection(peerId) {
+    let pc = peerConnections.get(peerId);
+    if (pc) return pc;
+    pc = new RTCPeerConnection(config);
+    peerConnections.set(peerId, pc);
+    if (localStream) {
+        localStream.getTracks().forEach(track => pc.addTrack(track, localStream));
+    }
+    pc.onicecandidate = (event) => {
         if (event.candidate) {
-            voiceSocket.send(JSON.stringify({
+            sendSignal(peerId, {
                 type: 'candidate',
                 candidate: event.candidate.candidate,
                 sdpMid: event.candidate.sdpMid,
                 sdpMLineIndex: event.candidate.sdpMLineIndex
-            }));
+            });
         }
     };
-    peerConnection.ontrack = (event) => {
-        const audio = document.createElement('audio');
+    pc.ontrack = (event) => {
+        let audio = document.getElementById('voice-audio-' + peerId);
+        if (!audio) {
+            audio = document.createElement('audio');
+            audio.id = 'voice-audio-' + peerId;
+            audio.autoplay = true;
+            audio.controls = true;
+            document.body.appendChild(audio);
+        }
         audio.srcObject = event.streams[0];
-        audio.autoplay = true;
-        audio.controls = true;
-        document.body.appendChild(audio);
     };
+    return pc;
+}
+
+function closePeer(peerId) {
+    const pc = peerConnections.get(peerId);
+    if (pc) {
+        pc.close();
+        peerConnections.delete(peerId);
+    }
+    const audio = document.getElementById('voice-audio-' + peerId);
+    if (audio) audio.remove();
+}
+
+async function callPeer(peerId) {
+    const pc = getPeerConnection(peerId);
+    const offer = await pc.createOffer();
+    await pc.setLocalDescription(offer);
+    sendSignal(peerId, { type: 'offer', sdp: pc.localDescription.sdp });
+}
+
+function roomPeerIds() {
+    return Array.from(document.querySelectorAll('.participants-list li[data-user-id]'))
+        .map(li => Number(li.dataset.userId))
+        .filter(id => id !== window.currentUserId);
+}
+
+function addParticipant(data) {
+    const list = document.querySelector('.participants-list ul');
+    if (!list || list.querySelector(`li[data-user-id="${data.user_id}"]`)) return;
+    const li = document.createElement('li');
+    li.setAttribute('data-user-id', data.user_id);
+    const avatar = document.createElement('img');
+    avatar.src = '/static/images/default-avatar.png';
+    avatar.className = 'avatar-tiny';
+    li.append(avatar, ' ' + data.username);
+    list.appendChild(li);
+}
+
+function removeParticipant(userId) {
+    const li = document.querySelector(`.participants-list li[data-user-id="${userId}"]`);
+    if (li) li.remove();
 }
 
 document.addEventListener('DOMContentLoaded', function() {
@@ -78,23 +157,13 @@ document.addEventListener('DOMContentLoaded', function() {
         startBtn.addEventListener('click', async () => {
             try {
                 localStream = await navigator.mediaDevices.getUserMedia({ audio: true, video: false });
-                if (!peerConnection) {
-                    createPeerConnection();
-                }
-                localStream.getTracks().forEach(track => {
-                    if (peerConnection) {
-                        peerConnection.addTrack(track, localStream);
-                    }
-                });
                 startBtn.disabled = true;
                 if (stopBtn) stopBtn.disabled = false;
-
-                const offer = await peerConnection.createOffer();
-                await peerConnection.setLocalDescription(offer);
-                voiceSocket.send(JSON.stringify({
-                    type: 'offer',
-                    sdp: peerConnection.localDescription.sdp
-                }));
+                // Звоним каждому участнику комнаты отдельно
+                for (const peerId of roomPeerIds()) {
+                    closePeer(peerId);
+                    await callPeer(peerId);
+                }
             } catch (err) {
                 console.error('Error accessing microphone:', err);
                 alert('Не удалось получить доступ к микрофону. Проверьте разрешения.');
@@ -108,32 +177,9 @@ document.addEventListener('DOMContentLoaded', function() {
                 localStream.getTracks().forEach(track => track.stop());
                 localStream = null;
             }
-            if (peerConnection) {
-                peerConnection.close();
-                peerConnection = null;
-            }
+            Array.from(peerConnections.keys()).forEach(closePeer);
             if (startBtn) startBtn.disabled = false;
             if (stopBtn) stopBtn.disabled = true;
         });
     }
-voiceSocket.onmessage = function(e) {
-    const data = JSON.parse(e.data);
-    if (data.type === 'user_joined') {
-        console.log('User joined:', data.username);
-        // Добавить элемент в список участников
-        const list = document.querySelector('.participants-list ul');
-        if (list) {
-            const li = document.createElement('li');
-            li.setAttribute('data-user-id', data.user_id);
-            li.innerHTML = `<img src="/static/images/default-avatar.png" class="avatar-tiny"> ${data.username}`;
-            list.appendChild(li);
-        }
-    } else if (data.type === 'user_left') {
-        console.log('User left:', data.user_id);
-        // Удалить элемент из списка
-        const li = document.querySelector(`.participants-list li[data-user-id="${data.user_id}"]`);
-        if (li) li.remove();
-    } else {
-        handleVoiceSignal(data);
-    }
-};
+});
@@ -1,81 +1,183 @@
-let chatSocket = null;
-let statusSocket = null;
+// Один сокет на вкладку: присутствие, счётчики непрочитанного и все открытые чаты
+let eventSocket = null;
+let statusHeartbeat = null;
+// Чат, открытый на странице (room.html); события остальных чатов обновляют список
+let activeConversationId = null;
+const subscribedConversations = new Set();
+// Отправленные, но ещё не подтверждённые сервером сообщения: uid -> {conversationId, content}
+const unconfirmedMessages = new Map();
 
-function initStatusSocket() {
+function sendEvent(payload) {
+    if (eventSocket && eventSocket.readyState === WebSocket.OPEN) {
+        eventSocket.send(JSON.stringify(payload));
+        return true;
+    }
+    return false;
+}
+
+function initEventSocket() {
     const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    statusSocket = new WebSocket(protocol + '//' + window.location.host + '/ws/status/');
-    
-    statusSocket.onopen = function(e) {
-        console.log('Status socket connected');
+    eventSocket = new WebSocket(protocol + '//' + window.location.host + '/ws/events/');
+
+    eventSocket.onopen = function(e) {
+        console.log('Event socket connected');
+        if (subscribedConversations.size) {
+            sendEvent({'type': 'subscribe', 'conversation_ids': Array.from(subscribedConversations)});
+        }
+        sendEvent({'type': 'sync_unread'});
+        // Переотправка после обрыва: uid тот же, дубликата не будет
+        unconfirmedMessages.forEach((item, uid) => {
+            sendEvent({'type': 'message', 'conversation_id': item.conversationId, 'content': item.content, 'uid': uid});
+        });
     };
-    
-    statusSocket.onmessage = function(e) {
+
+    eventSocket.onmessage = function(e) {
         const data = JSON.parse(e.data);
         if (data.type === 'friend_status') {
             updateFriendStatus(data.user_id, data.status);
+        } else if (data.type === 'presence_snapshot') {
+            Object.entries(data.statuses).forEach(([userId, status]) => updateFriendStatus(userId, status));
+            clearInterval(statusHeartbeat);
+            statusHeartbeat = setInterval(() => sendEvent({'type': 'heartbeat'}), data.heartbeat_interval * 1000);
+        } else if (data.type === 'unread_counts') {
+            document.querySelectorAll('#chat-list li[data-conversation-id]').forEach(li => {
+                setUnreadBadge(li, data.counts[li.dataset.conversationId] || 0);
+            });
+        } else if (data.type === 'subscribed' || data.type === 'unsubscribed') {
+            (data.rejected || []).forEach(id => subscribedConversations.delete(id));
+        } else if (data.conversation_id === activeConversationId) {
+            handleChatEvent(data);
+        } else if (data.type === 'chat_message') {
+            updateConversationPreview(data);
         }
     };
-    
-    statusSocket.onerror = function(e) {
-        console.error('Status socket error:', e);
+
+    eventSocket.onerror = function(e) {
+        console.error('Event socket error:', e);
     };
-    
-    statusSocket.onclose = function(e) {
-        console.warn('Status socket closed. Reconnecting in 5s...');
-        setTimeout(initStatusSocket, 5000);
+
+    eventSocket.onclose = function(e) {
+        clearInterval(statusHeartbeat);
+        console.warn('Event socket closed. Reconnecting in 5s...');
+        setTimeout(initEventSocket, 5000);
     };
 }
 
-function initChatSocket(conversationId) {
-    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-        chatSocket.close();
-    }
-    chatSocket = new WebSocket(protocol + '//' + window.location.host + '/ws/chat/' + conversationId + '/');
-    
-    chatSocket.onopen = function(e) {
-        console.log('WebSocket connected to chat', conversationId);
-    };
-    
-    chatSocket.onmessage = function(e) {
-        console.log('WebSocket message received:', e.data);
-        const data = JSON.parse(e.data);
-        if (data.type === 'chat_message') {
-            addMessageToChat(data);
-        } else if (data.type === 'edit_message') {
-            editMessageInChat(data);
-        } else if (data.type === 'delete_message') {
-            deleteMessageFromChat(data);
-        } else if (data.type === 'pin_message') {
-            pinMessageInChat(data);
-        } else if (data.type === 'unpin_message') {
-            unpinMessageInChat();
+function subscribeConversations(conversationIds) {
+    const fresh = conversationIds.map(Number).filter(id => !subscribedConversations.has(id));
+    if (!fresh.length) return;
+    fresh.forEach(id => subscribedConversations.add(id));
+    // Если сокет ещё не открыт, подписка уйдёт в onopen
+    sendEvent({'type': 'subscribe', 'conversation_ids': fresh});
+}
+
+function openConversation(conversationId) {
+    activeConversationId = Number(conversationId);
+    subscribeConversations([activeConversationId]);
+}
+
+function handleChatEvent(data) {
+    if (data.type === 'chat_message') {
+        addMessageToChat(data);
+        if (data.id && data.sender_id === window.currentUserId) {
+            unconfirmedMessages.delete(data.uid);
+        } else if (data.id) {
+            sendReadReceipt(data.id);
         }
-    };
-    
-    chatSocket.onerror = function(e) {
-        console.error('WebSocket error:', e);
-    };
-    
-    chatSocket.onclose = function(e) {
-        console.error('Chat socket closed unexpectedly. Code:', e.code, 'Reason:', e.reason);
-        setTimeout(() => initChatSocket(conversationId), 5000);
-    };
+    } else if (data.type === 'message_saved') {
+        confirmMessages(data.messages);
+    } else if (data.type === 'message_failed') {
+        data.uids.forEach(uid => {
+            const msgDiv = document.getElementById('msg-' + uid);
+            if (msgDiv) msgDiv.classList.add('failed');
+        });
+    } else if (data.type === 'message_read') {
+        markMessagesSeen(data);
+    } else if (data.type === 'edit_message') {
+        editMessageInChat(data);
+    } else if (data.type === 'delete_message') {
+        deleteMessageFromChat(data);
+    } else if (data.type === 'pin_message') {
+        pinMessageInChat(data);
+    } else if (data.type === 'unpin_message') {
+        unpinMessageInChat();
+    }
+}
+
+// Новое сообщение в чате, который сейчас не открыт: счётчик и превью в списке
+function updateConversationPreview(data) {
+    const li = document.querySelector(`#chat-list li[data-conversation-id="${data.conversation_id}"]`);
+    if (!li) return;
+    const preview = li.querySelector('.last-message');
+    if (preview) preview.textContent = (data.content || 'Стикер').slice(0, 30);
+    if (data.sender_id !== window.currentUserId) {
+        const badge = li.querySelector('.unread-badge');
+        setUnreadBadge(li, (badge ? parseInt(badge.textContent, 10) : 0) + 1);
+    }
+    li.parentNode.prepend(li);
+}
+
+function setUnreadBadge(li, count) {
+    let badge = li.querySelector('.unread-badge');
+    if (!count) {
+        if (badge) badge.remove();
+        return;
+    }
+    if (!badge) {
+        badge = document.createElement('span');
+        badge.className = 'unread-badge';
+        li.querySelector('.conversation-info').after(badge);
+    }
+    badge.textContent = count;
 }
 
 function sendMessage(content) {
-    if (chatSocket && chatSocket.readyState === WebSocket.OPEN) {
-        const msg = {
-            'type': 'message',
-            'content': content
-        };
-        console.log('Sending message:', msg);
-        chatSocket.send(JSON.stringify(msg));
-    } else {
-        console.error('Chat socket not open. State:', chatSocket ? chatSocket.readyState : 'null');
+    const uid = crypto.randomUUID();
+    const msg = {
+        'type': 'message',
+        'conversation_id': activeConversationId,
+        'content': content,
+        'uid': uid
+    };
+    unconfirmedMessages.set(uid, {conversationId: activeConversationId, content: content});
+    if (!sendEvent(msg)) {
+        console.error('Event socket not open, message will be sent on reconnect');
     }
 }
 
+// Сообщение записано в БД: временный uid в DOM заменяется на id
+function confirmMessages(saved) {
+    let lastForeignId = 0;
+    saved.forEach(item => {
+        unconfirmedMessages.delete(item.uid);
+        const msgDiv = document.getElementById('msg-' + item.uid);
+        if (!msgDiv) return;
+        msgDiv.id = 'msg-' + item.id;
+        msgDiv.setAttribute('data-message-id', item.id);
+        msgDiv.classList.remove('failed');
+        if (parseInt(msgDiv.dataset.senderId, 10) !== window.currentUserId) {
+            lastForeignId = Math.max(lastForeignId, item.id);
+        }
+    });
+    if (lastForeignId) sendReadReceipt(lastForeignId);
+}
+
+function sendReadReceipt(messageId) {
+    sendEvent({'type': 'read', 'conversation_id': activeConversationId, 'message_id': messageId});
+}
+
+// Собеседник прочитал всё до message_id включительно
+function markMessagesSeen(data) {
+    if (data.user_id === window.currentUserId) return;
+    document.querySelectorAll('#message-list .message.own .message-status:not(.seen)').forEach(status => {
+        const messageId = parseInt(status.closest('.message').dataset.messageId, 10);
+        if (messageId <= data.message_id) {
+            status.classList.add('seen');
+            status.textContent = '✓✓';
+        }
+    });
+}
+
 function addMessageToChat(data) {
     console.log('Adding message to chat:', data);
     const messageList = document.getElementById('message-list');
@@ -84,15 +186,23 @@ function addMessageToChat(data) {
         return;
     }
 
-    if (document.getElementById('msg-' + data.id)) {
+    if ((data.id && document.getElementById('msg-' + data.id)) ||
+        (data.uid && document.getElementById('msg-' + data.uid))) {
         console.log('Message already exists, skipping');
         return;
     }
 
+    messageList.appendChild(buildMessageElement(data));
+    messageList.scrollTop = messageList.scrollHeight;
+    console.log('Message added, scrolling to bottom');
+}
+
+function buildMessageElement(data) {
     const messageDiv = document.createElement('div');
     messageDiv.className = `message ${data.sender_id === window.currentUserId ? 'own' : ''}`;
-    messageDiv.id = 'msg-' + data.id;
-    messageDiv.setAttribute('data-message-id', data.id);
+    // До записи в БД (отложенная запись) у сообщения есть только uid
+    messageDiv.id = 'msg-' + (data.id || data.uid);
+    if (data.id) messageDiv.setAttribute('data-message-id', data.id);
     messageDiv.setAttribute('data-sender-id', data.sender_id);
 
     const avatar = document.createElement('img');
@@ -126,6 +236,12 @@ function addMessageToChat(data) {
     } else {
         contentDiv.textContent = data.content;
     }
+    if (data.edited_at) {
+        const edited = document.createElement('span');
+        edited.className = 'edited';
+        edited.textContent = ' (изменено)';
+        contentDiv.appendChild(edited);
+    }
     bubble.appendChild(contentDiv);
 
     const timeSpan = document.createElement('span');
@@ -134,10 +250,47 @@ function addMessageToChat(data) {
     timeSpan.textContent = date.toLocaleTimeString([], {hour: '2-digit', minute:'2-digit'});
     bubble.appendChild(timeSpan);
 
+    if (data.sender_id === window.currentUserId) {
+        const statusSpan = document.createElement('span');
+        statusSpan.className = 'message-status';
+        statusSpan.textContent = '✓';
+        bubble.appendChild(statusSpan);
+    }
+
     messageDiv.appendChild(bubble);
-    messageList.appendChild(messageDiv);
-    messageList.scrollTop = messageList.scrollHeight;
-    console.log('Message added, scrolling to bottom');
+    return messageDiv;
+}
+
+// Подгрузка старых сообщений при прокрутке вверх (курсорная пагинация)
+function initHistoryLoader() {
+    const messageList = document.getElementById('message-list');
+    if (!messageList || !messageList.dataset.historyUrl) return;
+    let loading = false;
+
+    messageList.addEventListener('scroll', function() {
+        const cursor = messageList.dataset.historyCursor;
+        if (loading || !cursor || messageList.scrollTop > 100) return;
+        loading = true;
+        fetch(messageList.dataset.historyUrl + '?before=' + encodeURIComponent(cursor))
+            .then(response => {
+                if (!response.ok) throw new Error('History request failed');
+                return response.json();
+            })
+            .then(data => {
+                const previousHeight = messageList.scrollHeight;
+                const fragment = document.createDocumentFragment();
+                data.messages.forEach(msg => {
+                    if (!document.getElementById('msg-' + msg.id)) {
+                        fragment.appendChild(buildMessageElement(msg));
+                    }
+                });
+                messageList.insertBefore(fragment, messageList.firstChild);
+                messageList.scrollTop += messageList.scrollHeight - previousHeight;
+                messageList.dataset.historyCursor = data.next_cursor || '';
+            })
+            .catch(error => console.error('History error:', error))
+            .finally(() => { loading = false; });
+    });
 }
 
 function editMessageInChat(data) {